@@ -13,6 +13,10 @@ import numpy as np
 from rknn.api import RKNN
 import traceback
 from datetime import datetime
+from pathlib import Path
+
+# yolov5 代码目录: 反序列化训练权重所需的 models 包，以及 utils.onnx_graph
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'yolov5'))
 
 # 设置日志
 def setup_logging():
@@ -126,14 +130,48 @@ class YOLOv5ToRKNN:
             traceback.print_exc()
             return False
     
+    def export_runtime_onnx(self, model, onnx_path, out_path, nms=False, uint8_input=None, conf_thres=0.25,
+                            iou_thres=0.45, max_det=100):
+        """生成供ONNX Runtime部署的ONNX模型
+        nms: 在图末尾追加解码、置信度筛选和NonMaxSuppression，输出 (K,6) 检测结果
+        uint8_input: 'rgb'/'bgr'，输入改为uint8 NHWC原始像素，类型转换、通道顺序、归一化和布局转换在图中完成"""
+        self.logger.info(f"Exporting ONNX Runtime model: {out_path} (NMS: {nms}, uint8 input: {uint8_input})")
+        
+        try:
+            import onnx
+            from utils.onnx_graph import add_nms, add_uint8_input
+            
+            onnx_model = onnx.load(onnx_path)
+            if nms:
+                detect = model.model[-1]  # Detect()
+                onnx_model = add_nms(onnx_model, conf_thres, iou_thres, max_det,
+                                     anchors=detect.anchor_grid.view(detect.nl, -1, 2).numpy(),
+                                     strides=detect.stride.tolist())
+            if uint8_input:
+                onnx_model = add_uint8_input(onnx_model, uint8_input)
+            onnx.save(onnx_model, out_path)
+            
+            file_size = os.path.getsize(out_path) / (1024 * 1024)
+            self.logger.info(f"ONNX Runtime model export successful: {file_size:.1f} MB")
+            return True
+            
+        except Exception as e:
+            self.logger.error(f"ONNX Runtime model export failed: {e}")
+            traceback.print_exc()
+            return False
+    
     def convert_to_rknn(self, onnx_path, rknn_path, input_size_list=[[1,3,640,640]], quantize=False):
         """转换ONNX为RKNN格式"""
         self.logger.info(f"Converting ONNX to RKNN: {onnx_path} -> {rknn_path}")
         
         try:
             # RKNN配置
+            # mean/std 把 0-255 到 0-1 的归一化折叠进NPU模型，运行时直接输入uint8 NHWC RGB像素
+            # (RKNN-Toolkit2 的 config 没有通道重排选项，输入保持RGB顺序)
             self.logger.info("Configuring RKNN conversion parameters...")
             ret = self.rknn.config(
+                mean_values=[[0, 0, 0]],
+                std_values=[[255, 255, 255]],
                 target_platform='rk3588',
                 optimization_level=2,
                 output_optimize=1,
@@ -147,7 +185,8 @@ class YOLOv5ToRKNN:
             
             # 加载ONNX模型
             self.logger.info("Loading ONNX model...")
-            ret = self.rknn.load_onnx(model=onnx_path)
+            # ONNX导出使用动态batch，RKNN按固定输入尺寸构建
+            ret = self.rknn.load_onnx(model=onnx_path, inputs=['input'], input_size_list=input_size_list)
             if ret != 0:
                 raise RuntimeError("Failed to load ONNX model")
             
@@ -174,8 +213,9 @@ class YOLOv5ToRKNN:
             self.logger.info("Performing basic validation...")
             ret = self.rknn.init_runtime()
             if ret == 0:
-                # 创建测试输入
-                input_data = [np.random.randint(0, 256, input_size_list[0], dtype=np.uint8)]
+                # 创建测试输入 (uint8 NHWC)
+                n, c, h, w = input_size_list[0]
+                input_data = [np.random.randint(0, 256, (n, h, w, c), dtype=np.uint8)]
                 outputs = self.rknn.inference(inputs=input_data)
                 if outputs is not None:
                     self.logger.info(f"Validation passed - Output shapes: {[out.shape for out in outputs]}")
@@ -193,7 +233,8 @@ class YOLOv5ToRKNN:
         finally:
             self.rknn.release()
     
-    def convert_full_pipeline(self, pytorch_path, output_dir, input_size=(1, 3, 640, 640), quantize=False):
+    def convert_full_pipeline(self, pytorch_path, output_dir, input_size=(1, 3, 640, 640), quantize=False, nms=False,
+                              uint8_input=None):
         """完整的转换管道"""
         self.logger.info("="*60)
         self.logger.info("Starting YOLOv5 to RKNN conversion pipeline")
@@ -221,6 +262,12 @@ class YOLOv5ToRKNN:
             if not self.export_to_onnx(model, onnx_path, input_size):
                 raise RuntimeError("ONNX conversion failed")
             
+            # NPU不支持NonMaxSuppression，RKNN使用原始ONNX; 另存内置NMS/uint8输入的ONNX模型供CPU部署
+            runtime_path = os.path.join(output_dir, model_name + ('.nms' if nms else '') +
+                                        (f'.{uint8_input}' if uint8_input else '') + '.onnx')
+            if (nms or uint8_input) and not self.export_runtime_onnx(model, onnx_path, runtime_path, nms, uint8_input):
+                raise RuntimeError("ONNX Runtime model export failed")
+            
             # Step 3: 转换为RKNN
             self.logger.info("Step 3/3: Converting to RKNN...")
             if not self.convert_to_rknn(onnx_path, rknn_path, [list(input_size)], quantize):
@@ -232,6 +279,8 @@ class YOLOv5ToRKNN:
             self.logger.info("="*60)
             self.logger.info(f"✅ ONNX Model: {onnx_path}")
             self.logger.info(f"✅ RKNN Model: {rknn_path}")
+            if nms or uint8_input:
+                self.logger.info(f"✅ ONNX Runtime Model: {runtime_path}")
             
             if os.path.exists(onnx_path):
                 onnx_size = os.path.getsize(onnx_path) / (1024 * 1024)
@@ -244,7 +293,7 @@ class YOLOv5ToRKNN:
             self.logger.info("📋 Next Steps:")
             self.logger.info(f"   1. Copy {rknn_path} to RK3588")
             self.logger.info("   2. Use RKNN model for NPU inference")
-            self.logger.info("   3. Expected performance: 15-30 FPS on RK3588")
+            self.logger.info("   3. Measure performance on RK3588: python3 benchmark.py --out baseline.json")
             
             return True
             
@@ -266,6 +315,10 @@ def main():
                        help='Input image size (default: 640)')
     parser.add_argument('--quantize', action='store_true',
                        help='Enable quantization for smaller model size')
+    parser.add_argument('--nms', action='store_true',
+                       help='Also export <name>.nms.onnx with decode and NMS in the graph for ONNX Runtime')
+    parser.add_argument('--uint8-input', type=str, default=None, choices=['rgb', 'bgr'],
+                       help='Also export an ONNX model taking uint8 NHWC pixels in this channel order')
     parser.add_argument('--verbose', action='store_true',
                        help='Enable verbose logging')
     
@@ -287,7 +340,9 @@ def main():
         args.input, 
         args.output, 
         input_size, 
-        args.quantize
+        args.quantize,
+        args.nms,
+        args.uint8_input
     )
     
     if success:
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+ONNX模型静态INT8量化
+用训练集图像(LoadImagesAndLabels读取的路径列表)校准，ONNX Runtime按通道(per-channel)生成QDQ格式INT8模型，
+并在验证集上按 yolov5/test.py 的方法对比FP32和INT8模型的mAP和CPU推理延迟，输出JSON报告。
+量化后的模型可直接用于 rk3588/detect_onnx.py，作为NPU不可用时的CPU后备。
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+# yolov5 代码目录放在最前面: 其 test.py 会被标准库的 test 包遮蔽
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'yolov5'))
+
+import torch
+from test import match_predictions
+from utils.datasets import LoadImagesAndLabels
+from utils.general import ap_per_class, clip_coords, non_max_suppression, xywh2xyxy
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+STRIDES = (8, 16, 32)
+
+
+def load_anchors(cfg):
+    """从模型yaml读取anchors，形状 (nl, na, 2)，单位为输入像素"""
+    with open(cfg) as f:
+        anchors = yaml.load(f, Loader=yaml.FullLoader)['anchors']
+    return np.array(anchors, dtype=np.float32).reshape(len(anchors), -1, 2)
+
+
+class ONNXModel:
+    """ONNX Runtime推理会话，兼容导出的各种输入输出形式:
+    float NCHW 或 uint8 NHWC(--uint8-input) 输入; 原始检测头、已解码 (b,n,no) 或图内NMS(--nms)输出"""
+
+    def __init__(self, path, anchors, threads=0):
+        import onnxruntime as ort
+        so = ort.SessionOptions()
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        so.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(path), so, providers=['CPUExecutionProvider'])
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.uint8 = inp.type == 'tensor(uint8)'
+        self.channels = self.session.get_modelmeta().custom_metadata_map.get('input_format', 'rgb')
+        self.in_graph_nms = self.session.get_outputs()[0].name == 'detections'
+        self.anchors = anchors
+
+    def feed(self, img):
+        """img: LoadImagesAndLabels输出的 (3,h,w) uint8 RGB"""
+        if self.uint8:
+            x = img.transpose(1, 2, 0)[None]  # NHWC
+            return {self.input_name: np.ascontiguousarray(x[..., ::-1] if self.channels == 'bgr' else x)}
+        return {self.input_name: (img[None] / 255.0).astype(np.float32)}
+
+    def run(self, img):
+        return self.session.run(None, self.feed(img))
+
+    def decode(self, outputs):
+        """原始检测头 -> (b,n,no) xywh 输入像素，同 Detect.forward"""
+        if len(outputs) == 1 and outputs[0].ndim == 3:
+            return outputs[0]
+        heads = sorted(outputs, key=lambda x: -x.shape[2] * x.shape[3])  # 大特征图对应小stride
+        z = []
+        for x, stride, anchors in zip(heads, STRIDES, self.anchors):
+            b, na, ny, nx, no = x.shape
+            y = 1 / (1 + np.exp(-x))
+            xv, yv = np.meshgrid(np.arange(nx), np.arange(ny))
+            grid = np.stack((xv, yv), 2).reshape(1, 1, ny, nx, 2)
+            y[..., 0:2] = (y[..., 0:2] * 2 - 0.5 + grid) * stride
+            y[..., 2:4] = (y[..., 2:4] * 2) ** 2 * anchors.reshape(1, na, 1, 1, 2)
+            z.append(y.reshape(b, -1, no))
+        return np.concatenate(z, 1)
+
+    def detect(self, img, conf_thres, iou_thres):
+        """返回 (n,6) [x1, y1, x2, y2, conf, cls] torch张量(输入像素)，无检测时为None"""
+        outputs = self.run(img)
+        if self.in_graph_nms:  # 图内NMS使用导出时的阈值
+            det = outputs[0][outputs[0][:, 4] > conf_thres]
+            return torch.from_numpy(det.astype(np.float32)) if len(det) else None
+        pred = torch.from_numpy(self.decode(outputs).astype(np.float32))
+        return non_max_suppression(pred, conf_thres=conf_thres, iou_thres=iou_thres)[0]
+
+
+class CalibrationReader:
+    """ONNX Runtime校准数据: 训练集中均匀抽取的图像"""
+
+    def __init__(self, model, dataset, n):
+        self.model = model
+        self.dataset = dataset
+        indices = np.unique(np.linspace(0, len(dataset) - 1, min(n, len(dataset))).astype(int))
+        self.n = len(indices)
+        self.indices = iter(indices)
+
+    def get_next(self):
+        i = next(self.indices, None)
+        return None if i is None else self.model.feed(self.dataset[i][0].numpy())
+
+
+def quantize(fp32_path, int8_path, dataset, n, method='minmax'):
+    """预处理(形状推断+图优化)后做静态QDQ量化，权重per-channel INT8
+    图内追加的输入归一化(input/)和解码/NMS(nms/)节点保持FP32"""
+    import onnx
+    import onnx.version_converter
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    prep_path = str(Path(int8_path).with_suffix('.prep.onnx'))
+    model = onnx.load(str(fp32_path))
+    opset = next(o.version for o in model.opset_import if o.domain in ('', 'ai.onnx'))
+    if opset < 13:  # per-channel DequantizeLinear (axis) 需要 opset 13，导出脚本使用 opset 11/12
+        logger.info(f"Converting opset {opset} -> 13 for per-channel QDQ")
+        onnx.save(onnx.version_converter.convert_version(model, 13), prep_path)
+    else:
+        onnx.save(model, prep_path)
+    try:
+        quant_pre_process(prep_path, prep_path, skip_symbolic_shape=True)  # CNN静态形状，ONNX形状推断即可
+    except Exception as e:
+        logger.warning(f"Quantization pre-processing failed ({e}), quantizing without it")
+    model = onnx.load(prep_path)
+    exclude = [node.name for node in model.graph.node if node.name.startswith(('input/', 'nms/'))]
+
+    reader = CalibrationReader(ONNXModel(fp32_path, None), dataset, n)
+    logger.info(f"Calibrating on {reader.n} images with {method}")
+    t = time.time()
+    quantize_static(prep_path, str(int8_path), reader,
+                    quant_format=QuantFormat.QDQ,
+                    per_channel=True,
+                    activation_type=QuantType.QInt8,
+                    weight_type=QuantType.QInt8,
+                    calibrate_method={'minmax': CalibrationMethod.MinMax, 'entropy': CalibrationMethod.Entropy,
+                                      'percentile': CalibrationMethod.Percentile}[method],
+                    nodes_to_exclude=exclude)
+    os.remove(prep_path)
+    logger.info(f"INT8 model saved: {int8_path} ({time.time() - t:.0f}s)")
+
+
+def evaluate(model, dataset, conf_thres=0.001, iou_thres=0.65, max_images=None):
+    """按 yolov5/test.py 的方法计算 P、R、mAP@.5、mAP@.5:.95"""
+    iouv = torch.linspace(0.5, 0.95, 10)
+    stats = []
+    n = min(len(dataset), max_images or len(dataset))
+    for i in range(n):
+        img, targets, _, _ = dataset[i]
+        _, height, width = img.shape
+        whwh = torch.Tensor([width, height, width, height])
+        labels = targets[:, 1:]
+        tcls = labels[:, 0].tolist()
+        pred = model.detect(img.numpy(), conf_thres, iou_thres)
+        if pred is None:
+            if len(labels):
+                stats.append((torch.zeros(0, len(iouv), dtype=torch.bool), torch.Tensor(), torch.Tensor(), tcls))
+            continue
+        clip_coords(pred, (height, width))
+        correct = match_predictions(pred, labels[:, 0], xywh2xyxy(labels[:, 1:5]) * whwh, iouv)
+        stats.append((correct, pred[:, 4], pred[:, 5], tcls))
+
+    stats = [np.concatenate(x, 0) for x in zip(*stats)]
+    mp, mr, map50, map = 0., 0., 0., 0.
+    if len(stats) and stats[0].any():
+        p, r, ap, f1, ap_class = ap_per_class(*stats)
+        p, r, ap50, ap = p[:, 0], r[:, 0], ap[:, 0], ap.mean(1)
+        mp, mr, map50, map = p.mean(), r.mean(), ap50.mean(), ap.mean()
+    return {'images': n, 'precision': float(mp), 'recall': float(mr), 'mAP@.5': float(map50),
+            'mAP@.5:.95': float(map)}
+
+
+def latency(model, dataset, runs=50, warmup=5):
+    """单张图像推理延迟 (ms)，不含前后处理"""
+    feed = model.feed(dataset[0][0].numpy())
+    for _ in range(warmup):
+        model.session.run(None, feed)
+    dt = []
+    for _ in range(runs):
+        t = time.time()
+        model.session.run(None, feed)
+        dt.append((time.time() - t) * 1000)
+    return {'latency_ms': float(np.mean(dt)), 'latency_p95_ms': float(np.percentile(dt, 95))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Static INT8 quantization of a YOLOv5 ONNX model for the CPU')
+    parser.add_argument('--model', type=str, required=True, help='FP32 ONNX model')
+    parser.add_argument('--data', type=str, default=str(Path(__file__).resolve().parents[1] / 'yolov5' / 'data' /
+                                                        'fire_smoke.yaml'),
+                        help='dataset yaml: train images calibrate, val images evaluate')
+    parser.add_argument('--cfg', type=str, default=str(Path(__file__).resolve().parents[1] / 'yolov5' / 'models' /
+                                                       'yolov5s_fs.yaml'),
+                        help='model yaml with the anchors, to decode raw head outputs')
+    parser.add_argument('--output', type=str, default=None, help='INT8 model path (default <model>.int8.onnx)')
+    parser.add_argument('--img-size', type=int, default=640, help='model input size')
+    parser.add_argument('--calib-images', type=int, default=300, help='number of calibration images')
+    parser.add_argument('--calib-method', type=str, default='minmax', choices=['minmax', 'entropy', 'percentile'],
+                        help='activation range calibration')
+    parser.add_argument('--eval-images', type=int, default=None, help='evaluate on the first N val images')
+    parser.add_argument('--conf-thres', type=float, default=0.001, help='object confidence threshold')
+    parser.add_argument('--iou-thres', type=float, default=0.65, help='IOU threshold for NMS')
+    parser.add_argument('--runs', type=int, default=50, help='latency runs')
+    parser.add_argument('--threads', type=int, default=0, help='ONNX Runtime intra-op threads (0: all cores)')
+    parser.add_argument('--report', type=str, default=None, help='JSON report path (default <output>.json)')
+    parser.add_argument('--skip-quantize', action='store_true', help='only evaluate an existing --output model')
+    args = parser.parse_args()
+
+    output = args.output or str(Path(args.model).with_suffix('.int8.onnx'))
+    with open(args.data) as f:
+        data = yaml.load(f, Loader=yaml.FullLoader)
+    anchors = load_anchors(args.cfg)
+
+    if not args.skip_quantize:
+        train = LoadImagesAndLabels(data['train'], args.img_size, batch_size=1)
+        quantize(args.model, output, train, args.calib_images, args.calib_method)
+
+    val = LoadImagesAndLabels(data['val'], args.img_size, batch_size=1)
+    report = {'calibration': {'images': args.calib_images, 'method': args.calib_method, 'format': 'QDQ',
+                              'per_channel': True}}
+    for name, path in (('fp32', args.model), ('int8', output)):
+        logger.info(f"Evaluating {name}: {path}")
+        model = ONNXModel(path, anchors, args.threads)
+        report[name] = {'model': path, 'size_mb': os.path.getsize(path) / (1024 * 1024),
+                        **evaluate(model, val, args.conf_thres, args.iou_thres, args.eval_images),
+                        **latency(model, val, args.runs)}
+    report['speedup'] = report['fp32']['latency_ms'] / report['int8']['latency_ms']
+    report['mAP@.5_drop'] = report['fp32']['mAP@.5'] - report['int8']['mAP@.5']
+
+    print('\n%8s%12s%12s%12s%12s%12s%12s' % ('Model', 'Size(MB)', 'P', 'R', 'mAP@.5', 'mAP@.5:.95', 'Latency(ms)'))
+    for name in ('fp32', 'int8'):
+        r = report[name]
+        print('%8s%12.1f%12.3g%12.3g%12.3g%12.3g%12.1f' % (name, r['size_mb'], r['precision'], r['recall'],
+                                                           r['mAP@.5'], r['mAP@.5:.95'], r['latency_ms']))
+    print(f"INT8 speedup: {report['speedup']:.2f}x, mAP@.5 drop: {report['mAP@.5_drop']:.3f}")
+
+    report_path = args.report or str(Path(output).with_suffix('.json'))
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Report saved: {report_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+火灾烟雾检测性能基准测试
+在录制视频上回放各推理后端，记录各阶段延迟分位数(p50/p95/p99)、实际FPS、CPU占用、峰值内存和每帧检测数，
+结果写入JSON，可与基线JSON对比以发现性能回退。无NPU的机器上可用 --stub-npu 模拟RKNN推理。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import sys
+import time
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from smart_detect import find_models, load_backend
+from utils.backends import BACKENDS, CLIP
+from utils.npu_pool import FakeRuntime
+from utils.ort_session import PROFILES
+from utils.postprocess import postprocess_predictions
+
+STAGES = ('read', 'preprocess', 'infer', 'postprocess', 'total')
+# 对比基线的指标: (路径, 越大越好)
+METRICS = (('fps', True), ('stages.total.p95_ms', False), ('cpu_percent', False), ('peak_rss_mb', False))
+
+def percentiles(ms):
+    """延迟统计(毫秒)"""
+    ms = np.array(ms) if len(ms) else np.zeros(1)
+    return {'mean_ms': round(float(ms.mean()), 3), 'p50_ms': round(float(np.percentile(ms, 50)), 3),
+            'p95_ms': round(float(np.percentile(ms, 95)), 3), 'p99_ms': round(float(np.percentile(ms, 99)), 3)}
+
+def run_backend(name, weights, opt, profile=None):
+    """在当前进程中回放视频并测量一个后端，返回结果字典; profile为ONNX Runtime调优配置"""
+    kwargs = {'runtime': FakeRuntime(opt.stub_npu / 1000)} if name == 'rknn' and opt.stub_npu else {}
+    if name == 'onnx':
+        kwargs.update(profile=profile or 'latency', io_binding=opt.io_binding)
+    t = time.time()
+    backend = load_backend(name, weights, opt.conf, **kwargs)
+    if backend is None:
+        return None
+    load_ms = (time.time() - t) * 1000
+
+    cap = cv2.VideoCapture(opt.clip)
+    ret, frame = cap.read() if cap.isOpened() else (False, None)
+    if not ret:
+        cap.release()
+        backend.release()
+        raise RuntimeError(f"无法读取回放视频: {opt.clip}")
+    for _ in range(opt.warmup):  # 预热
+        backend.detect(frame)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    times = {s: [] for s in STAGES}
+    detections = []
+    usage0, t_start = resource.getrusage(resource.RUSAGE_SELF), time.time()
+    for _ in range(opt.repeat):
+        n = 0
+        while not opt.frames or n < opt.frames:
+            n += 1
+            t0 = time.time()
+            ret, frame = cap.read()
+            if not ret:
+                break
+            t1 = time.time()
+            x = backend.preprocess(frame)
+            t2 = time.time()
+            outputs = backend.forward(x)
+            t3 = time.time()
+            det = backend.decode(outputs, frame.shape)
+            t4 = time.time()
+            for s, dt in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t4 - t0)):
+                times[s].append(dt * 1000)
+            detections.append(len(det))
+        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    wall = time.time() - t_start
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cap.release()
+    backend.release()
+
+    cpu = usage.ru_utime + usage.ru_stime - usage0.ru_utime - usage0.ru_stime
+    detections = np.array(detections) if detections else np.zeros(1)
+    result = {'backend': name,
+              'weights': weights,
+              'stub': 'runtime' in kwargs,
+              'load_ms': round(load_ms, 1),  # 冷启动: 模型加载和运行时初始化
+              'frames': len(times['total']),
+              'wall_s': round(wall, 3),
+              'fps': round(len(times['total']) / wall, 2),
+              'cpu_percent': round(100 * cpu / wall, 1),  # 100% = 一个CPU核心
+              'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),  # Linux下单位为KB
+              'detections_per_frame': round(float(detections.mean()), 3),
+              'frames_with_detections': int((detections > 0).sum()),
+              'stages': {s: percentiles(times[s]) for s in STAGES}}
+    if name == 'onnx':
+        result['ort'] = dict(backend.session_info, options=PROFILES[backend.profile], io_binding=backend.io_binding)
+    return result
+
+def loop_postprocess(predictions, shape, conf_thres=0.4, nms_thres=0.5, input_size=(640, 640)):
+    """原ONNXFireDetector逐行循环后处理，作为 --postprocess 对比基准"""
+    boxes, scores, class_ids = [], [], []
+    h, w = shape[:2]
+    x_scale, y_scale = w / input_size[0], h / input_size[1]
+    for detection in predictions[0]:
+        confidence = detection[4]
+        if confidence > conf_thres:
+            x_center, y_center = detection[0] * x_scale, detection[1] * y_scale
+            width, height = detection[2] * x_scale, detection[3] * y_scale
+            class_scores = detection[5:]
+            class_id = np.argmax(class_scores)
+            final_score = confidence * class_scores[class_id]
+            if final_score > conf_thres:
+                boxes.append([int(x_center - width / 2), int(y_center - height / 2),
+                              int(x_center + width / 2), int(y_center + height / 2)])
+                scores.append(float(final_score))
+                class_ids.append(int(class_id))
+    if boxes:
+        indices = cv2.dnn.NMSBoxes(boxes, scores, conf_thres, nms_thres)
+        return [boxes[i] for i in np.array(indices).flatten()]
+    return []
+
+def synthetic_predictions(n=25200, nc=2, candidates=0.01, objects=5, input_size=(640, 640), seed=0):
+    """模拟YOLOv5 ONNX输出 (1,n,5+nc)：约candidates比例的行是围绕objects个目标抖动的高置信度框，其余为背景"""
+    rng = np.random.default_rng(seed)
+    pred = np.empty((1, n, 5 + nc), dtype=np.float32)
+    pred[0, :, 0] = rng.uniform(0, input_size[0], n)
+    pred[0, :, 1] = rng.uniform(0, input_size[1], n)
+    pred[0, :, 2:4] = rng.uniform(8, 200, (n, 2))
+    pred[0, :, 4] = rng.uniform(0, 0.05, n)
+    pred[0, :, 5:] = rng.random((n, nc))
+    rows = rng.random(n) < candidates
+    k = int(rows.sum())
+    centers = np.column_stack((rng.uniform(100, input_size[0] - 100, objects),
+                               rng.uniform(100, input_size[1] - 100, objects), rng.uniform(30, 150, (objects, 2))))
+    pred[0, rows, :4] = centers[rng.integers(0, objects, k)] * rng.normal(1, 0.05, (k, 4))
+    pred[0, rows, 4] = rng.uniform(0.3, 1.0, k)
+    return pred
+
+def run_postprocess(opt):
+    """对比逐行循环与NumPy向量化后处理的耗时"""
+    shape = (720, 1280, 3)
+    results = {}
+    for candidates in (0.001, 0.01, 0.05):
+        pred = synthetic_predictions(candidates=candidates)
+        row = {}
+        for name, fn in (('loop', lambda: loop_postprocess(pred, shape, opt.conf)),
+                         ('vectorized', lambda: postprocess_predictions(pred, (640, 640), shape, opt.conf))):
+            fn()  # 预热
+            ms = []
+            for _ in range(opt.frames or 50):
+                t = time.time()
+                n = len(fn())
+                ms.append((time.time() - t) * 1000)
+            row[name] = dict(percentiles(ms), detections=n)
+        row['speedup'] = round(row['loop']['mean_ms'] / row['vectorized']['mean_ms'], 1)
+        results[f'candidates_{candidates}'] = row
+        print(f"   候选比例 {candidates:.1%}: 循环 {row['loop']['mean_ms']:.2f}ms ({row['loop']['detections']}个) | "
+              f"向量化 {row['vectorized']['mean_ms']:.2f}ms ({row['vectorized']['detections']}个) | "
+              f"加速 {row['speedup']:.1f}x")
+    return results
+
+def _child(name, weights, opt, profile, results):
+    try:
+        run = run_backend(name, weights, opt, profile)
+        results.put((run, None) if run is not None else (None, '后端加载失败'))
+    except Exception as e:
+        results.put((None, str(e)))
+
+def run_isolated(name, weights, opt, profile=None):
+    """在独立子进程中测试一个后端，使峰值内存和CPU占用互不干扰
+    返回 (结果, 错误)，子进程异常退出(如原生库崩溃)或超过 opt.timeout 秒时结果为None"""
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    p = ctx.Process(target=_child, args=(name, weights, opt, profile, results))
+    p.start()
+    deadline = time.time() + opt.timeout if opt.timeout else None
+    result = None
+    while result is None:
+        try:
+            result = results.get(timeout=1)
+        except queue.Empty:
+            if not p.is_alive():
+                try:  # 结果可能在退出前刚写入
+                    result = results.get(timeout=1)
+                except queue.Empty:
+                    result = None, f"子进程异常退出 (exitcode {p.exitcode})"
+            elif deadline and time.time() > deadline:
+                p.terminate()
+                result = None, f"超时 ({opt.timeout:.0f}s)"
+    p.join()
+    return result
+
+def lookup(d, path):
+    for k in path.split('.'):
+        d = d[k]
+    return d
+
+def compare(results, baseline, tolerance=0.1):
+    """与基线对比，返回 [(后端, 指标, 基线值, 当前值, 相对变化, 是否回退)]"""
+    rows = []
+    for name, run in results['runs'].items():
+        base = baseline.get('runs', {}).get(name)
+        if base is None:
+            continue
+        for metric, higher_better in METRICS:
+            old, new = lookup(base, metric), lookup(run, metric)
+            change = (new - old) / old if old else 0.0
+            rows.append((name, metric, old, new, change, (-change if higher_better else change) > tolerance))
+        # 每帧检测数变化说明精度发生变化，双向都标记
+        old, new = base['detections_per_frame'], run['detections_per_frame']
+        change = (new - old) / old if old else float(new != old)
+        rows.append((name, 'detections_per_frame', old, new, change, abs(change) > tolerance))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='火灾烟雾检测性能基准测试')
+    parser.add_argument('--clip', type=str, default=str(CLIP), help='回放视频')
+    parser.add_argument('--frames', type=int, default=0, help='每轮测试帧数 (0=整个视频)')
+    parser.add_argument('--repeat', type=int, default=1, help='视频回放轮数')
+    parser.add_argument('--warmup', type=int, default=5, help='预热推理次数')
+    parser.add_argument('--conf', type=float, default=0.4, help='置信度阈值')
+    parser.add_argument('--timeout', type=float, default=600, help='每个后端的最长测试时间(秒)，超时记为失败 (0=不限)')
+    parser.add_argument('--backends', type=str, nargs='+', default=None, choices=list(BACKENDS), help='测试的后端')
+    parser.add_argument('--weights', type=str, nargs='+', default=[], metavar='BACKEND=PATH', help='指定模型路径')
+    parser.add_argument('--stub-npu', type=float, default=None, metavar='MS',
+                        help='用固定耗时的模拟运行时代替RKNN (无NPU的机器)')
+    parser.add_argument('--ort-profiles', type=str, nargs='+', default=['latency'], choices=list(PROFILES),
+                        help='ONNX后端测试的调优配置，多个配置分别记为 onnx:<配置>')
+    parser.add_argument('--io-binding', action='store_true', help='ONNX后端使用IOBinding预分配输入输出缓冲区')
+    parser.add_argument('--postprocess', action='store_true',
+                        help='只对比ONNX后处理的逐行循环与向量化实现 (模拟25200行输出)')
+    parser.add_argument('--out', type=str, default='benchmark.json', help='结果JSON')
+    parser.add_argument('--baseline', type=str, default=None, help='基线JSON，对比并报告回退')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='允许的相对变化 (0.1=10%%)')
+    opt = parser.parse_args()
+
+    if opt.postprocess:
+        print("⏱️  ONNX后处理对比 (1x25200x7, 原图1280x720)")
+        results = {'time': datetime.now().isoformat(timespec='seconds'), 'postprocess': run_postprocess(opt)}
+        with open(opt.out, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"💾 结果已保存: {opt.out}")
+        return 0
+
+    models = dict(find_models())
+    if opt.stub_npu and os.path.exists('./models/best_final_clean.rknn'):
+        models.setdefault('rknn', './models/best_final_clean.rknn')
+    models.update(w.split('=', 1) for w in opt.weights)
+    if opt.backends:
+        models = {k: v for k, v in models.items() if k in opt.backends}
+    if not models:
+        print("❌ 没有可测试的后端")
+        return 1
+    cap = cv2.VideoCapture(opt.clip)
+    ret = cap.isOpened() and cap.read()[0]
+    cap.release()
+    if not ret:
+        print(f"❌ 无法读取回放视频: {opt.clip}")
+        return 1
+
+    results = {'clip': opt.clip,
+               'time': datetime.now().isoformat(timespec='seconds'),
+               'host': {'machine': platform.machine(), 'python': platform.python_version(),
+                        'cpus': os.cpu_count(), 'opencv': cv2.__version__},
+               'runs': {}, 'failed': {}}
+    jobs = [(name, weights, None) for name, weights in models.items() if name != 'onnx']
+    if 'onnx' in models:
+        jobs += [('onnx', models['onnx'], p) for p in opt.ort_profiles]
+    for name, weights, profile in jobs:
+        key = f"{name}:{profile}" if profile and len(opt.ort_profiles) > 1 else name
+        print(f"⏱️  测试 {key}: {weights}{' (模拟NPU)' if name == 'rknn' and opt.stub_npu else ''}")
+        run, error = run_isolated(name, weights, opt, profile)
+        if run is None:
+            print(f"❌ {key} 测试失败: {error}")
+            results['failed'][key] = error
+            continue
+        results['runs'][key] = run
+        if 'ort' in run:
+            binding = ' | IOBinding' if run['ort']['io_binding'] else ''
+            print(f"   调优配置 {run['ort']['profile']} {run['ort']['options']}{binding} | "
+                  f"优化模型缓存 {run['ort']['cache']} | 加载 {run['load_ms']:.0f}ms")
+        total = run['stages']['total']
+        print(f"   {run['fps']:.1f} FPS | 延迟 p50 {total['p50_ms']:.1f}ms p95 {total['p95_ms']:.1f}ms "
+              f"p99 {total['p99_ms']:.1f}ms | CPU {run['cpu_percent']:.0f}% | 内存峰值 {run['peak_rss_mb']:.0f}MB | "
+              f"每帧检测 {run['detections_per_frame']:.2f}")
+        print('   ' + ' | '.join(f"{s} {run['stages'][s]['p95_ms']:.1f}ms" for s in STAGES[:-1]) + ' (p95)')
+
+    with open(opt.out, 'w') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"💾 结果已保存: {opt.out}")
+
+    if opt.baseline:
+        with open(opt.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, opt.tolerance)
+        print(f"\n📊 与基线对比: {opt.baseline}")
+        for name, metric, old, new, change, regressed in rows:
+            print(f"   {'❌' if regressed else '✅'} {name:8s} {metric:22s} {old:10.2f} -> {new:10.2f} ({change:+.1%})")
+        if any(r[-1] for r in rows):
+            print("❌ 发现性能回退")
+            return 1
+    if results['failed']:
+        print(f"❌ 测试失败的后端: {', '.join(results['failed'])}")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
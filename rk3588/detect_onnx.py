@@ -11,6 +11,11 @@ import argparse
 import os
 import sys
 
+from utils.buffers import FrameBufferPool
+from utils.pipeline import POLICIES, Pipeline, Stage
+from utils.ort_session import CACHE_DIR, PROFILES, IOBindingRunner, create_session
+from utils.postprocess import postprocess_predictions, scale_boxes
+
 def check_onnx_requirements():
     """检查ONNX运行环境"""
     try:
@@ -33,12 +38,20 @@ def check_onnx_requirements():
         return False
 
 class ONNXFireDetector:
-    def __init__(self, onnx_model_path, conf_threshold=0.4, nms_threshold=0.5):
+    def __init__(self, onnx_model_path, conf_threshold=0.4, nms_threshold=0.5, buffer_slots=8, profile='latency',
+                 cache_dir=CACHE_DIR, io_binding=False):
         self.onnx_model_path = onnx_model_path
+        self.profile = profile  # ONNX Runtime调优配置，见 utils/ort_session.py
+        self.cache_dir = cache_dir  # 优化后模型缓存目录，None=不缓存
+        self.io_binding = io_binding  # 输入输出绑定到预分配缓冲区，推理不再分配内存
+        self.runner = None
         self.conf_threshold = conf_threshold
         self.nms_threshold = nms_threshold
         self.session = None
+        self.in_graph_nms = False
+        self.channels = None  # uint8 NHWC输入模型的通道顺序 'rgb'/'bgr'
         self.input_size = (640, 640)
+        self.buffers = FrameBufferPool(self.input_size, buffer_slots)  # 预分配输入缓冲区
         self.class_names = ['fire', 'smoke']
         
         self.load_model()
@@ -46,22 +59,40 @@ class ONNXFireDetector:
     def load_model(self):
         """加载ONNX模型"""
         try:
-            import onnxruntime as ort
-            
             print(f"🔄 加载ONNX模型: {self.onnx_model_path}")
             
-            # 创建推理会话，优先使用CPU
-            providers = ['CPUExecutionProvider']
-            self.session = ort.InferenceSession(self.onnx_model_path, providers=providers)
+            # 按调优配置创建CPU推理会话，图优化结果缓存到磁盘
+            self.session, info = create_session(self.onnx_model_path, self.profile, cache_dir=self.cache_dir)
+            cache = {'hit': '命中', 'miss': '已生成'}.get(info['cache'], '未启用')
+            print(f"⚙️  调优配置: {self.profile} {PROFILES[self.profile]} | 优化模型缓存: {cache} | "
+                  f"加载耗时: {info['load_ms']:.0f}ms")
             
             # 获取输入输出信息
             self.input_name = self.session.get_inputs()[0].name
             self.output_names = [output.name for output in self.session.get_outputs()]
             
-            input_shape = self.session.get_inputs()[0].shape
+            inp = self.session.get_inputs()[0]
+            input_shape = inp.shape
+            if inp.type == 'tensor(uint8)':  # 导出时使用 --uint8-input，类型转换和归一化在图中完成
+                self.channels = self.session.get_modelmeta().custom_metadata_map.get('input_format', 'rgb')
+                h, w = input_shape[1:3]
+            else:
+                h, w = input_shape[2:4]
+            if isinstance(h, int) and isinstance(w, int) and (w, h) != self.input_size:
+                self.input_size = (w, h)
+                self.buffers = FrameBufferPool(self.input_size, self.buffers.slots)
             print(f"✅ ONNX模型加载成功")
             print(f"   输入: {self.input_name} {input_shape}")
             print(f"   输出: {len(self.output_names)}个")
+            if self.channels:
+                print(f"✅ 模型输入为uint8 NHWC {self.channels.upper()}，预处理只需缩放")
+            self.in_graph_nms = self.output_names[0] == 'detections'
+            if self.in_graph_nms:
+                print("✅ 模型内置解码和NMS，输出 (K,6) 检测结果")
+            
+            if self.io_binding:
+                self.runner = IOBindingRunner(self.session, self.buffers)
+                print(f"🔗 IOBinding: {self.buffers.slots} 组预分配输入输出缓冲区")
             
             return True
             
@@ -69,81 +100,38 @@ class ONNXFireDetector:
             print(f"❌ ONNX模型加载错误: {e}")
             return False
     
-    def preprocess(self, image):
-        """图像预处理"""
-        # 调整大小
-        input_image = cv2.resize(image, self.input_size)
-        # 颜色空间转换
-        input_image = cv2.cvtColor(input_image, cv2.COLOR_BGR2RGB)
-        # 归一化
-        input_image = input_image.astype(np.float32) / 255.0
-        # 添加batch维度并转换为NCHW格式
-        input_image = np.transpose(input_image, (2, 0, 1))  # HWC -> CHW
-        input_image = np.expand_dims(input_image, axis=0)   # CHW -> NCHW
-        
-        return input_image
+    def preprocess(self, image, slot=None):
+        """图像预处理: 缩放、BGR转RGB、归一化、HWC转NCHW，全部写入预分配缓冲区 (slot为acquire()取得的槽位)
+        uint8输入的模型只缩放(BGR模型不转换颜色)，其余步骤在图中完成"""
+        if self.channels is None:
+            return self.buffers.preprocess_nchw(image, slot)
+        x = self.buffers.preprocess_bgr(image, slot) if self.channels == 'bgr' else \
+            self.buffers.preprocess_nhwc(image, slot)
+        return x[None]
+    
+    def infer(self, input_image):
+        """推理; IOBinding模式下输出写入该输入槽位对应的预分配缓冲区，槽位复用前有效"""
+        if self.runner is not None:
+            return self.runner.run(input_image)
+        return self.session.run(self.output_names, {self.input_name: input_image})
     
     def postprocess(self, outputs, original_shape):
-        """后处理 - 标准YOLOv5格式"""
+        """后处理，返回 boxes, scores, class_ids 列表"""
+        det = self.postprocess_det(outputs, original_shape)
+        return det[:, :4].astype(int).tolist(), det[:, 4].tolist(), det[:, 5].astype(int).tolist()
+    
+    def postprocess_det(self, outputs, original_shape):
+        """后处理 - 标准YOLOv5格式 (1, 25200, 5+nc)，NumPy向量化筛选、解码和按类别NMS，返回 (N,6) [x1, y1, x2, y2, conf, cls]"""
         try:
-            # YOLOv5 ONNX输出通常是 (1, 25200, 85)
-            predictions = outputs[0]  # 获取第一个输出
-            
-            if len(predictions.shape) == 3:
-                predictions = predictions[0]  # 去掉batch维度: (25200, 85)
-            
-            boxes = []
-            scores = []
-            class_ids = []
-            
-            h, w = original_shape[:2]
-            x_scale = w / self.input_size[0]
-            y_scale = h / self.input_size[1]
-            
-            for detection in predictions:
-                # YOLOv5格式: [x_center, y_center, width, height, confidence, class1_score, class2_score, ...]
-                confidence = detection[4]
-                
-                if confidence > self.conf_threshold:
-                    # 提取边框坐标
-                    x_center = detection[0] * x_scale
-                    y_center = detection[1] * y_scale
-                    width = detection[2] * x_scale
-                    height = detection[3] * y_scale
-                    
-                    # 转换为左上角坐标
-                    x1 = int(x_center - width / 2)
-                    y1 = int(y_center - height / 2)
-                    x2 = int(x_center + width / 2)
-                    y2 = int(y_center + height / 2)
-                    
-                    # 获取类别分数
-                    class_scores = detection[5:]
-                    class_id = np.argmax(class_scores)
-                    class_score = class_scores[class_id]
-                    
-                    final_score = confidence * class_score
-                    
-                    if final_score > self.conf_threshold:
-                        boxes.append([x1, y1, x2, y2])
-                        scores.append(float(final_score))
-                        class_ids.append(int(class_id))
-            
-            # NMS去重
-            if len(boxes) > 0:
-                indices = cv2.dnn.NMSBoxes(boxes, scores, self.conf_threshold, self.nms_threshold)
-                
-                if len(indices) > 0:
-                    final_boxes = [boxes[i] for i in indices.flatten()]
-                    final_scores = [scores[i] for i in indices.flatten()]
-                    final_class_ids = [class_ids[i] for i in indices.flatten()]
-                    
-                    return final_boxes, final_scores, final_class_ids
-            
+            if self.in_graph_nms:  # 导出时已在图中完成解码和NMS，只需缩放到原图
+                det = outputs[0]
+                return scale_boxes(det[det[:, 4] > self.conf_threshold].astype(np.float32), self.input_size,
+                                   original_shape)
+            return postprocess_predictions(outputs[0], self.input_size, original_shape, self.conf_threshold,
+                                           self.nms_threshold)
         except Exception as e:
             print(f"后处理错误: {e}")
-        
-        return [], [], []
+            return np.zeros((0, 6), dtype=np.float32)
     
     def detect(self, image):
         """执行检测"""
@@ -155,7 +143,7 @@ class ONNXFireDetector:
             input_image = self.preprocess(image)
             
             # 推理
-            outputs = self.session.run(self.output_names, {self.input_name: input_image})
+            outputs = self.infer(input_image)
             
             # 后处理
             boxes, scores, class_ids = self.postprocess(outputs, image.shape)
@@ -181,6 +169,14 @@ def main():
     parser.add_argument('--weights', type=str, default='./models/best_final_clean.onnx', help='ONNX模型路径')
     parser.add_argument('--conf', type=float, default=0.4, help='置信度阈值')
     parser.add_argument('--nms', type=float, default=0.5, help='NMS阈值')
+    parser.add_argument('--ort-profile', type=str, default='latency', choices=list(PROFILES),
+                        help='ONNX Runtime调优配置 (latency=单路低延迟, throughput=多路/多进程吞吐)')
+    parser.add_argument('--ort-cache', type=str, default=str(CACHE_DIR), help='优化后模型缓存目录 (空字符串=不缓存)')
+    parser.add_argument('--io-binding', action='store_true',
+                        help='IOBinding推理: 输入输出使用预分配缓冲区，预处理下一帧与当前帧推理重叠')
+    parser.add_argument('--queue-size', type=int, default=2, help='流水线各阶段队列长度')
+    parser.add_argument('--queue-policy', type=str, default=None, choices=POLICIES,
+                        help='队列满时策略 (默认: RTSP丢弃最旧帧, 其他阻塞)')
     
     args = parser.parse_args()
     
@@ -190,7 +186,12 @@ def main():
         return
     
     # 创建检测器
-    detector = ONNXFireDetector(args.weights, args.conf, args.nms)
+    # 缓冲区数量需大于预处理到推理之间的在途帧数: 队列 + 正在预处理和推理的帧
+    # IOBinding模式下输出也在槽位中，需覆盖到后处理完成: 两个队列 + 正在预处理、推理和后处理的帧
+    # 每帧从空闲列表取槽位，用完或帧被丢弃后归还，丢弃最旧帧策略下也不会覆盖使用中的槽位
+    slots = 2 * args.queue_size + 3 if args.io_binding else args.queue_size + 3
+    detector = ONNXFireDetector(args.weights, args.conf, args.nms, buffer_slots=slots, profile=args.ort_profile,
+                                cache_dir=args.ort_cache or None, io_binding=args.io_binding)
     
     if detector.session is None:
         print("❌ 模型加载失败")
@@ -222,64 +223,106 @@ def main():
     total_time = 0
     detection_count = 0
     
-    try:
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("❌ 读取视频帧失败")
-                break
-            
-            frame_count += 1
-            
-            # 检测
-            start_time = time.time()
-            boxes, scores, class_ids = detector.detect(frame)
-            detect_time = time.time() - start_time
-            total_time += detect_time
-            
-            detection_count += len(boxes)
-            
-            # 绘制检测结果
-            for i, (box, score, class_id) in enumerate(zip(boxes, scores, class_ids)):
-                x1, y1, x2, y2 = box
-                label = f"{detector.class_names[class_id]}: {score:.2f}"
-                
-                # 颜色设置
-                color = (0, 255, 0) if class_id == 0 else (0, 0, 255)  # 绿色=火灾，红色=烟雾
-                
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                cv2.putText(frame, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-            
-            # 显示FPS和性能信息
-            if frame_count > 0:
-                avg_fps = frame_count / total_time
-                current_fps = 1.0 / detect_time if detect_time > 0 else 0
-                fps_text = f"CPU FPS: {current_fps:.1f} | Avg: {avg_fps:.1f} | Inference: {detect_time*1000:.0f}ms"
-            else:
-                fps_text = "CPU FPS: 计算中..."
-            
-            cv2.putText(frame, fps_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+    def capture():
+        ret, frame = cap.read()
+        if not ret:
+            print("❌ 读取视频帧失败")
+            return None
+        return {'frame': frame}
+    
+    def preprocess(item):
+        # 等待空闲槽位，流水线停止时退出
+        slot = None
+        while slot is None:
+            if pipeline.stop_event.is_set():
+                raise StopIteration
+            slot = detector.buffers.acquire(timeout=0.1)
+        item['slot'] = slot
+        item['input'] = detector.preprocess(item['frame'], slot)
+        return item
+    
+    def release(item):
+        # 槽位用完或帧被队列丢弃时归还
+        slot = item.pop('slot', None)
+        if slot is not None:
+            detector.buffers.release(slot)
+    
+    def infer(item):
+        start_time = time.time()
+        item['outputs'] = detector.infer(item['input'])
+        item['detect_time'] = time.time() - start_time
+        if detector.runner is None:
+            release(item)  # IOBinding的输出也在槽位中，需等后处理完成
+        return item
+    
+    def postprocess(item):
+        item['boxes'], item['scores'], item['class_ids'] = detector.postprocess(item['outputs'], item['frame'].shape)
+        release(item)
+        return item
+    
+    def sink(item):
+        nonlocal frame_count, total_time, detection_count
+        frame, boxes, detect_time = item['frame'], item['boxes'], item['detect_time']
+        frame_count += 1
+        total_time += detect_time
+        detection_count += len(boxes)
+        
+        # 绘制检测结果
+        for i, (box, score, class_id) in enumerate(zip(boxes, item['scores'], item['class_ids'])):
+            x1, y1, x2, y2 = box
+            label = f"{detector.class_names[class_id]}: {score:.2f}"
             
-            # 显示检测统计
-            stats_text = f"Detections: {len(boxes)} | Total: {detection_count}"
-            cv2.putText(frame, stats_text, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+            # 颜色设置
+            color = (0, 255, 0) if class_id == 0 else (0, 0, 255)  # 绿色=火灾，红色=烟雾
             
-            # 显示图像
-            cv2.imshow('ONNX Fire Detection (CPU)', frame)
+            cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+            cv2.putText(frame, label, (x1, y1-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+        
+        # 显示FPS和性能信息
+        if frame_count > 0:
+            avg_fps = frame_count / total_time
+            current_fps = 1.0 / detect_time if detect_time > 0 else 0
+            fps_text = f"CPU FPS: {current_fps:.1f} | Avg: {avg_fps:.1f} | Inference: {detect_time*1000:.0f}ms"
+        else:
+            fps_text = "CPU FPS: 计算中..."
+        
+        cv2.putText(frame, fps_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+        
+        # 显示检测统计
+        stats_text = f"Detections: {len(boxes)} | Total: {detection_count}"
+        cv2.putText(frame, stats_text, (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+        
+        # 显示图像
+        cv2.imshow('ONNX Fire Detection (CPU)', frame)
+        
+        # 按'q'退出
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            raise StopIteration
             
-            # 按'q'退出
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
-                
-            # 每30帧显示统计信息
-            if frame_count % 30 == 0:
-                avg_fps = frame_count / total_time
-                print(f"📊 已处理 {frame_count} 帧，平均FPS: {avg_fps:.1f}，检测到 {detection_count} 个目标")
+        # 每30帧显示统计信息
+        if frame_count % 30 == 0:
+            avg_fps = frame_count / total_time
+            print(f"📊 已处理 {frame_count} 帧，平均FPS: {avg_fps:.1f}，检测到 {detection_count} 个目标")
+            print(f"⏱️  各阶段: {pipeline.report()}")
+    
+    # 采集 -> 预处理 -> 推理 -> 后处理 -> 显示，各阶段独立线程，有界队列连接
+    policy = args.queue_policy or ('drop_oldest' if str(source).startswith('rtsp://') else 'block')
+    pipeline = Pipeline([
+        Stage('capture', capture),
+        Stage('preprocess', preprocess),
+        Stage('infer', infer),
+        Stage('postprocess', postprocess),
+        Stage('sink', sink),
+    ], args.queue_size, policy, on_drop=release)
+    
+    try:
+        pipeline.run()
     
     except KeyboardInterrupt:
         print("\n⏹️  检测中断")
     
     finally:
+        pipeline.stop()
         cap.release()
         cv2.destroyAllWindows()
         
@@ -290,6 +333,7 @@ def main():
             print(f"   平均FPS: {avg_fps:.1f}")
             print(f"   检测到目标: {detection_count} 个")
             print(f"   总耗时: {total_time:.1f}秒")
+            print(f"   各阶段: {pipeline.report()}")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -14,8 +14,23 @@ import sys
 import platform
 from rknn.api import RKNN
 import threading
+import queue
+import json
+from collections import deque
 from datetime import datetime
 
+from utils.buffers import FrameBufferPool
+from utils.motion import MotionGate
+from utils.npu_pool import NPU_CORE_0_1_2, FrameSequencer, NPUPool, raw_output_qparams, split_core_mask
+from utils.pipeline import POLICIES, LatencyController, Pipeline, Stage
+from utils.postprocess import decode_outputs, non_max_suppression, scale_boxes
+from utils.preview import PreviewServer, PreviewSink
+from utils.recorder import EventRecorder
+from utils.sinks import (DisplaySink, EventLogSink, FrameResult, RecorderSink, SinkGroup, SnapshotSink,
+                         VideoSink)
+from utils.streams import CameraStream, LatestFrameGrabber, is_live, load_sources, open_capture
+from utils.tracker import IoUTracker
+
 def check_rk3588_environment():
     """检查RK3588运行环境"""
     print("🔍 检查RK3588环境...")
@@ -70,13 +85,23 @@ def check_rk3588_environment():
     return True
 
 class RKNNFireDetector:
-    def __init__(self, rknn_model_path, conf_threshold=0.4, nms_threshold=0.5):
+    def __init__(self, rknn_model_path, conf_threshold=0.4, nms_threshold=0.5, core_mask=NPU_CORE_0_1_2):
         self.rknn_model_path = rknn_model_path
         self.conf_threshold = conf_threshold
         self.nms_threshold = nms_threshold
-        self.rknn = RKNN()
+        self.core_mask = core_mask
+        self.output_qparams = None  # 运行时返回原始int8输出时的 (zero_point, scale)，每个输出头一组，加载时自动获取
+        self.infer_kwargs = {}
+        self.rknn = RKNN()  # 第一个核心的上下文，也用于单帧detect()
+        self.contexts = []
+        self.pool = None
+        self.motion_gate = None  # MotionGate，设置后跳过静止画面的推理
+        self.tracker = None  # IoUTracker，跳过推理的帧由跟踪器外推
+        self.detect_interval = 1
         self.model_loaded = False
         self.input_size = (640, 640)
+        self.buffers = FrameBufferPool(self.input_size)  # 预分配输入缓冲区
+        self._stop = threading.Event()  # 流水线停止事件，等待空闲缓冲区时检查
         
         # 类别名称（根据您的模型调整）
         self.class_names = ['fire', 'smoke']  # 火灾和烟雾
@@ -97,34 +122,50 @@ class RKNNFireDetector:
             file_size = os.path.getsize(self.rknn_model_path) / (1024*1024)
             print(f"📊 模型文件大小: {file_size:.1f} MB")
             
-            # 加载RKNN模型
-            ret = self.rknn.load_rknn(self.rknn_model_path)
-            if ret != 0:
-                print('❌ 加载RKNN模型失败')
-                print('💡 提示: 请检查模型文件是否完整或兼容')
-                return False
+            # 每个NPU核心一个运行时上下文
+            for core in split_core_mask(self.core_mask):
+                rknn = self.rknn if not self.contexts else RKNN()
+                
+                # 加载RKNN模型
+                ret = rknn.load_rknn(self.rknn_model_path)
+                if ret != 0:
+                    print('❌ 加载RKNN模型失败')
+                    print('💡 提示: 请检查模型文件是否完整或兼容')
+                    return False
             
-            # 初始化运行时环境 - 明确指定RK3588 NPU目标
-            print("🎯 初始化RK3588 NPU运行时...")
-            ret = self.rknn.init_runtime(target='rk3588', device_id=0)
-            if ret != 0:
-                print('❌ 初始化运行时环境失败')
-                print('💡 可能原因:')
-                print('   1. 不是在RK3588设备上运行')
-                print('   2. RKNN运行时库未正确安装') 
-                print('   3. NPU驱动未正确加载')
-                print('   4. 模型与运行时版本不匹配')
+                # 初始化运行时环境 - 明确指定RK3588 NPU目标
+                print(f"🎯 初始化RK3588 NPU运行时 (core_mask={core})...")
+                ret = rknn.init_runtime(target='rk3588', device_id=0, core_mask=core)
+                if ret != 0:
+                    print('❌ 初始化运行时环境失败')
+                    print('💡 可能原因:')
+                    print('   1. 不是在RK3588设备上运行')
+                    print('   2. RKNN运行时库未正确安装') 
+                    print('   3. NPU驱动未正确加载')
+                    print('   4. 模型与运行时版本不匹配')
                 
-                # 尝试获取更多错误信息
-                try:
-                    # 不调用get_sdk_version，因为需要先init_runtime
-                    print('📋 RKNN环境信息:')
-                    print('   已加载模型但运行时初始化失败')
-                    print('   建议检查NPU驱动和设备权限')
-                except:
-                    print('   无法获取详细错误信息')
+                    # 尝试获取更多错误信息
+                    try:
+                        # 不调用get_sdk_version，因为需要先init_runtime
+                        print('📋 RKNN环境信息:')
+                        print('   已加载模型但运行时初始化失败')
+                        print('   建议检查NPU驱动和设备权限')
+                    except:
+                        print('   无法获取详细错误信息')
                 
-                return False
+                    return False
+                
+                self.contexts.append(rknn)
+            
+            # 运行时支持时直接取int8输出，量化参数来自运行时，后处理在int8域比较阈值
+            self.output_qparams = raw_output_qparams(self.rknn)
+            if self.output_qparams is not None:
+                self.infer_kwargs = {'want_float': False}
+                print(f"🔢 int8输出，量化参数 (zero_point, scale): {self.output_qparams}")
+            
+            # 多核推理池: 轮询分发，按帧序号返回结果
+            self.pool = NPUPool(self.contexts, want_float=self.output_qparams is None)
+            print(f"⚡ NPU推理池: {len(self.contexts)} 个核心上下文")
             
             # 获取模型信息
             try:
@@ -151,170 +192,37 @@ class RKNNFireDetector:
             print(f"❌ 模型加载错误: {e}")
             return False
     
-    def preprocess(self, image):
-        """图像预处理"""
-        # 调整大小
-        input_image = cv2.resize(image, self.input_size)
-        # 颜色空间转换
-        input_image = cv2.cvtColor(input_image, cv2.COLOR_BGR2RGB)
-        return input_image
+    def preprocess(self, image, slot=None):
+        """图像预处理: 缩放+BGR转RGB，写入预分配缓冲区 (slot为acquire()取得的槽位，None时轮转使用)"""
+        return self.buffers.preprocess_nhwc(image, slot)
     
     def postprocess(self, outputs, original_shape):
-        """后处理，解析RKNN输出 - 简化直接版本"""
+        """后处理，返回 boxes, scores, class_ids 列表"""
+        det = self.postprocess_det(outputs, original_shape)
+        return det[:, :4].astype(int).tolist(), det[:, 4].tolist(), det[:, 5].astype(int).tolist()
+    
+    def postprocess_det(self, outputs, original_shape):
+        """后处理，向量化解码YOLOv5三个输出头 (stride 8/16/32)，返回 (N,6) [x1, y1, x2, y2, conf, cls]"""
         try:
             # 调试输出格式信息
             if not hasattr(self, '_first_run'):
                 print(f"🔍 模型输出格式:")
-                print(f"   形状: {outputs[0].shape}")
-                print(f"   数据类型: {outputs[0].dtype}")
+                for out in outputs:
+                    print(f"   形状: {out.shape} 数据类型: {out.dtype}")
                 self._first_run = True
             
-            # YOLOv5输出格式: (1, 85, 20, 20) 
-            feature_map = outputs[0]  # (1, 85, 20, 20)
-            
-            # 移除batch维度
-            if len(feature_map.shape) == 4:
-                feature_map = feature_map[0]  # (85, 20, 20)
+            # 解码 -> (N,6) [x1, y1, x2, y2, conf, cls]
+            # 量化输出在int8域比较阈值，只反量化候选单元
+            det = decode_outputs(outputs, self.input_size, self.conf_threshold, qparams=self.output_qparams)
+            det = non_max_suppression(det, self.nms_threshold)
+            return scale_boxes(det, self.input_size, original_shape)
             
-            boxes = []
-            scores = []
-            class_ids = []
-            
-            h, w = original_shape[:2]
-            grid_h, grid_w = feature_map.shape[1], feature_map.shape[2]  # 20, 20
-            
-            # 简化方法：直接扫描可能的置信度通道
-            # 通常在YOLOv5中，每个anchor的置信度在特定位置
-            confidence_channels = [4, 9, 14]  # 假设3个anchor，每个占5+num_classes个通道
-            
-            for ch_idx, conf_channel in enumerate(confidence_channels):
-                if conf_channel >= feature_map.shape[0]:
-                    continue
-                    
-                # 获取置信度图
-                conf_map = feature_map[conf_channel]  # (20, 20)
-                
-                # 应用sigmoid激活
-                conf_map_sigmoid = 1.0 / (1.0 + np.exp(-conf_map))
-                
-                # 找到高置信度位置
-                high_conf_mask = conf_map_sigmoid > self.conf_threshold
-                high_conf_positions = np.where(high_conf_mask)
-                
-                print(f"   通道{conf_channel}: 找到{len(high_conf_positions[0])}个高置信度位置")
-                
-                for gy, gx in zip(high_conf_positions[0], high_conf_positions[1]):
-                    confidence = float(conf_map_sigmoid[gy, gx])
-                    
-                    # 获取对应的坐标信息（如果存在）
-                    base_ch = ch_idx * (5 + 2)  # 假设每个anchor: x,y,w,h,conf,class1,class2
-                    
-                    try:
-                        # 计算边框位置（简化版）
-                        stride = 640 // grid_w  # 32
-                        
-                        # 从特征图获取预测坐标
-                        if base_ch + 3 < feature_map.shape[0]:
-                            pred_x = feature_map[base_ch + 0, gy, gx]
-                            pred_y = feature_map[base_ch + 1, gy, gx] 
-                            pred_w = feature_map[base_ch + 2, gy, gx]
-                            pred_h = feature_map[base_ch + 3, gy, gx]
-                            
-                            # 简单的坐标解码
-                            center_x = (gx + 0.5) * stride
-                            center_y = (gy + 0.5) * stride
-                            
-                            # 使用固定大小或基于预测的大小
-                            box_w = min(stride * 3, w * 0.1)  # 限制最大大小
-                            box_h = min(stride * 3, h * 0.1)
-                            
-                        else:
-                            # 如果没有坐标信息，使用网格中心和固定大小
-                            stride = 640 // grid_w  # 32
-                            center_x = (gx + 0.5) * stride
-                            center_y = (gy + 0.5) * stride
-                            box_w = stride * 2
-                            box_h = stride * 2
-                        
-                        # 转换到原图尺寸
-                        center_x = center_x * w / 640
-                        center_y = center_y * h / 640
-                        box_w = box_w * w / 640
-                        box_h = box_h * h / 640
-                        
-                        # 计算边框
-                        x1 = int(max(0, center_x - box_w/2))
-                        y1 = int(max(0, center_y - box_h/2))
-                        x2 = int(min(w, center_x + box_w/2))
-                        y2 = int(min(h, center_y + box_h/2))
-                        
-                        if x2 > x1 and y2 > y1:
-                            boxes.append([x1, y1, x2, y2])
-                            scores.append(confidence)
-                            
-                            # 简单的类别分配
-                            class_id = ch_idx % 2  # 0=fire, 1=smoke
-                            class_ids.append(class_id)
-                            
-                    except Exception as coord_e:
-                        print(f"   坐标解码错误: {coord_e}")
-                        continue
-            
-            # 输出检测统计
-            if len(boxes) > 0:
-                print(f"   原始检测: {len(boxes)}个目标")
-                
-                # 简单NMS
-                try:
-                    indices = cv2.dnn.NMSBoxes(boxes, scores, self.conf_threshold, 0.4)
-                    
-                    if len(indices) > 0:
-                        final_boxes = [boxes[i] for i in indices.flatten()]
-                        final_scores = [scores[i] for i in indices.flatten()]
-                        final_class_ids = [class_ids[i] for i in indices.flatten()]
-                        
-                        print(f"   NMS后保留: {len(final_boxes)}个目标")
-                        return final_boxes, final_scores, final_class_ids
-                    
-                except Exception as nms_e:
-                    print(f"   NMS错误: {nms_e}, 返回原始结果")
-                    return boxes[:5], scores[:5], class_ids[:5]  # 限制返回数量
-            else:
-                print(f"   未检测到目标 (阈值={self.conf_threshold})")
-                
-        except Exception as e:
-            print(f"后处理错误: {e}")
-            import traceback
-            traceback.print_exc()
-        
-            # 输出检测统计
-            if len(boxes) > 0:
-                print(f"   原始检测: {len(boxes)}个目标")
-                
-                # 简单NMS
-                try:
-                    indices = cv2.dnn.NMSBoxes(boxes, scores, self.conf_threshold, 0.4)
-                    
-                    if len(indices) > 0:
-                        final_boxes = [boxes[i] for i in indices.flatten()]
-                        final_scores = [scores[i] for i in indices.flatten()]
-                        final_class_ids = [class_ids[i] for i in indices.flatten()]
-                        
-                        print(f"   NMS后保留: {len(final_boxes)}个目标")
-                        return final_boxes, final_scores, final_class_ids
-                    
-                except Exception as nms_e:
-                    print(f"   NMS错误: {nms_e}, 返回原始结果")
-                    return boxes[:5], scores[:5], class_ids[:5]  # 限制返回数量
-            else:
-                print(f"   未检测到目标 (阈值={self.conf_threshold})")
-                
         except Exception as e:
             print(f"后处理错误: {e}")
             import traceback
             traceback.print_exc()
         
-        return [], [], []
+        return np.zeros((0, 6), dtype=np.float32)
     
     def detect(self, image):
         """执行检测"""
@@ -326,7 +234,7 @@ class RKNNFireDetector:
             input_image = self.preprocess(image)
             
             # 推理 - 指定数据格式避免警告
-            outputs = self.rknn.inference(inputs=[input_image], data_format='nhwc')
+            outputs = self.rknn.inference(inputs=[input_image], data_format='nhwc', **self.infer_kwargs)
             
             # 后处理
             boxes, scores, class_ids = self.postprocess(outputs, image.shape)
@@ -337,8 +245,75 @@ class RKNNFireDetector:
             print(f"检测错误: {e}")
             return [], [], []
     
-    def draw_results(self, image, boxes, scores, class_ids):
-        """绘制检测结果"""
+    def schedule_stage(self, item):
+        """流水线调度阶段: 每detect_interval帧推理一次，画面无变化时也跳过推理"""
+        keyframe = self._frame_index % self.detect_interval == 0
+        self._frame_index += 1
+        if self.motion_gate is not None:
+            item['still'] = not self.motion_gate(item['frame'])  # 每帧都更新背景
+            keyframe = keyframe and not item['still']
+        item['skip'] = not keyframe
+        return item
+    
+    def preprocess_stage(self, item):
+        """流水线预处理阶段"""
+        if not item.get('skip'):
+            item['slot'] = self._acquire_slot()
+            item['input'] = self.preprocess(item['frame'], item['slot'])
+        return item
+    
+    def _acquire_slot(self):
+        """等待空闲的输入缓冲区槽位 (推理完成或丢帧时释放)，流水线停止时退出"""
+        while True:
+            slot = self.buffers.acquire(timeout=0.1)
+            if slot is not None:
+                return slot
+            if self._stop.is_set():
+                raise StopIteration
+    
+    def _release_slot(self, item):
+        """推理完成或帧被队列丢弃时归还输入缓冲区槽位"""
+        slot = item.pop('slot', None)
+        if slot is not None:
+            self.buffers.release(slot)
+    
+    def infer_stage(self, item):
+        """流水线推理阶段: 提交到多核推理池，按帧顺序输出 (跳过推理的帧也保持顺序，且不等待推理池填满)"""
+        return self._ready(self._sequencer.push(item, None if item.get('skip') else item['input']))
+    
+    def flush_infer_stage(self):
+        """视频结束时取回推理池中剩余的帧"""
+        return self._ready(self._sequencer.flush())
+    
+    def _ready(self, ready):
+        for item, result in ready:
+            if result is not None:
+                item['outputs'], item['infer_time'] = result
+            self._release_slot(item)
+        return [item for item, _ in ready]
+    
+    def postprocess_stage(self, item):
+        """流水线后处理阶段，跳过推理的帧由跟踪器外推 (画面静止时保持不动)，未开启跟踪时沿用上一次的检测结果"""
+        if item.get('skip'):
+            if self.tracker is None:
+                item['boxes'], item['scores'], item['class_ids'] = self._last_results
+                return item
+            det = self.tracker.predict(still=item.get('still', False))
+        else:
+            det = np.zeros((0, 6), dtype=np.float32) if item['outputs'] is None else \
+                self.postprocess_det(item['outputs'], item['frame'].shape)
+            if self.tracker is not None:
+                det = self.tracker.update(det)
+        
+        item['boxes'] = det[:, :4].astype(int).tolist()
+        item['scores'], item['class_ids'] = det[:, 4].tolist(), det[:, 5].astype(int).tolist()
+        if self.tracker is not None:
+            item['track_ids'] = det[:, 6].astype(int).tolist()
+        self._last_results = item['boxes'], item['scores'], item['class_ids']
+        return item
+    
+    def draw_results(self, image, boxes, scores, class_ids, track_ids=None):
+        """绘制检测结果，track_ids不为空时在标签中显示跟踪ID"""
         for i, (box, score, class_id) in enumerate(zip(boxes, scores, class_ids)):
             x1, y1, x2, y2 = box
             
@@ -350,110 +325,304 @@ class RKNNFireDetector:
             
             # 绘制标签
             label = f"{self.class_names[class_id]}: {score:.2f}"
+            if track_ids:
+                label = f"{self.class_names[class_id]} #{track_ids[i]}: {score:.2f}"
             (text_width, text_height), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)
             cv2.rectangle(image, (x1, y1 - text_height - 10), (x1 + text_width, y1), color, -1)
             cv2.putText(image, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
         
         return image
     
-    def run_detection(self, source, save_video=False, show_display=True):
-        """运行检测循环"""
-        # 打开视频源
-        if source == '0' or source == 0:
-            cap = cv2.VideoCapture(0)
-        elif source.startswith('rtsp://'):
-            cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG)
-            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-        else:
-            cap = cv2.VideoCapture(source)
-        
-        if not cap.isOpened():
-            print(f"❌ 无法打开视频源: {source}")
+    def annotate(self, result):
+        """绘制FrameResult的检测框和信息文字，仅在有输出需要画面时调用"""
+        image = self.draw_results(result.frame, result.boxes, result.scores, result.class_ids, result.track_ids)
+        for i, text in enumerate(result.info):
+            cv2.putText(image, text, (10, 30 + 40 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        return image
+    
+    def make_sinks(self, show_display=False, video_path=None, video_fps=20.0, event_dir=None, pre_event=5.0,
+                   post_event=10.0, snapshot_dir=None, event_log=None, preview=None, name='fire', event_quality=0):
+        """创建输出: 显示窗口、连续录像、事件录像、检测截图、事件日志、HTTP预览，无需画面的输出不触发绘制
+        event_quality: 事件录像缓存的JPEG质量，0表示缓存原始帧 (不编码，占用更多内存)
+        """
+        sinks = SinkGroup()
+        if show_display:
+            sinks.add(DisplaySink('RK3588 NPU Fire Detection' + (f' {name}' if name != 'fire' else '')))
+        if video_path:
+            sinks.add(VideoSink(video_path, video_fps))
+            print(f"💾 保存视频到: {video_path}")
+        if event_dir:
+            # 事件录像: 内存中保留最近pre_event秒的原始帧和检测框，仅在检测到火焰/烟雾时绘制、编码并写盘
+            sinks.add(RecorderSink(EventRecorder(event_dir, pre_event, post_event, video_fps, event_quality,
+                                                 name=name)))
+            print(f"🎬 事件录像: 事件前 {pre_event}s + 事件后 {post_event}s -> {event_dir}/")
+        if snapshot_dir:
+            sinks.add(SnapshotSink(snapshot_dir))
+        if event_log:
+            sinks.add(EventLogSink(self.class_names, event_log))
+        if preview is not None:
+            # HTTP预览: 仅在有浏览器连接时按预览帧率编码，所有连接共享同一份JPEG
+            sinks.add(PreviewSink(preview, name))
+            print(f"🌐 HTTP预览: http://<设备IP>:{preview.port}/stream/{name}")
+        return sinks
+    
+    def run_detection(self, source, save_video=False, show_display=True, queue_size=2, policy=None,
+                      motion_threshold=None, keyframe_interval=10.0, detect_interval=1, track=False, latency_slo=None,
+                      capture_pipeline=None, loop=False, event_dir=None, pre_event=5.0, post_event=10.0,
+                      snapshot_dir=None, event_log=None, preview=None, event_quality=0):
+        """运行检测流水线，policy为None时RTSP丢弃最旧帧、文件阻塞等待
+        motion_threshold: 画面变化像素比例低于此值时跳过推理，沿用上次结果；每keyframe_interval秒强制推理一次
+        detect_interval: 每N帧推理一次，中间帧由IoU跟踪器外推检测框 (N>1时自动开启跟踪)
+        latency_slo: 采集到结果的p95延迟目标(毫秒)，超出时自动跳帧；为None时RTSP默认1000ms，其他输入源不跳帧
+        capture_pipeline: 自定义GStreamer管道或FFmpeg采集参数
+        loop: 循环播放视频文件，模拟实时视频流
+        event_dir: 事件录像目录，检测到目标时保存前pre_event秒到最后一次检测后post_event秒的片段
+        event_quality: 事件录像缓存的JPEG质量，0表示缓存原始帧
+        snapshot_dir: 检测截图目录; event_log: 检测事件JSON日志文件; preview: PreviewServer，MJPEG预览
+        """
+        if self.pool is None:
+            print("❌ 模型未加载，无法运行检测")
             return
         
-        # 获取视频信息
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        
-        print(f"📹 视频源信息: {width}x{height} @ {fps:.2f}FPS")
+        # 打开视频源: 网络流/自定义管道/循环文件由后台线程只保留最新帧，断流后自动重连，无需重启进程
+        cap = grabber = None
+        if is_live(source) and not str(source).isdigit() or capture_pipeline or loop:
+            grabber = LatestFrameGrabber(source, capture_pipeline, loop).start()
+            if not grabber.wait(timeout=30):
+                print(f"❌ 无法打开视频源: {source}")
+                grabber.stop()
+                return
+            height, width = grabber.frame.shape[:2]
+            print(f"📹 视频源信息: {width}x{height} (最新帧采集, 断流自动重连)")
+        else:
+            cap = open_capture(source)
+            if not cap.isOpened():
+                print(f"❌ 无法打开视频源: {source}")
+                return
+            
+            # 获取视频信息
+            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            print(f"📹 视频源信息: {width}x{height} @ {fps:.2f}FPS")
         print("🚀 NPU加速推理启动...")
         
-        # 视频保存设置
-        out = None
-        if save_video:
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            out_filename = f"rknn_fire_detection_{timestamp}.mp4"
-            out = cv2.VideoWriter(out_filename, fourcc, 20.0, (width, height))
-            print(f"💾 保存视频到: {out_filename}")
+        # 输出设置，无头模式且无需保存时不绘制任何画面
+        video_path = f"rknn_fire_detection_{datetime.now().strftime('%Y%m%d_%H%M%S')}.mp4" if save_video else None
+        sinks = self.make_sinks(show_display, video_path, 20.0, event_dir, pre_event, post_event, snapshot_dir, event_log,
+                                preview, event_quality=event_quality)
         
         # FPS计算
         fps_counter = 0
         start_time = time.time()
         detection_count = 0
+        fps_text = "NPU FPS: -"
         
-        try:
-            while True:
+        # 延迟控制: 根据采集到结果的延迟动态跳帧，保证告警实时性
+        if latency_slo is None and str(source).startswith('rtsp://'):
+            latency_slo = 1000
+        controller = LatencyController(latency_slo / 1000) if latency_slo else None
+        
+        def capture():
+            if grabber is not None:
+                frame, t0 = grabber.read(timeout=0.5)  # 等待新帧，超时则返回空列表以便检查停止信号
+                if frame is None:
+                    return None if grabber.ended else []
+            else:
                 ret, frame = cap.read()
                 if not ret:
-                    break
-                
-                fps_counter += 1
+                    return None
+                t0 = time.time()
+            if controller is None:
+                return {'frame': frame, 't0': t0}
+            if not controller.admit():
+                return []  # 照常读帧避免缓冲堆积，但不送入流水线
+            return {'frame': frame, 't0': t0, 'seq': controller.admitted}  # 调整前送入的帧不计入下一窗口
+        
+        def sink(item):
+            nonlocal fps_counter, start_time, detection_count, fps_text
+            boxes = item['boxes']
+            detect_time = time.time() - item['t0']  # 采集到结果的延迟
+            fps_counter += 1
+            if controller is not None:
+                controller.observe(detect_time, item['seq'])
+            
+            if len(boxes) > 0:
+                detection_count += len(boxes)
                 
-                # 执行检测
-                detect_start = time.time()
-                boxes, scores, class_ids = self.detect(frame)
-                detect_time = time.time() - detect_start
+                # 打印检测信息
+                timestamp = datetime.now().strftime("%H:%M:%S")
+                print(f"🔥 [{timestamp}] NPU检测到 {len(boxes)} 个目标 (推理时间: {detect_time*1000:.1f}ms)")
+            
+            # 计算并显示FPS
+            elapsed = time.time() - start_time
+            if elapsed > 1.0:
+                current_fps = fps_counter / elapsed
+                fps_counter = 0
+                start_time = time.time()
                 
-                # 绘制结果
+                # 画面上显示的性能信息
+                fps_text = f"NPU FPS: {current_fps:.1f} | Inference: {detect_time*1000:.1f}ms"
+                if controller is not None and controller.adjustments:
+                    print(f"🎯 延迟控制: {controller.report()}")
+            
+            # 各输出按需绘制，同一帧最多绘制一次
+            sinks.write(FrameResult(item['frame'], boxes, item['scores'], item['class_ids'], item.get('track_ids'),
+                                    item['t0'], info=(fps_text, f"Detections: {detection_count}"),
+                                    annotate=self.annotate))
+        
+        # 采集 -> 预处理 -> 多核NPU推理 -> 后处理 -> 输出，各阶段独立线程，有界队列连接
+        if policy is None:
+            policy = 'drop_oldest' if str(source).startswith('rtsp://') else 'block'
+        
+        # 每帧从空闲列表取缓冲区槽位，推理完成或被丢弃后归还，丢弃最旧帧策略下也不会覆盖推理中的输入
+        # 槽位数覆盖预处理到推理之间的在途帧数: 队列 + 推理池 + 正在处理的帧，不足时预处理等待
+        self.buffers = FrameBufferPool(self.input_size, queue_size + 2 * len(self.pool) + 3)
+        self._sequencer = FrameSequencer(self.pool)  # 每个核心保持两帧在途
+        self._last_results = [], [], []
+        self.motion_gate = MotionGate(motion_threshold, keyframe_interval) if motion_threshold else None
+        self.detect_interval = max(detect_interval, 1)
+        # 跟踪框最多外推detect_interval帧，更长的推理间隔 (如运动检测跳过推理时) 保持不动
+        self.tracker = IoUTracker(max_coast=self.detect_interval) if track or self.detect_interval > 1 else None
+        self._frame_index = 0
+        stages = [Stage('capture', capture)]
+        if self.motion_gate is not None or self.detect_interval > 1:
+            stages.append(Stage('schedule', self.schedule_stage))
+        pipeline = Pipeline(stages + [
+            Stage('preprocess', self.preprocess_stage),
+            Stage('infer', self.infer_stage, self.flush_infer_stage),
+            Stage('postprocess', self.postprocess_stage),
+            Stage('sink', sink),
+        ], queue_size, policy, on_drop=self._release_slot)
+        self._stop = pipeline.stop_event
+        print(f"🔀 流水线队列: {queue_size} 帧/阶段, 策略: {policy}")
+        
+        try:
+            pipeline.run()
+        
+        except KeyboardInterrupt:
+            print("\n⏹️  检测停止")
+        
+        finally:
+            if grabber is not None:
+                grabber.stop()
+                print(f"🔌 视频流: 采集 {grabber.seq} 帧, 丢弃旧帧 {grabber.dropped}, 重连 {grabber.reconnects} 次")
+            pipeline.stop()
+            if cap is not None:
+                cap.release()
+            sinks.close()
+            
+            print(f"🖌️  绘制画面: {sinks.annotated}/{sinks.frames} 帧 ({len(sinks)} 个输出)")
+            print(f"⏱️  各阶段: {pipeline.report()}")
+            if self.motion_gate is not None:
+                print(f"💤 运动检测跳过推理: {self.motion_gate.skipped}/{self.motion_gate.frames} 帧")
+            if controller is not None:
+                print(f"🎯 延迟控制: {json.dumps(controller.stats())}")
+            print(f"📊 检测完成，共检测到 {detection_count} 个目标")
+    
+    def run_multi_camera(self, sources, fps_budget=(5.0,), save_video=False, max_inflight=2,
+                         motion_threshold=None, keyframe_interval=10.0, event_dir=None, pre_event=5.0, post_event=10.0,
+                         snapshot_dir=None, event_log=None, preview=None, capture_pipeline=None, loop=False,
+                         event_quality=0):
+        """单进程多路摄像头检测，所有摄像头共享同一组NPU核心上下文，断流后自动重连"""
+        if self.pool is None:
+            print("❌ 模型未加载，无法运行检测")
+            return
+        
+        cameras = [CameraStream(i, s, fps_budget[i] if len(fps_budget) > 1 else fps_budget[0], max_inflight,
+                                capture_pipeline, loop) for i, s in enumerate(sources)]
+        # 每路摄像头独立的输入缓冲区，在途帧数不超过max_inflight
+        buffers = {cam.index: FrameBufferPool(self.input_size, max_inflight + 1) for cam in cameras}
+        # 每路摄像头独立的运动检测，静止画面不占用NPU
+        gates = {cam.index: MotionGate(motion_threshold, keyframe_interval) for cam in cameras} \
+            if motion_threshold else {}
+        # 每路摄像头独立的输出 (录像、事件录像、截图、事件日志)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        sinks = {cam.index: self.make_sinks(False, f"rknn_fire_detection_cam{cam.index}_{timestamp}.mp4" if save_video
+                                            else None, cam.fps_budget, event_dir, pre_event, post_event, snapshot_dir,
+                                            event_log, preview, name=f'cam{cam.index}', event_quality=event_quality)
+                 for cam in cameras}
+        
+        # 每路摄像头按采集顺序排队的帧，推理完成或被运动检测跳过后依次输出
+        ordered = {cam.index: deque() for cam in cameras}
+        last_results = {cam.index: ([], [], []) for cam in cameras}  # 跳过推理的帧沿用上次结果
+        
+        def submit(cam, frame):
+            # 在各摄像头采集线程中预处理并提交到共享推理池，静止画面不推理直接排队
+            item = {'frame': frame, 't0': time.time(), 'done': False}
+            if cam.index in gates and not gates[cam.index](frame):
+                item['done'] = True
+                ordered[cam.index].append(item)
+                return
+            ordered[cam.index].append(item)
+            self.pool.submit(buffers[cam.index].preprocess_nhwc(frame), item)
+        
+        def emit(cam, item):
+            cam.done()  # 输出后才释放在途名额，每路排队帧数不超过max_inflight
+            frame, t0 = item['frame'], item['t0']
+            if 'outputs' not in item:
+                boxes, scores, class_ids = last_results[cam.index]
+            else:
+                outputs = item['outputs']
+                boxes, scores, class_ids = self.postprocess(outputs, frame.shape) if outputs is not None \
+                    else ([], [], [])
+                last_results[cam.index] = boxes, scores, class_ids
                 if len(boxes) > 0:
-                    frame = self.draw_results(frame, boxes, scores, class_ids)
-                    detection_count += len(boxes)
-                    
-                    # 打印检测信息
+                    cam.detections += len(boxes)
                     timestamp = datetime.now().strftime("%H:%M:%S")
-                    print(f"🔥 [{timestamp}] NPU检测到 {len(boxes)} 个目标 (推理时间: {detect_time*1000:.1f}ms)")
-                
-                # 计算并显示FPS
-                elapsed = time.time() - start_time
-                if elapsed > 1.0:
-                    current_fps = fps_counter / elapsed
-                    fps_counter = 0
-                    start_time = time.time()
-                    
-                    # 在画面上显示性能信息
-                    fps_text = f"NPU FPS: {current_fps:.1f} | Inference: {detect_time*1000:.1f}ms"
-                    cv2.putText(frame, fps_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                
-                detection_info = f"Detections: {detection_count}"
-                cv2.putText(frame, detection_info, (10, 70), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                
-                # 保存视频帧
-                if save_video and out:
-                    out.write(frame)
+                    print(f"🔥 [{timestamp}] 摄像头{cam.index} NPU检测到 {len(boxes)} 个目标 "
+                          f"(延迟: {(time.time() - t0)*1000:.1f}ms)")
+            
+            # 各输出按需绘制，同一帧最多绘制一次
+            sinks[cam.index].write(FrameResult(frame, boxes, scores, class_ids, t0=t0, name=f'cam{cam.index}',
+                                               annotate=self.annotate))
+        
+        print(f"📹 多路摄像头模式: {len(cameras)} 路, 共享 {len(self.pool)} 个NPU核心上下文")
+        cameras = [cam for cam in cameras if cam.start(submit)]
+        print("🚀 NPU加速推理启动...")
+        
+        last_report, last_submitted = time.time(), [0] * len(sources)
+        try:
+            while any(cam.running for cam in cameras) or self.pool.pending or any(ordered.values()):
+                try:
+                    _, item, outputs, _ = self.pool.get(timeout=0.05)
+                    item['outputs'], item['done'] = outputs, True
+                except queue.Empty:
+                    pass
+                for cam in cameras:
+                    pending = ordered[cam.index]
+                    while pending and pending[0]['done']:
+                        emit(cam, pending.popleft())
                 
-                # 显示图像
-                if show_display:
-                    cv2.imshow('RK3588 NPU Fire Detection', frame)
-                    key = cv2.waitKey(1) & 0xFF
-                    if key == ord('q') or key == 27:
-                        break
+                # 每10秒输出各路实际推理帧率
+                elapsed = time.time() - last_report
+                if elapsed > 10:
+                    rates = []
+                    for c in cameras:
+                        submitted = c.submitted - (gates[c.index].skipped if c.index in gates else 0)
+                        rates.append(f"cam{c.index} {(submitted - last_submitted[c.index]) / elapsed:.1f}")
+                        last_submitted[c.index] = submitted
+                    print(f"📊 推理FPS: {' | '.join(rates)}")
+                    last_report = time.time()
         
         except KeyboardInterrupt:
             print("\n⏹️  检测停止")
         
         finally:
-            cap.release()
-            if out:
-                out.release()
-            if show_display:
-                cv2.destroyAllWindows()
+            for cam in cameras:
+                cam.stop()
+            for group in sinks.values():
+                group.close()
             
-            print(f"📊 检测完成，共检测到 {detection_count} 个目标")
+            for cam in cameras:
+                skipped = gates[cam.index].skipped if cam.index in gates else 0
+                print(f"📊 摄像头{cam.index}: 读取 {cam.frames} 帧, 推理 {cam.submitted - skipped} 帧, "
+                      f"运动检测跳过 {skipped} 帧, 重连 {cam.grabber.reconnects} 次, 检测到 {cam.detections} 个目标")
     
     def __del__(self):
-        if hasattr(self, 'rknn'):
+        if getattr(self, 'pool', None) is not None:
+            self.pool.close()  # 同时释放所有核心上下文
+        elif hasattr(self, 'rknn'):
             self.rknn.release()
 
 def main():
@@ -466,11 +635,40 @@ def main():
         return
     
     parser = argparse.ArgumentParser(description='RK3588 NPU火灾烟雾检测')
-    parser.add_argument('--source', type=str, default='0', help='输入源')
+    parser.add_argument('--source', type=str, default='0', help='输入源，*.txt为多路摄像头列表(每行一个)')
     parser.add_argument('--weights', type=str, default='./models/best_final_clean.rknn', help='RKNN模型路径')
     parser.add_argument('--conf', type=float, default=0.4, help='置信度阈值')
     parser.add_argument('--nms', type=float, default=0.5, help='NMS阈值')
-    parser.add_argument('--save-vid', action='store_true', help='保存检测视频')
+    parser.add_argument('--core-mask', type=lambda x: int(x, 0), default=NPU_CORE_0_1_2,
+                        help='NPU核心掩码 (1=核心0, 2=核心1, 4=核心2, 7=全部三核)')
+    parser.add_argument('--queue-size', type=int, default=2, help='流水线各阶段队列长度')
+    parser.add_argument('--queue-policy', type=str, default=None, choices=POLICIES,
+                        help='队列满时策略 (默认: RTSP丢弃最旧帧, 其他阻塞)')
+    parser.add_argument('--fps-budget', type=float, nargs='+', default=[5.0],
+                        help='多路模式下每路摄像头的推理帧率上限，一个值或每路一个')
+    parser.add_argument('--motion-thres', type=float, default=None,
+                        help='运动检测阈值(变化像素比例，如0.005)，低于此值跳过推理并沿用上次结果，默认关闭')
+    parser.add_argument('--keyframe-interval', type=float, default=10.0, help='运动检测开启时强制推理的间隔(秒)')
+    parser.add_argument('--capture-pipeline', type=str, default=None,
+                        help="自定义采集管道: GStreamer管道(含'!', {source}替换为输入源)或FFmpeg参数如 'rtsp_transport;tcp'")
+    parser.add_argument('--loop', action='store_true', help='循环播放视频文件，模拟实时视频流(测试断流重连)')
+    parser.add_argument('--latency-slo', type=float, default=None,
+                        help='采集到结果的p95延迟目标(ms)，超出时自动跳帧 (默认: RTSP 1000ms, 其他不跳帧)')
+    parser.add_argument('--detect-interval', type=int, default=1,
+                        help='每N帧执行一次NPU推理，中间帧由跟踪器外推 (N>1时自动开启跟踪)')
+    parser.add_argument('--track', action='store_true', help='开启IoU目标跟踪，显示跟踪ID')
+    parser.add_argument('--save-vid', action='store_true', help='保存检测视频(连续录像)')
+    parser.add_argument('--record-events', action='store_true', help='仅在检测到目标时保存事件片段')
+    parser.add_argument('--event-dir', type=str, default='events', help='事件录像目录')
+    parser.add_argument('--snapshot-dir', type=str, default=None, help='保存检测截图的目录 (每5秒最多一张)')
+    parser.add_argument('--event-log', type=str, default=None, help='检测事件JSON日志文件 (每行一个事件)')
+    parser.add_argument('--preview-port', type=int, default=None, help='MJPEG HTTP预览端口，如8080 (默认关闭)')
+    parser.add_argument('--preview-fps', type=float, default=5.0, help='HTTP预览帧率')
+    parser.add_argument('--preview-width', type=int, default=640, help='HTTP预览画面宽度')
+    parser.add_argument('--pre-event', type=float, default=5.0, help='事件录像包含事件前的秒数')
+    parser.add_argument('--post-event', type=float, default=10.0, help='事件录像包含最后一次检测后的秒数')
+    parser.add_argument('--event-jpeg-quality', type=int, default=0,
+                        help='事件录像缓存帧的JPEG质量 (1-100)，默认0缓存原始帧，不做持续编码但占用更多内存')
     parser.add_argument('--no-display', action='store_true', help='不显示检测窗口')
     
     args = parser.parse_args()
@@ -487,17 +685,53 @@ def main():
     print(f"   RKNN模型: {args.weights}")
     print(f"   输入源: {args.source}")
     print(f"   置信度阈值: {args.conf}")
+    print(f"   NPU核心掩码: {args.core_mask}")
     print("-" * 50)
     
     # 创建检测器
-    detector = RKNNFireDetector(args.weights, args.conf, args.nms)
-    
-    # 运行检测
-    detector.run_detection(
-        source=args.source,
-        save_video=args.save_vid,
-        show_display=not args.no_display
-    )
+    detector = RKNNFireDetector(args.weights, args.conf, args.nms, args.core_mask)
+    
+    event_dir = args.event_dir if args.record_events else None
+    preview = PreviewServer(args.preview_port, fps=args.preview_fps, width=args.preview_width).start() \
+        if args.preview_port else None
+    if preview is not None:
+        print(f"🌐 HTTP预览服务已启动: http://<设备IP>:{args.preview_port}/")
+    
+    # 多路摄像头: 单进程共享NPU上下文
+    sources = load_sources(args.source)
+    if len(sources) > 1:
+        detector.run_multi_camera(sources, args.fps_budget, args.save_vid,
+                                  motion_threshold=args.motion_thres, keyframe_interval=args.keyframe_interval,
+                                  event_dir=event_dir, pre_event=args.pre_event, post_event=args.post_event,
+                                  snapshot_dir=args.snapshot_dir, event_log=args.event_log, preview=preview,
+                                  capture_pipeline=args.capture_pipeline, loop=args.loop,
+                                  event_quality=args.event_jpeg_quality)
+    else:
+        # 运行检测
+        detector.run_detection(
+            source=args.source,
+            save_video=args.save_vid,
+            show_display=not args.no_display,
+            queue_size=args.queue_size,
+            policy=args.queue_policy,
+            motion_threshold=args.motion_thres,
+            keyframe_interval=args.keyframe_interval,
+            detect_interval=args.detect_interval,
+            track=args.track,
+            latency_slo=args.latency_slo,
+            capture_pipeline=args.capture_pipeline,
+            loop=args.loop,
+            event_dir=event_dir,
+            pre_event=args.pre_event,
+            post_event=args.post_event,
+            snapshot_dir=args.snapshot_dir,
+            event_log=args.event_log,
+            preview=preview,
+            event_quality=args.event_jpeg_quality
+        )
+    
+    if preview is not None:
+        preview.stop()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
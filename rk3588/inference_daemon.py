@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+火灾烟雾检测推理守护进程
+常驻进程只加载一次模型，通过Unix域套接字为多个采集进程提供检测服务，帧通过共享内存传递不经套接字复制。
+采集进程重启只需毫秒级重连，无需重新加载模型和初始化NPU。
+"""
+
+import argparse
+import signal
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from smart_detect import find_models, load_backend
+from utils.backends import BACKENDS, SUFFIXES
+from utils.daemon import DaemonServer
+
+def main():
+    parser = argparse.ArgumentParser(description='火灾烟雾检测推理守护进程')
+    parser.add_argument('--socket', type=str, default='/tmp/fire-detect.sock', help='Unix套接字路径')
+    parser.add_argument('--backend', type=str, default=None, choices=list(BACKENDS), help='推理后端 (默认第一个可用模型)')
+    parser.add_argument('--weights', type=str, default=None, help='模型路径')
+    parser.add_argument('--conf', type=float, default=0.4, help='置信度阈值')
+    args = parser.parse_args()
+    
+    # 选择模型
+    if args.weights:
+        models = [(args.backend or SUFFIXES.get(Path(args.weights).suffix, 'onnx'), args.weights)]
+    else:
+        models = [m for m in find_models() if args.backend in (None, m[0])]
+    if not models:
+        print("❌ 未找到可用模型")
+        return 1
+    name, weights = models[0]
+    
+    t = time.time()
+    backend = load_backend(name, weights, args.conf)
+    if backend is None:
+        return 1
+    backend.detect(np.zeros((480, 640, 3), dtype=np.uint8))  # 预热
+    print(f"✅ 模型已加载: {name} - {weights} ({time.time() - t:.1f}s)")
+    
+    server = DaemonServer(backend, args.socket)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"🚀 推理服务已启动: {args.socket}")
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        print("\n⏹️  推理服务停止")
+    finally:
+        server.server_close()
+        backend.release()
+        print(f"📊 共处理 {server.requests} 个请求")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
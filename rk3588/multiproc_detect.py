@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+多进程火灾烟雾检测
+每路视频源由独立的采集进程直接解码到共享内存帧环(utils/shm_ring.py)，多个推理进程零拷贝读取各路最新帧。
+解码、预处理和后处理分布在多个CPU核心上，不受单进程GIL限制，帧也不经过pickle复制。
+--batch > 1 时推理进程把多路的最新帧合成一个batch，一次推理(需要动态batch或对应batch导出的ONNX模型)。
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from smart_detect import find_models, load_backend
+from utils.backends import BACKENDS, CLASS_NAMES, SUFFIXES
+from utils.batcher import MicroBatcher
+from utils.npu_pool import NPU_CORES
+from utils.shm_ring import FrameRing
+from utils.sinks import EventLogSink, FrameResult, SinkGroup
+from utils.streams import is_live, load_sources, open_capture
+
+def capture(index, source, slots, loop, ready, stop, locks):
+    """采集进程: 解码直接写入帧环槽位，发布为最新帧; locks为父进程创建的每槽位锁，与推理进程同步"""
+    cv2.setNumThreads(1)  # 并行来自多个进程
+    cap = open_capture(source)
+    ret, frame = cap.read() if cap.isOpened() else (False, None)
+    if not ret:
+        print(f"❌ 无法打开视频源 {index}: {source}")
+        ready.put((index, None))
+        return
+    ring = FrameRing(frame.shape, slots, locks=locks)
+    ring.write(frame)
+    ready.put((index, ring.name))
+    h, w = frame.shape[:2]
+    print(f"📹 cam{index}: {source} ({w}x{h}) -> {ring.name}")
+
+    live = is_live(source)
+    interval = 0 if live else 1 / (cap.get(cv2.CAP_PROP_FPS) or 25)  # 视频文件按原帧率回放
+    delay = 0.5
+    try:
+        while not stop.is_set():
+            seq, view = ring.begin()
+            ret, image = cap.read(view)  # 尺寸一致时直接解码到共享内存
+            t = time.time()
+            if ret:
+                if image.shape != view.shape:  # 分辨率变化，缩放到帧环尺寸
+                    cv2.resize(image, (w, h), dst=view)
+                elif not np.shares_memory(image, view):
+                    view[:] = image
+                ring.commit(t)
+                delay = 0.5
+                if interval:
+                    time.sleep(max(interval - (time.time() - t), 0))
+                continue
+
+            cap.release()
+            if not (live or loop):
+                print(f"⏹️  cam{index}: 视频结束")
+                break
+            if live:
+                print(f"⚠️  cam{index}: 视频流中断，{delay:.1f}s后重连")
+                stop.wait(delay)
+                delay = min(delay * 2, 30.0)
+            cap = open_capture(source)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.release()
+        ring.close()
+
+def inference(worker, rings, locks, labels, name, weights, args, stop):
+    """推理进程: 轮询分配到的帧环，每路只处理未处理过的最新帧，凑满batch或等待超时后一次推理"""
+    kwargs = {'core_mask': 1 << (worker % NPU_CORES)} if name == 'rknn' else {}  # 各进程使用不同NPU核心
+    if name == 'onnx':
+        kwargs['profile'] = 'throughput'  # 多进程并行，每个会话单线程
+    backend = load_backend(name, weights, args.conf, **kwargs)
+    if backend is None:
+        return
+    batch = min(args.batch, len(rings))
+    if batch > 1 and backend.batch_size == 1:
+        print(f"⚠️  推理进程{worker}: 模型batch固定为1，逐帧推理 (导出时使用 --dynamic)")
+    batcher = MicroBatcher(backend, batch, args.batch_wait / 1000)
+    rings = [FrameRing.attach(r, l) for r, l in zip(rings, locks)]
+    sinks = SinkGroup([EventLogSink(CLASS_NAMES, args.event_log)])
+    last = [-1] * len(rings)
+    frames, latency = [0] * len(rings), [[] for _ in rings]
+    torn, start, last_report = 0, 0, time.time()
+    print(f"🚀 推理进程{worker}: {backend.name}, batch {batcher.max_batch}, 负责 {', '.join(labels)}")
+    try:
+        while not stop.is_set():
+            idle = True
+            for k in range(len(rings)):
+                if len(batcher) >= batcher.max_batch:
+                    break
+                i = (start + k) % len(rings)  # 轮换起点，batch小于视频源数时各路机会均等
+                ring = rings[i]
+                item = ring.read(last[i])
+                if item is None:
+                    continue
+                idle = False
+                seq, t0, frame = item
+                last[i] = seq
+                if not ring.hold(seq):  # 读取索引后槽位已被采集进程覆盖
+                    torn += 1
+                    continue
+                try:
+                    batcher.submit(frame, (i, t0, frame))  # 预处理期间锁住槽位，采集进程不会写入
+                finally:
+                    ring.release(seq)
+            start = (start + 1) % len(rings)
+            if batcher.ready():
+                for (i, t0, frame), det in batcher.run():
+                    frames[i] += 1
+                    latency[i].append((time.time() - t0) * 1000)
+                    if len(det):
+                        timestamp = datetime.now().strftime("%H:%M:%S")
+                        print(f"🔥 [{timestamp}] {labels[i]} 检测到 {len(det)} 个目标 (延迟: {latency[i][-1]:.1f}ms)")
+                    sinks.write(FrameResult(frame, det[:, :4].astype(int).tolist(), det[:, 4].tolist(),
+                                            det[:, 5].astype(int).tolist(), t0=t0, name=labels[i]))
+            elif idle:
+                time.sleep(0.002)
+
+            # 每10秒输出各路推理帧率和延迟
+            elapsed = time.time() - last_report
+            if elapsed > 10:
+                rates = [f"{labels[i]} {frames[i] / elapsed:.1f} FPS {np.mean(latency[i] or [0]):.0f}ms"
+                         for i in range(len(rings))]
+                print(f"📊 推理进程{worker}: {' | '.join(rates)} | 平均batch {batcher.mean_batch():.1f} | "
+                      f"覆盖丢弃 {torn}")
+                frames, latency = [0] * len(rings), [[] for _ in rings]
+                batcher.batches = batcher.frames = 0
+                last_report = time.time()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for ring in rings:
+            ring.close()
+        sinks.close()
+        backend.release()
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程火灾烟雾检测 (共享内存帧环)')
+    parser.add_argument('--source', type=str, default='config/streams.txt', help='视频源，或每行一个视频源的*.txt文件')
+    parser.add_argument('--backend', type=str, default=None, choices=list(BACKENDS), help='推理后端 (默认第一个可用模型)')
+    parser.add_argument('--weights', type=str, default=None, help='模型路径')
+    parser.add_argument('--conf', type=float, default=0.4, help='置信度阈值')
+    parser.add_argument('--workers', type=int, default=None, help='推理进程数 (默认 min(视频源数, CPU核心数/2))')
+    parser.add_argument('--slots', type=int, default=4, help='每路帧环槽位数')
+    parser.add_argument('--batch', type=int, default=1, help='每次推理最多合并的视频源帧数 (动态batch模型)')
+    parser.add_argument('--batch-wait', type=float, default=5.0, help='凑batch的最长等待时间 (ms)')
+    parser.add_argument('--loop', action='store_true', help='视频文件循环播放')
+    parser.add_argument('--event-log', type=str, default=None, help='检测事件JSON日志文件 (默认打印)')
+    args = parser.parse_args()
+
+    sources = load_sources(args.source)
+    if args.weights:
+        models = [(args.backend or SUFFIXES.get(Path(args.weights).suffix, 'onnx'), args.weights)]
+    else:
+        models = [m for m in find_models() if args.backend in (None, m[0])]
+    if not models:
+        print("❌ 未找到可用模型")
+        return 1
+    name, weights = models[0]
+
+    ctx = multiprocessing.get_context('spawn')  # 子进程不继承父进程的线程和推理运行时
+    stop, ready = ctx.Event(), ctx.Queue()
+    # 每路帧环每个槽位一把跨进程锁: 共享内存的普通写入在AArch64上没有顺序保证，加锁保证读到完整的帧
+    locks = [[ctx.Lock() for _ in range(args.slots)] for _ in sources]
+    captures = [ctx.Process(target=capture, args=(i, s, args.slots, args.loop, ready, stop, locks[i]), daemon=True)
+                for i, s in enumerate(sources)]
+    for p in captures:
+        p.start()
+    rings = {}
+    try:
+        for _ in captures:
+            index, ring = ready.get(timeout=60)
+            if ring is not None:
+                rings[index] = ring
+    except queue.Empty:
+        print("⚠️  部分视频源打开超时")
+    if not rings:
+        print("❌ 没有可用的视频源")
+        stop.set()
+        return 1
+
+    # 各路视频源轮流分配给推理进程
+    n = args.workers or min(len(rings), max(1, (os.cpu_count() or 2) // 2))
+    indices = sorted(rings)
+    workers = []
+    for w in range(min(n, len(indices))):
+        mine = indices[w::n]
+        workers.append(ctx.Process(target=inference, args=(w, [rings[i] for i in mine], [locks[i] for i in mine],
+                                                           [f'cam{i}' for i in mine], name, weights, args, stop)))
+    print(f"🎯 {len(rings)} 路视频源, {len(workers)} 个推理进程, 模型: {name} - {weights}")
+    for p in workers:
+        p.start()
+
+    try:
+        while any(p.is_alive() for p in captures) and any(p.is_alive() for p in workers):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("\n⏹️  检测停止")
+    finally:
+        stop.set()
+        for p in workers + captures:
+            p.join(timeout=10)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,281 @@
+# Detector backends behind one interface, sharing preprocessing (utils.buffers) and decode/NMS (utils.postprocess)
+import importlib.util
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from utils.buffers import FrameBufferPool
+from utils.npu_pool import NPU_CORE_0, raw_output_qparams
+from utils.ort_session import CACHE_DIR, IOBindingRunner, create_session
+from utils.postprocess import decode_outputs, filter_predictions, non_max_suppression, postprocess_predictions, \
+    scale_boxes
+from utils.tracker import box_iou
+
+ROOT = Path(__file__).resolve().parents[2]  # repository root
+CLIP = ROOT / 'result' / 'forest1.mp4'  # bundled benchmark clip
+CLASS_NAMES = ['fire', 'smoke']
+
+
+class Backend:
+    """Fire/smoke detector on one inference runtime
+
+    detect(image) returns an (N,6) array [x1, y1, x2, y2, conf, cls] in image pixels. Subclasses implement load()
+    and forward(x), returning raw YOLOv5 heads or one (1,n,5+nc) prediction array in input pixels; layout
+    selects the NHWC uint8 or NCHW float32 0-1 input.
+    """
+
+    name = 'backend'
+    module = None  # import name of the runtime, for available()
+    layout = 'nchw'
+    batch_size = 1  # input batch axis of the model, None if dynamic; see utils.batcher.MicroBatcher
+    in_graph_nms = False  # forward() returns final (K,6) detections in input pixels, e.g. an ONNX export with NMS
+
+    def __init__(self, weights, input_size=(640, 640), conf_thres=0.4, iou_thres=0.5, slots=4):
+        self.weights = str(weights)
+        self.input_size = input_size
+        self.conf_thres = conf_thres
+        self.iou_thres = iou_thres
+        self.slots = slots
+        self.qparams = None  # (zero_point, scale) per output for quantized outputs
+        self.buffers = FrameBufferPool(input_size, slots)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.name, self.weights)
+
+    @classmethod
+    def available(cls):
+        return cls.module is None or importlib.util.find_spec(cls.module) is not None
+
+    def load(self):
+        raise NotImplementedError
+
+    def forward(self, x):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def set_input_size(self, input_size):
+        if tuple(input_size) != tuple(self.input_size):
+            self.input_size = tuple(input_size)
+            self.buffers = FrameBufferPool(self.input_size, self.slots)
+
+    def preprocess(self, image):
+        return self.buffers.preprocess_nhwc(image) if self.layout == 'nhwc' else self.buffers.preprocess_nchw(image)
+
+    def decode(self, outputs, shape):
+        if self.in_graph_nms:
+            det = outputs[0]
+            return scale_boxes(det[det[:, 4] > self.conf_thres].astype(np.float32), self.input_size, shape)
+        if len(outputs) == 1 and outputs[0].ndim == 3:  # Detect() in inference mode, already decoded
+            return postprocess_predictions(outputs[0], self.input_size, shape, self.conf_thres, self.iou_thres)
+        det = decode_outputs(outputs, self.input_size, self.conf_thres, qparams=self.qparams)
+        return scale_boxes(non_max_suppression(det, self.iou_thres), self.input_size, shape)
+
+    def split(self, outputs, n):
+        # Per-image outputs of a batched forward(), for decode()
+        if self.in_graph_nms:
+            det, index = outputs[:2]
+            return [[det[index == i]] for i in range(n)]
+        return [[o[i:i + 1] for o in outputs] for i in range(n)]
+
+    def detect(self, image):
+        return self.decode(self.forward(self.preprocess(image)), image.shape)
+
+
+class RKNNBackend(Backend):
+    name = 'rknn'
+    module = 'rknn'
+    layout = 'nhwc'
+
+    def __init__(self, weights, core_mask=NPU_CORE_0, runtime=None, **kwargs):
+        super().__init__(weights, **kwargs)
+        self.core_mask = core_mask
+        self.infer_kwargs = {}
+        self.rknn = runtime  # e.g. utils.npu_pool.FakeRuntime to stub the NPU off-device
+
+    def load(self):
+        if self.rknn is None:
+            from rknn.api import RKNN
+            self.rknn = RKNN(verbose=False)
+        if self.rknn.load_rknn(self.weights) != 0:
+            raise RuntimeError('failed to load %s' % self.weights)
+        if self.rknn.init_runtime(target='rk3588', device_id=0, core_mask=self.core_mask) != 0:
+            raise RuntimeError('failed to init the NPU runtime')
+        self.qparams = raw_output_qparams(self.rknn)  # raw int8 outputs if the runtime provides them
+        self.infer_kwargs = {} if self.qparams is None else {'want_float': False}
+        return self
+
+    def forward(self, x):
+        return self.rknn.inference(inputs=[x], data_format='nhwc', **self.infer_kwargs)
+
+    def release(self):
+        if self.rknn is not None:
+            self.rknn.release()
+
+
+class ONNXBackend(Backend):
+    """ONNX Runtime on the CPU, profile is a utils.ort_session tuning profile; io_binding runs on preallocated
+    input and output buffers. Models exported with a uint8 NHWC input are fed resized pixels only."""
+
+    name = 'onnx'
+    module = 'onnxruntime'
+
+    def __init__(self, weights, profile='latency', cache_dir=CACHE_DIR, io_binding=False, **kwargs):
+        super().__init__(weights, **kwargs)
+        self.profile = profile
+        self.cache_dir = cache_dir
+        self.io_binding = io_binding
+        self.runner = None
+        self.session_info = {}
+        self.channels = None  # 'rgb' or 'bgr' for a uint8 NHWC input normalized in the graph
+
+    def load(self):
+        self.session, self.session_info = create_session(self.weights, self.profile, cache_dir=self.cache_dir)
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        self.in_graph_nms = self.session.get_outputs()[0].name == 'detections'  # exported with --nms
+        self.batch_size = inp.shape[0] if isinstance(inp.shape[0], int) else None  # exported with --dynamic
+        if inp.type == 'tensor(uint8)':  # exported with --uint8-input
+            self.channels = self.session.get_modelmeta().custom_metadata_map.get('input_format', 'rgb')
+            h, w = inp.shape[1:3]
+        else:
+            h, w = inp.shape[2:4]
+        if isinstance(h, int) and isinstance(w, int):
+            self.set_input_size((w, h))  # static (w, h) of the model
+        if self.io_binding:
+            self.runner = IOBindingRunner(self.session, self.buffers)
+        return self
+
+    def preprocess(self, image):
+        if self.channels is None:
+            return self.buffers.preprocess_nchw(image)
+        x = self.buffers.preprocess_bgr(image) if self.channels == 'bgr' else self.buffers.preprocess_nhwc(image)
+        return x[None]  # (1,h,w,3)
+
+    def forward(self, x):
+        if self.runner is not None and np.shares_memory(x, self.runner.tensor):  # not for e.g. MicroBatcher batches
+            return self.runner.run(x)
+        return self.session.run(None, {self.input_name: x})
+
+
+class TorchBackend(Backend):
+    name = 'pytorch'
+    module = 'torch'
+    batch_size = None
+
+    def load(self):
+        import torch
+        if str(ROOT / 'yolov5') not in sys.path:
+            sys.path.append(str(ROOT / 'yolov5'))  # yolov5 'models' package for unpickling checkpoints
+        from models.experimental import attempt_load
+        self.torch = torch
+        self.model = attempt_load(self.weights, map_location='cpu').float().eval()
+        return self
+
+    def forward(self, x):
+        with self.torch.no_grad():
+            return [self.model(self.torch.from_numpy(x))[0].numpy()]
+
+
+class DarknetBackend(Backend):
+    """YOLOv4 darknet cfg/weights through OpenCV DNN, cfg defaults to weights with a .cfg suffix"""
+
+    name = 'darknet'
+
+    def __init__(self, weights, cfg=None, **kwargs):
+        super().__init__(weights, **kwargs)
+        self.cfg = str(cfg or Path(self.weights).with_suffix('.cfg'))
+
+    def load(self):
+        self.net = cv2.dnn.readNetFromDarknet(self.cfg, self.weights)
+        self.output_names = self.net.getUnconnectedOutLayersNames()
+        with open(self.cfg) as f:
+            net = dict(line.strip().replace(' ', '').split('=', 1) for line in f
+                       if '=' in line and line.strip().startswith(('width', 'height')))
+        self.set_input_size((int(net.get('width', 608)), int(net.get('height', 608))))
+        return self
+
+    def forward(self, x):
+        self.net.setInput(x)
+        return self.net.forward(self.output_names)
+
+    def decode(self, outputs, shape):
+        # OpenCV region output rows: normalized xywh, objectness, objectness * class probabilities
+        pred = np.concatenate(outputs, 0)
+        pred[:, :4] *= np.array(self.input_size * 2, dtype=np.float32)
+        pred[:, 4] = 1.0
+        det = filter_predictions(pred, self.conf_thres)
+        return scale_boxes(non_max_suppression(det, self.iou_thres), self.input_size, shape)
+
+
+BACKENDS = {b.name: b for b in (RKNNBackend, ONNXBackend, TorchBackend, DarknetBackend)}
+SUFFIXES = {'.rknn': 'rknn', '.onnx': 'onnx', '.pt': 'pytorch', '.weights': 'darknet'}
+REFERENCE_ORDER = ('pytorch', 'onnx', 'darknet', 'rknn')  # float models first
+
+
+def read_clip(path=CLIP, frames=30):
+    # First `frames` frames of a video file
+    cap, images = cv2.VideoCapture(str(path)), []
+    while len(images) < frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        images.append(frame)
+    cap.release()
+    return images
+
+
+def parity(det, ref, iou_thres=0.5, conf_tol=0.1):
+    # Fraction of boxes in det and ref matched by class, IoU >= iou_thres and |conf difference| <= conf_tol
+    if not len(det) and not len(ref):
+        return 1.0
+    if not len(det) or not len(ref):
+        return 0.0
+    ok = (box_iou(det[:, :4], ref[:, :4]) >= iou_thres) & (det[:, None, 5] == ref[None, :, 5]) & \
+         (np.abs(det[:, None, 4] - ref[None, :, 4]) <= conf_tol)
+    matched = min(ok.any(1).sum(), ok.any(0).sum())
+    return 2 * matched / (len(det) + len(ref))
+
+
+def benchmark(backend, images, warmup=3):
+    """Time backend.detect() over images, returns a dict of fps, latency_ms, latency_p95_ms and the detections"""
+    for image in images[:warmup]:
+        backend.detect(image)
+    dt, dets = [], []
+    for image in images:
+        t = time.time()
+        dets.append(backend.detect(image))
+        dt.append(time.time() - t)
+    dt = np.array(dt) * 1000
+    return {'backend': backend.name, 'weights': backend.weights, 'fps': 1000 / dt.mean(),
+            'latency_ms': float(dt.mean()), 'latency_p95_ms': float(np.percentile(dt, 95)), 'dets': dets}
+
+
+def save_reference(path, dets):
+    np.savez_compressed(path, **{'f%g' % i: d for i, d in enumerate(dets)})
+
+
+def load_reference(path):
+    ref = np.load(path)
+    return [ref['f%g' % i] for i in range(len(ref.files))]
+
+
+def select_backend(backends, images, reference=None, min_parity=0.9):
+    """Benchmark loaded backends on images and return (fastest backend passing the parity check, results)
+
+    reference: per-image (N,6) detections; if None the first backend of REFERENCE_ORDER is the reference.
+    """
+    results = [benchmark(b, images) for b in backends]
+    if reference is None:
+        ref = min(results, key=lambda r: REFERENCE_ORDER.index(r['backend']))
+        ref['reference'] = True
+        reference = ref['dets']
+    for r in results:
+        r['parity'] = float(np.mean([parity(d, f) for d, f in zip(r['dets'], reference)]))
+        r['passed'] = r['parity'] >= min_parity
+    passed = [(r['fps'], i) for i, r in enumerate(results) if r['passed']]
+    return (backends[max(passed)[1]] if passed else None), results
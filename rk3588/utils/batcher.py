@@ -0,0 +1,64 @@
+# Micro-batching across streams: frames from several cameras share one forward() call of a batched model
+import time
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Collect frames from several streams into one batched forward() and split the detections per frame
+
+    submit() preprocesses a frame straight into the next row of a preallocated batch; run() executes the batch once
+    ready(), i.e. max_batch frames are pending or the oldest has waited max_wait seconds, and returns
+    [(tag, detections)] in submission order. Models with a static batch axis (backend.batch_size > 1) are padded to
+    it; with a batch of 1 every frame runs alone.
+    """
+
+    def __init__(self, backend, max_batch=4, max_wait=0.005):
+        self.backend = backend
+        self.pad = backend.batch_size  # None: dynamic batch axis
+        self.max_batch = max_batch if self.pad is None else min(max_batch, self.pad)
+        self.max_wait = max_wait
+        self.batch = None  # (max_batch or pad, ...) input, allocated on first submit()
+        self.items = []  # (image shape, tag) per pending row
+        self.t0 = 0.0
+        self.batches = self.frames = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def submit(self, image, tag=None):
+        x = self.backend.preprocess(image)
+        x = x if x.ndim == 4 else x[None]
+        if self.max_batch == 1 and self.pad in (None, 1):
+            self.batch = x  # batch of one: run the preprocessed buffer itself, e.g. an IOBinding slot
+        elif self.batch is None:
+            self.batch = np.empty((self.pad or self.max_batch,) + x.shape[1:], dtype=x.dtype)
+            if self.pad:
+                self.batch[:] = 0  # padding rows
+        if not self.items:
+            self.t0 = time.time()
+        if self.batch is not x:
+            self.batch[len(self.items)] = x[0]
+        self.items.append((image.shape, tag))
+
+    def drop(self):
+        # Withdraw the last submitted frame, e.g. one overwritten in a frame ring during preprocessing
+        self.items.pop()
+
+    def ready(self):
+        return len(self.items) >= self.max_batch or (bool(self.items) and time.time() - self.t0 >= self.max_wait)
+
+    def run(self):
+        n = len(self.items)
+        if not n:
+            return []
+        b = self.backend
+        outputs = b.forward(self.batch if self.pad else self.batch[:n])
+        results = [(tag, b.decode(o, shape)) for o, (shape, tag) in zip(b.split(outputs, n), self.items)]
+        self.items = []
+        self.batches += 1
+        self.frames += n
+        return results
+
+    def mean_batch(self):
+        return self.frames / self.batches if self.batches else 0.0
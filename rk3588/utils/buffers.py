@@ -0,0 +1,77 @@
+# Preallocated per-stream input buffers, so steady-state preprocessing allocates no new arrays
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+class FrameBufferPool:
+    """Ring of preallocated network input tensors for one stream
+
+    Each call to preprocess_*() writes into a slot through OpenCV dst= outputs and NumPy out= ufuncs and returns
+    a view of it. Without a slot argument the slots are used round-robin and a slot is overwritten `slots` frames
+    later, so slots must exceed the frames in flight between preprocess and inference. Pipelines that drop frames
+    instead acquire() a free slot per frame and release() it once inference (or anything else reading the slot,
+    e.g. IOBinding outputs) is done with it, or the frame is dropped; acquire() waits while all slots are held.
+    """
+
+    def __init__(self, input_size=(640, 640), slots=8):
+        w, h = input_size
+        self.input_size = input_size
+        self.slots = slots
+        self.i = 0
+        self.resized = np.empty((h, w, 3), dtype=np.uint8)  # BGR after resize, only used within one call
+        self.rgb = np.empty((slots, h, w, 3), dtype=np.uint8)  # RGB (BGR after preprocess_bgr), NHWC uint8 input
+        self.tensor = None  # NCHW float32 input, allocated on first preprocess_nchw()
+        self.free = deque(range(slots))  # slots not held, for acquire()
+        self.cond = threading.Condition()
+
+    def _next(self):
+        i = self.i
+        self.i = (i + 1) % self.slots
+        return i
+
+    def acquire(self, timeout=None):
+        # Index of a free slot, held until release(), or None on timeout
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.free, timeout):
+                return None
+            return self.free.popleft()
+
+    def release(self, slot):
+        with self.cond:
+            self.free.append(slot)
+            self.cond.notify()
+
+    def preprocess_nhwc(self, image, slot=None):
+        # BGR image -> resized RGB uint8 (h,w,3), e.g. for RKNN data_format='nhwc'
+        i = self._next() if slot is None else slot
+        cv2.resize(image, self.input_size, dst=self.resized)
+        cv2.cvtColor(self.resized, cv2.COLOR_BGR2RGB, dst=self.rgb[i])
+        return self.rgb[i]
+
+    def preprocess_bgr(self, image, slot=None):
+        # BGR image -> resized BGR uint8 (h,w,3), for models that reorder channels and normalize in the graph
+        i = self._next() if slot is None else slot
+        cv2.resize(image, self.input_size, dst=self.rgb[i])
+        return self.rgb[i]
+
+    def nhwc(self):
+        # (slots,1,h,w,3) uint8 view of the ring behind preprocess_nhwc() and preprocess_bgr()
+        return self.rgb[:, None]
+
+    def nchw(self):
+        # (slots,1,3,h,w) float32 ring behind preprocess_nchw(), e.g. to bind its slots as runtime inputs
+        if self.tensor is None:
+            w, h = self.input_size
+            self.tensor = np.empty((self.slots, 1, 3, h, w), dtype=np.float32)
+        return self.tensor
+
+    def preprocess_nchw(self, image, slot=None):
+        # BGR image -> RGB float32 0-1 (1,3,h,w), e.g. for ONNX Runtime
+        self.nchw()
+        i = self._next() if slot is None else slot
+        rgb = self.preprocess_nhwc(image, i)
+        np.multiply(rgb.transpose(2, 0, 1), np.float32(1 / 255.0), out=self.tensor[i, 0])  # HWC -> CHW, 0-255 -> 0-1
+        return self.tensor[i]
@@ -0,0 +1,212 @@
+# Warm-start inference daemon: one loaded model serves detection requests from many processes over a Unix socket
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils.backends import Backend
+from utils.shm_ring import attach_shm
+
+# Request: op, seq, shared memory name, byte offset, height, width, channels; the frame itself stays in shared memory
+REQUEST = struct.Struct('<BI32sQHHB')
+# Response: status, seq, n, inference ms; followed by n (N,6) float32 detections, or n bytes of JSON for OP_INFO
+RESPONSE = struct.Struct('<BIIf')
+OP_DETECT, OP_INFO = 1, 2
+STATUS_OK, STATUS_ERROR = 0, 1
+
+
+def recv_exact(sock, n):
+    buf = bytearray(n)
+    view, i = memoryview(buf), 0
+    while i < n:
+        k = sock.recv_into(view[i:])
+        if not k:
+            return None  # peer closed
+        i += k
+    return bytes(buf)
+
+
+class DaemonHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server, segments = self.server, {}
+        try:
+            while True:
+                data = recv_exact(self.request, REQUEST.size)
+                if data is None:
+                    break
+                op, seq, name, offset, h, w, c = REQUEST.unpack(data)
+                if op == OP_INFO:
+                    payload = json.dumps(server.info()).encode()
+                    self.request.sendall(RESPONSE.pack(STATUS_OK, seq, len(payload), 0) + payload)
+                    continue
+                try:
+                    name = name.rstrip(b'\0').decode()
+                    if name not in segments:
+                        segments[name] = attach_shm(name)
+                    frame = np.ndarray((h, w, c), dtype=np.uint8, buffer=segments[name].buf, offset=offset)
+                    with server.lock:  # one backend, requests from all clients are serialized
+                        t = time.time()
+                        det = server.backend.detect(frame)
+                        dt = (time.time() - t) * 1000
+                        server.requests += 1
+                    del frame
+                    det = np.ascontiguousarray(det, dtype=np.float32)
+                except Exception as e:
+                    print('Daemon request %g error: %s' % (seq, e))
+                    self.request.sendall(RESPONSE.pack(STATUS_ERROR, seq, 0, 0))
+                    continue
+                self.request.sendall(RESPONSE.pack(STATUS_OK, seq, len(det), dt) + det.tobytes())
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # client gave up, e.g. timed out and reconnected
+        finally:
+            for shm in segments.values():
+                shm.close()
+
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve backend.detect() on a Unix socket, one thread per client connection"""
+
+    daemon_threads = True
+
+    def __init__(self, backend, path):
+        if os.path.exists(path):
+            os.unlink(path)  # stale socket of a previous run
+        self.backend = backend
+        self.path = path
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.started = time.time()
+        super().__init__(path, DaemonHandler)
+
+    def info(self):
+        return {'backend': self.backend.name, 'weights': self.backend.weights,
+                'input_size': list(self.backend.input_size), 'requests': self.requests,
+                'uptime_s': round(time.time() - self.started, 1), 'pid': os.getpid()}
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class DaemonClient:
+    """Client of a DaemonServer; frames are passed as handles to a shared memory ring owned by the client
+
+    Decode straight into buffer(shape) to avoid any copy, other frames are copied into the next ring slot once.
+    A reply slower than timeout seconds raises socket.timeout; the connection is then out of step with the
+    daemon and must be reconnect()ed before the next request.
+    """
+
+    def __init__(self, path, slots=2, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+        self.reconnect()
+        self.slots = slots
+        self.seq = 0
+        self.shm = None
+        self.views = []
+        self.i = 0
+
+    def reconnect(self):
+        # New connection, drops any reply still pending on the old one; the shared memory ring is kept
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+    def buffer(self, shape):
+        # Next ring slot as an (h,w,c) uint8 array in shared memory, e.g. for cap.read(image=...)
+        if not self.views or self.views[0].shape != tuple(shape):
+            self._release()
+            size = int(np.prod(shape))
+            self.shm = shared_memory.SharedMemory(create=True, size=size * self.slots)
+            self.views = [np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=i * size)
+                          for i in range(self.slots)]
+        self.i = (self.i + 1) % self.slots
+        return self.views[self.i]
+
+    def _slot(self, frame):
+        for i, v in enumerate(self.views):
+            if v.shape == frame.shape and v.__array_interface__['data'][0] == frame.__array_interface__['data'][0]:
+                return i
+        buf = self.buffer(frame.shape)
+        buf[:] = frame
+        return self.i
+
+    def _request(self, op, name=b'', offset=0, shape=(0, 0, 0)):
+        self.seq += 1
+        self.sock.sendall(REQUEST.pack(op, self.seq, name, offset, *shape))
+        data = recv_exact(self.sock, RESPONSE.size)
+        if data is None:
+            raise ConnectionError('daemon closed the connection')
+        status, seq, n, dt = RESPONSE.unpack(data)
+        return status, n, dt
+
+    def detect(self, frame):
+        """Return (N,6) [x1, y1, x2, y2, conf, cls] detections of a BGR frame and the daemon's inference ms"""
+        i = self._slot(frame)
+        status, n, dt = self._request(OP_DETECT, self.shm.name.encode(), i * self.views[i].nbytes, frame.shape)
+        if status != STATUS_OK:
+            raise RuntimeError('daemon failed to process frame %g' % self.seq)
+        det = np.frombuffer(recv_exact(self.sock, n * 24), dtype=np.float32).reshape(n, 6)
+        return det.copy(), dt
+
+    def info(self):
+        _, n, _ = self._request(OP_INFO)
+        return json.loads(recv_exact(self.sock, n))
+
+    def _release(self):
+        self.views = []
+        if self.shm is not None:
+            try:
+                self.shm.close()
+            except BufferError:
+                pass  # frames handed out by buffer() are still referenced, the mapping goes with them
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        self.sock.close()
+        self._release()
+
+
+class RemoteBackend(Backend):
+    """Backend interface over a DaemonClient, so detectors can use a model loaded by the daemon"""
+
+    name = 'daemon'
+
+    def __init__(self, path, slots=2, timeout=10.0, **kwargs):
+        super().__init__(path, slots=1, **kwargs)  # preprocessing happens in the daemon
+        self.path = path
+        self.client_slots = slots
+        self.timeout = timeout
+        self.client = None
+        self.infer_time = 0.0  # daemon inference ms of the last frame
+
+    def load(self):
+        self.client = DaemonClient(self.path, self.client_slots, self.timeout)
+        info = self.client.info()
+        self.name, self.weights = 'daemon:%s' % info['backend'], info['weights']
+        return self
+
+    def buffer(self, shape):
+        return self.client.buffer(shape)
+
+    def detect(self, image):
+        det, self.infer_time = self.client.detect(image)
+        return det
+
+    def reconnect(self):
+        self.client.reconnect()
+
+    def release(self):
+        if self.client is not None:
+            self.client.close()
@@ -0,0 +1,53 @@
+# Motion gating for fixed cameras: skip inference while the scene is unchanged
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Decide per frame whether inference is needed, by comparing a low-resolution grayscale frame with a
+    running-average background
+
+    A frame is inferred when more than `threshold` of its pixels differ from the background by more than
+    `pixel_thres` grey levels, or when `keyframe_interval` seconds have passed since the last inferred frame.
+    """
+
+    def __init__(self, threshold=0.005, keyframe_interval=10.0, size=(64, 36), alpha=0.05, pixel_thres=25):
+        self.threshold = threshold
+        self.keyframe_interval = keyframe_interval
+        self.size = size
+        self.alpha = alpha
+        self.pixel_thres = pixel_thres
+        w, h = size
+        self.small = np.empty((h, w, 3), dtype=np.uint8)
+        self.gray = np.empty((h, w), dtype=np.uint8)
+        self.gray_f = np.empty((h, w), dtype=np.float32)
+        self.diff = np.empty((h, w), dtype=np.float32)
+        self.background = None  # running average, float32
+        self.last_infer = 0.0
+        self.changed = 0.0  # changed-pixel fraction of the last frame
+        self.frames = 0
+        self.skipped = 0
+
+    def __call__(self, frame):
+        # Returns True if this frame should be inferred
+        now = time.time()
+        self.frames += 1
+        cv2.resize(frame, self.size, dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.gray)
+        self.gray_f[:] = self.gray
+        if self.background is None:
+            self.background = self.gray_f.copy()
+            self.last_infer = now
+            return True
+
+        cv2.absdiff(self.gray_f, self.background, dst=self.diff)
+        self.changed = float(np.count_nonzero(self.diff > self.pixel_thres)) / self.diff.size
+        cv2.accumulateWeighted(self.gray_f, self.background, self.alpha)
+
+        if self.changed >= self.threshold or now - self.last_infer >= self.keyframe_interval:
+            self.last_infer = now
+            return True
+        self.skipped += 1
+        return False
@@ -0,0 +1,253 @@
+# Multi-core NPU inference pool: one runtime context per RK3588 NPU core, round-robin dispatch, in-order results
+import inspect
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from utils.postprocess import dequantize, quantize
+
+# core_mask values, same as RKNN.NPU_CORE_* / RKNNLite.NPU_CORE_*
+NPU_CORE_AUTO = 0
+NPU_CORE_0 = 1
+NPU_CORE_1 = 2
+NPU_CORE_2 = 4
+NPU_CORE_0_1_2 = 7
+NPU_CORES = 3  # RK3588
+
+
+def split_core_mask(core_mask=NPU_CORE_0_1_2):
+    # Split a core mask into single-core masks, i.e. 7 -> [1, 2, 4]; AUTO -> [AUTO]
+    cores = [1 << i for i in range(NPU_CORES) if core_mask >> i & 1]
+    return cores or [NPU_CORE_AUTO]
+
+
+class FakeRuntime:
+    """Stand-in for RKNN/RKNNLite on x86: sleeps infer_time per inference and returns fixed outputs
+
+    With qparams, a (zero_point, scale) per output, the outputs are held quantized to int8 as on the NPU and
+    inference() dequantizes them, or returns them raw with want_float=False; see raw_output_qparams().
+    """
+
+    def __init__(self, infer_time=0.03, outputs=None, qparams=None):
+        self.infer_time = infer_time
+        self.outputs = outputs if outputs is not None else \
+            [np.full((1, 21, s, s), -10., dtype=np.float32) for s in (80, 40, 20)]  # background only
+        self.output_qparams = qparams
+        if qparams is not None:
+            self.outputs = [quantize(x, zp, scale) for x, (zp, scale) in zip(self.outputs, qparams)]
+        self.core_mask = None
+
+    def load_rknn(self, path):
+        return 0
+
+    def init_runtime(self, target=None, device_id=None, core_mask=NPU_CORE_AUTO):
+        self.core_mask = core_mask
+        return 0
+
+    def inference(self, inputs, data_format=None, want_float=True):
+        time.sleep(self.infer_time)  # releases the GIL like the real C runtime
+        if self.output_qparams is None or not want_float:
+            return self.outputs
+        return [dequantize(x, zp, scale) for x, (zp, scale) in zip(self.outputs, self.output_qparams)]
+
+    def release(self):
+        pass
+
+
+def raw_output_qparams(ctx):
+    """(zero_point, scale) per output if runtime ctx can return its int8 outputs undequantized, else None
+
+    Such a runtime takes inference(..., want_float=False) and reports output_qparams. The rknn-toolkit2 and
+    RKNNLite Python APIs return float32 outputs, so on the board decoding stays on the float path.
+    """
+    qparams = getattr(ctx, 'output_qparams', None)
+    if qparams is None:
+        return None
+    try:
+        return qparams if 'want_float' in inspect.signature(ctx.inference).parameters else None
+    except (TypeError, ValueError):
+        return None
+
+
+class NPUPool:
+    """Dispatch inputs round-robin over runtime contexts, one worker thread each, and return results by sequence
+
+    submit() blocks once a context's bounded queue is full; get() returns results strictly in submit order.
+    """
+
+    def __init__(self, contexts, queue_size=2, data_format='nhwc', want_float=True):
+        self.contexts = contexts
+        self.data_format = data_format
+        self.kwargs = {} if want_float else {'want_float': False}  # raw int8 outputs, see raw_output_qparams()
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in contexts]
+        self.results = {}  # seq -> (meta, outputs, inference time)
+        self.cond = threading.Condition()
+        self.lock = threading.Lock()  # serializes submit()
+        self.seq_in = 0  # next sequence number to submit
+        self.seq_out = 0  # next sequence number to return
+        self.threads = [threading.Thread(target=self._worker, args=(ctx, q), daemon=True)
+                        for ctx, q in zip(contexts, self.queues)]
+        for t in self.threads:
+            t.start()
+
+    def __len__(self):
+        return len(self.contexts)
+
+    @property
+    def pending(self):
+        # Frames submitted but not yet returned by get()
+        return self.seq_in - self.seq_out
+
+    def submit(self, inputs, meta=None, timeout=None):
+        # Thread-safe, several capture threads may share one pool
+        with self.lock:
+            seq = self.seq_in
+            self.queues[seq % len(self.queues)].put((seq, inputs, meta), timeout=timeout)
+            self.seq_in += 1
+        return seq
+
+    def get(self, timeout=None):
+        """Return (seq, meta, outputs, inference time) of the oldest frame, outputs is None if inference failed"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq_out in self.results, timeout):
+                raise queue.Empty
+            seq = self.seq_out
+            self.seq_out += 1
+            return (seq,) + self.results.pop(seq)
+
+    def _worker(self, ctx, q):
+        while True:
+            item = q.get()
+            if item is None:
+                break
+            seq, inputs, meta = item
+            t = time.time()
+            try:
+                outputs = ctx.inference(inputs=[inputs], data_format=self.data_format, **self.kwargs)
+            except Exception as e:
+                print('NPU inference error (frame %g): %s' % (seq, e))
+                outputs = None
+            with self.cond:
+                self.results[seq] = (meta, outputs, time.time() - t)
+                self.cond.notify_all()
+
+    def close(self):
+        for q in self.queues:
+            q.put(None)
+        for t in self.threads:
+            t.join()
+        for ctx in self.contexts:
+            ctx.release()
+        self.contexts = []
+
+
+class FrameSequencer:
+    """Keep frames in capture order around an NPUPool when some of them skip inference (motion gate, detect interval)
+
+    push(item, inputs) submits inputs, or skips inference if inputs is None, and returns the [(item, result)] now
+    ready in order, result being (outputs, inference time) or None for skipped frames. Up to depth frames per core
+    stay in flight while only inferred frames wait; once a skipped frame is queued behind an inferred one, the
+    inferred one is collected right away (pool.get() blocks for that frame only), so skipped frames never wait for
+    the pool to fill. At most depth * cores + 1 frames are held.
+    """
+
+    def __init__(self, pool, depth=2):
+        self.pool = pool
+        self.depth = depth
+        self.inflight = deque()  # (item, inferred)
+
+    def __len__(self):
+        return len(self.inflight)
+
+    def push(self, item, inputs=None):
+        if inputs is not None:
+            self.pool.submit(inputs, item)
+        self.inflight.append((item, inputs is not None))
+        ready = []
+        limit = self.depth * len(self.pool)
+        while self.inflight and (not self.inflight[0][1] or not self.inflight[-1][1] or
+                                 self.pool.pending >= limit or len(self.inflight) > limit):
+            ready.append(self._collect())
+        return ready
+
+    def flush(self):
+        # Everything still held, e.g. at end of stream
+        return [self._collect() for _ in range(len(self.inflight))]
+
+    def _collect(self):
+        item, inferred = self.inflight.popleft()
+        if not inferred:
+            return item, None
+        _, _, outputs, infer_time = self.pool.get()  # results come back in submit order, i.e. this frame
+        return item, (outputs, infer_time)
+
+
+if __name__ == '__main__':
+    # x86 check: throughput of the pool over fake runtimes, python -m utils.npu_pool --infer-ms 30
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--infer-ms', type=float, default=30, help='simulated inference time per frame (ms)')
+    parser.add_argument('--frames', type=int, default=90, help='frames per run')
+    opt = parser.parse_args()
+
+    img = np.zeros((640, 640, 3), dtype=np.uint8)
+    for mask in (NPU_CORE_0, NPU_CORE_0 | NPU_CORE_1, NPU_CORE_0_1_2):
+        contexts = []
+        for core in split_core_mask(mask):
+            ctx = FakeRuntime(opt.infer_ms / 1000)
+            ctx.init_runtime(target='rk3588', core_mask=core)
+            contexts.append(ctx)
+        pool = NPUPool(contexts)
+        t, order = time.time(), []
+        for i in range(opt.frames):
+            pool.submit(img, i)
+            if pool.pending >= 2 * len(pool):
+                order.append(pool.get()[1])
+        while pool.pending:
+            order.append(pool.get()[1])
+        dt = time.time() - t
+        pool.close()
+        assert order == list(range(opt.frames)), 'results out of order'
+        print('core_mask=%g: %g contexts, %.1f FPS' % (mask, len(contexts), opt.frames / dt))
+
+    # Skipped frames (every 5th frame inferred, and one keyframe in 50 as with a static scene behind the motion
+    # gate) must leave the sequencer in order and within 2 * cores frames of arriving
+    contexts = [FakeRuntime(opt.infer_ms / 1000) for _ in split_core_mask(NPU_CORE_0_1_2)]
+    pool = NPUPool(contexts)
+    for interval in (5, 50):
+        sequencer, order, lag = FrameSequencer(pool), [], 0
+        for i in range(opt.frames):
+            for item, result in sequencer.push(i, img if i % interval == 0 else None):
+                order.append(item)
+                if result is None:
+                    lag = max(lag, i - item)
+        order += [item for item, _ in sequencer.flush()]
+        assert order == list(range(opt.frames)), 'frames out of order'
+        assert lag <= 2 * len(pool), 'skipped frame held for %g frames' % lag
+        print('detect interval %g: skipped frames emitted after at most %g frames' % (interval, lag))
+    pool.close()
+
+    # int8 outputs: thresholding raw int8 heads must give the same detections as decoding the dequantized ones,
+    # and thresholding float logits the same as decoding every cell
+    from utils.postprocess import ANCHORS, STRIDES, decode_head, decode_outputs, filter_predictions, head_to_grid
+
+    rng = np.random.default_rng(0)
+    heads = [rng.normal(-4, 3, (1, 21, s, s)).astype(np.float32) for s in (80, 40, 20)]  # a few hundred candidates
+    qparams = [(-10, 0.08), (-12, 0.07), (-9, 0.09)]
+    contexts = [FakeRuntime(0, heads, qparams) for _ in range(2)]
+    raw, dequantized = NPUPool(contexts[:1], want_float=False), NPUPool(contexts[1:])
+    raw.submit(img), dequantized.submit(img)
+    q, f = raw.get()[2], dequantized.get()[2]
+    assert raw_output_qparams(contexts[0]) == qparams and q[0].dtype == np.int8 and f[0].dtype == np.float32
+    for conf in (0.1, 0.25, 0.4):
+        a, b = decode_outputs(q, conf_thres=conf, qparams=qparams), decode_outputs(f, conf_thres=conf)
+        assert len(a) and a.shape == b.shape and np.allclose(a, b), 'int8 and float decodes differ'
+        dense = [decode_head(head_to_grid(x), ANCHORS[i], STRIDES[i]) for i, x in enumerate(f)]
+        c = filter_predictions(np.concatenate(dense, 0), conf)
+        assert b.shape == c.shape and np.allclose(b, c), 'logit-thresholded and dense float decodes differ'
+        print('conf %g: int8, float and dense decodes agree on %g detections' % (conf, len(a)))
+    raw.close(), dequantized.close()
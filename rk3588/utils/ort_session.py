@@ -0,0 +1,143 @@
+# ONNX Runtime session tuning profiles and an on-disk cache of optimized graphs for faster cold starts
+import hashlib
+import os
+import platform
+import time
+from pathlib import Path
+
+import numpy as np
+
+CACHE_DIR = Path.home() / '.cache' / 'fire-detect' / 'ort'
+CORES = os.cpu_count() or 1
+TYPES = {'tensor(float)': np.float32, 'tensor(float16)': np.float16, 'tensor(uint8)': np.uint8,
+         'tensor(int8)': np.int8, 'tensor(int32)': np.int32, 'tensor(int64)': np.int64}
+
+# SessionOptions per profile; missing keys keep the ONNX Runtime defaults
+PROFILES = {
+    'default': {},
+    # one stream: every frame uses the big cores (RK3588: 4x Cortex-A76), workers spin between ops
+    'latency': {'intra_op_threads': min(4, CORES), 'inter_op_threads': 1, 'execution_mode': 'sequential',
+                'spinning': True},
+    # many streams or worker processes, one session per core: no thread pool contention, no busy waiting
+    'throughput': {'intra_op_threads': 1, 'inter_op_threads': 1, 'execution_mode': 'sequential',
+                   'spinning': False},
+}
+
+
+def session_options(profile='latency'):
+    import onnxruntime as ort
+    p = PROFILES[profile]
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if 'intra_op_threads' in p:
+        so.intra_op_num_threads = p['intra_op_threads']
+    if 'inter_op_threads' in p:
+        so.inter_op_num_threads = p['inter_op_threads']
+    if 'execution_mode' in p:
+        so.execution_mode = ort.ExecutionMode.ORT_PARALLEL if p['execution_mode'] == 'parallel' else \
+            ort.ExecutionMode.ORT_SEQUENTIAL
+    if 'spinning' in p:
+        so.add_session_config_entry('session.intra_op.allow_spinning', '1' if p['spinning'] else '0')
+        so.add_session_config_entry('session.inter_op.allow_spinning', '1' if p['spinning'] else '0')
+    return so
+
+
+def model_hash(path, chunk=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+def create_session(model_path, profile='latency', providers=('CPUExecutionProvider',), cache_dir=CACHE_DIR):
+    """Create an InferenceSession with a tuning profile, returns (session, info)
+
+    The graph optimized by the first run is saved under cache_dir, keyed by model hash, ONNX Runtime version,
+    execution provider and machine, and later runs load it with optimization disabled. info: profile, cache (hit,
+    miss or None) and load_ms. cache_dir=None disables the cache.
+    """
+    import onnxruntime as ort
+    t = time.time()
+    so = session_options(profile)
+    info = {'profile': profile, 'cache': None}
+    session = None
+    if cache_dir:
+        # optimized graphs may use hardware specific kernels (e.g. NCHWc layouts), so the machine is part of the key
+        key = '%s-ort%s-%s-%s' % (model_hash(model_path), ort.__version__, providers[0], platform.machine())
+        cached = Path(cache_dir) / (key + '.onnx')
+        if cached.exists():
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL  # already optimized
+            try:
+                session = ort.InferenceSession(str(cached), so, providers=list(providers))
+                info['cache'] = 'hit'
+            except Exception as e:
+                print('Optimized model cache %s unusable (%s), rebuilding' % (cached, e))
+                cached.unlink()
+                so = session_options(profile)
+        if session is None:
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            tmp = cached.with_name('%s.%d.tmp.onnx' % (key, os.getpid()))  # concurrent starts never see a partial file
+            so.optimized_model_filepath = str(tmp)
+            session = ort.InferenceSession(str(model_path), so, providers=list(providers))
+            if tmp.exists():
+                os.replace(tmp, cached)
+                info['cache'] = 'miss'
+    if session is None:
+        session = ort.InferenceSession(str(model_path), so, providers=list(providers))
+    info['load_ms'] = round((time.time() - t) * 1000, 1)
+    return session, info
+
+
+class IOBindingRunner:
+    """Run a session through IOBinding on preallocated buffers, so steady-state inference allocates nothing
+
+    Inputs are bound to the slots of a FrameBufferPool ring, the NHWC uint8 one for models exported with a uint8
+    input and the NCHW float32 one otherwise, and every slot has its own output arrays: one slot
+    can be preprocessed while another runs (double buffering), and a slot's outputs stay valid until the pool
+    reuses it. Outputs with dynamic shapes, e.g. in-graph NMS detections, are allocated by the runtime per run.
+    """
+
+    def __init__(self, session, buffers):
+        import onnxruntime as ort
+        outputs = session.get_outputs()
+        inp = session.get_inputs()[0]
+        name = inp.name
+        self.session = session
+        self.tensor = buffers.nhwc() if inp.type == 'tensor(uint8)' else buffers.nchw()
+        self.static = [all(isinstance(d, int) for d in o.shape) for o in outputs]
+        self.dynamic = [o.name for o, static in zip(outputs, self.static) if not static]
+        self.outputs, self.bindings, self.values = [], [], []
+        for x in self.tensor:
+            y = [np.empty(o.shape, dtype=TYPES[o.type]) if static else None for o, static in zip(outputs, self.static)]
+            values = [ort.OrtValue.ortvalue_from_numpy(x)]  # CPU OrtValues share numpy memory
+            binding = session.io_binding()
+            binding.bind_ortvalue_input(name, values[0])
+            for o, a in zip(outputs, y):
+                if a is None:
+                    binding.bind_output(o.name, 'cpu')
+                else:
+                    values.append(ort.OrtValue.ortvalue_from_numpy(a))
+                    binding.bind_ortvalue_output(o.name, values[-1])
+            self.outputs.append(y)
+            self.bindings.append(binding)
+            self.values.append(values)
+
+    def slot(self, x):
+        # Index of the ring slot x is a view of
+        offset = x.__array_interface__['data'][0] - self.tensor.__array_interface__['data'][0]
+        i = offset // self.tensor[0].nbytes
+        if x.shape != self.tensor.shape[1:] or offset % self.tensor[0].nbytes or not 0 <= i < len(self.tensor):
+            raise ValueError('input is not a slot of the bound buffer ring')
+        return i
+
+    def run(self, x):
+        i = self.slot(x)
+        binding = self.bindings[i]
+        for name in self.dynamic:
+            binding.bind_output(name, 'cpu')  # fresh allocation, the last run's shape may not fit
+        self.session.run_with_iobinding(binding)
+        if all(self.static):
+            return self.outputs[i]
+        values = binding.get_outputs()
+        return [a if a is not None else v.numpy() for a, v in zip(self.outputs[i], values)]
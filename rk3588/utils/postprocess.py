@@ -0,0 +1,185 @@
+# NumPy-only YOLOv5 output decoding and NMS, for runtimes without torch (RKNN, ONNX Runtime)
+import numpy as np
+
+# anchors per head from yolov5_models/yolov5s_fs.yaml, shape(nl,na,2)
+ANCHORS = np.array([[10, 13, 16, 30, 33, 23],  # P3/8
+                    [30, 61, 62, 45, 59, 119],  # P4/16
+                    [116, 90, 156, 198, 373, 326]], dtype=np.float32).reshape(3, -1, 2)  # P5/32
+STRIDES = (8, 16, 32)
+
+_grids = {}  # (nx, ny) -> grid, built once per head size
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def make_grid(nx=20, ny=20):
+    # NumPy counterpart of Detect._make_grid, shape(1,ny,nx,2)
+    if (nx, ny) not in _grids:
+        xv, yv = np.meshgrid(np.arange(nx), np.arange(ny))
+        _grids[(nx, ny)] = np.stack((xv, yv), 2).reshape(1, ny, nx, 2).astype(np.float32)
+    return _grids[(nx, ny)]
+
+
+def head_to_grid(x, na=3):
+    # Raw head output x(1,na*no,ny,nx) or x(1,na,ny,nx,no) to x(na,ny,nx,no)
+    x = np.asarray(x)
+    if x.ndim == 5:
+        return x[0]
+    if x.ndim == 4:
+        x = x[0]
+    c, ny, nx = x.shape
+    return x.reshape(na, c // na, ny, nx).transpose(0, 2, 3, 1)
+
+
+def decode_head(x, anchors, stride):
+    # Decode one head x(na,ny,nx,no) to (na*ny*nx,no) xywh in input pixels, same math as Detect.forward
+    na, ny, nx, no = x.shape
+    y = sigmoid(x.astype(np.float32))
+    y[..., 0:2] = (y[..., 0:2] * 2. - 0.5 + make_grid(nx, ny)) * stride  # xy
+    y[..., 2:4] = (y[..., 2:4] * 2) ** 2 * anchors.reshape(na, 1, 1, 2)  # wh
+    return y.reshape(-1, no)
+
+
+def logit(p):
+    # Inverse sigmoid
+    return float(np.log(p / (1 - p)))
+
+
+def quantize(x, zp, scale, qmin=-128, qmax=127):
+    # Affine int8 quantization of a float tensor, q = round(x / scale) + zp
+    return np.clip(np.round(np.asarray(x, dtype=np.float32) / scale) + zp, qmin, qmax).astype(np.int8)
+
+
+def dequantize(q, zp, scale):
+    # Inverse of quantize(), float32 as in decode_head_sparse()
+    return (q.astype(np.float32) - zp) * np.float32(scale)
+
+
+def quantize_threshold(conf_thres, zp, scale, qmin=-128, qmax=127):
+    # conf_thres as an int8 threshold: q > result <=> sigmoid((q - zp) * scale) > conf_thres
+    return int(np.clip(np.floor(logit(conf_thres) / scale + zp), qmin - 1, qmax))
+
+
+def logit_threshold(conf_thres, margin=1e-4):
+    # conf_thres as a float logit threshold, x > result for every x with sigmoid(x) > conf_thres; the margin
+    # absorbs float rounding at the boundary, filter_predictions() applies the exact threshold afterwards
+    return logit(conf_thres) - margin if conf_thres > 0 else -np.inf
+
+
+def decode_head_sparse(x, anchors, stride, thres, qparams=None):
+    """Decode one head x(na,ny,nx,no) only at cells whose raw objectness beats thres, returns (n,no)
+
+    thres is a logit for float x, or an int8 threshold for quantized x with qparams (zero_point, scale); sigmoid
+    and dequantization run on the surviving cells only.
+    """
+    a, gy, gx = np.nonzero(x[..., 4] > thres)  # one compare over the objectness channel
+    y = x[a, gy, gx]  # survivors (n,no)
+    y = sigmoid(dequantize(y, *qparams) if qparams is not None else y.astype(np.float32))
+    y[:, 0] = (y[:, 0] * 2. - 0.5 + gx) * stride  # x
+    y[:, 1] = (y[:, 1] * 2. - 0.5 + gy) * stride  # y
+    y[:, 2:4] = (y[:, 2:4] * 2) ** 2 * anchors[a]  # wh
+    return y
+
+
+def xywh2xyxy(x):
+    # Convert nx4 boxes from [x, y, w, h] to [x1, y1, x2, y2] where xy1=top-left, xy2=bottom-right
+    y = np.empty_like(x)
+    y[:, 0:2] = x[:, 0:2] - x[:, 2:4] / 2  # top left xy
+    y[:, 2:4] = x[:, 0:2] + x[:, 2:4] / 2  # bottom right xy
+    return y
+
+
+def filter_predictions(pred, conf_thres=0.25):
+    """Turn decoded (n,5+nc) predictions into an (N,6) array of [x1, y1, x2, y2, conf, cls]"""
+    pred = pred[pred[:, 4] > conf_thres]  # objectness candidates
+    if not len(pred):
+        return np.zeros((0, 6), dtype=np.float32)
+    j = pred[:, 5:].argmax(1)
+    conf = pred[:, 4] * pred[np.arange(len(pred)), 5 + j]  # conf = obj_conf * cls_conf
+    keep = conf > conf_thres
+    return np.concatenate((xywh2xyxy(pred[keep, :4]), conf[keep, None], j[keep, None].astype(np.float32)), 1)
+
+
+def decode_outputs(outputs, input_size=(640, 640), conf_thres=0.25, anchors=ANCHORS, strides=STRIDES,
+                   qparams=None):
+    """Decode all raw YOLOv5 heads in one vectorized pass each, returns (N,6) [x1, y1, x2, y2, conf, cls]
+
+    Objectness is thresholded before any sigmoid, on logits for float outputs and in the int8 domain for integer
+    outputs with qparams, a (zero_point, scale) per output, so only candidate cells are dequantized and decoded.
+    """
+    na = anchors.shape[1]
+    z = []
+    for i, out in enumerate(outputs):
+        x = head_to_grid(out, na)
+        stride = input_size[1] // x.shape[1]
+        a = anchors[strides.index(stride)]
+        if qparams is not None and np.issubdtype(x.dtype, np.integer):
+            zp, scale = qparams[i]
+            z.append(decode_head_sparse(x, a, stride, quantize_threshold(conf_thres, zp, scale), (zp, scale)))
+        else:
+            z.append(decode_head_sparse(x, a, stride, logit_threshold(conf_thres)))
+    return filter_predictions(np.concatenate(z, 0), conf_thres)
+
+
+def nms(boxes, scores, iou_thres=0.5, max_matrix=2048):
+    """Greedy NMS over (n,4) xyxy boxes, returns kept indices by descending score
+
+    Up to max_matrix boxes the pairwise IoU matrix is computed in one pass, leaving one cheap row operation per
+    box; larger inputs suppress iteratively to bound memory.
+    """
+    order = scores.argsort()[::-1]
+    if order.size > max_matrix:
+        return _nms_iterative(boxes, order, iou_thres)
+    b = boxes[order].astype(np.float32)
+    areas = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    w = np.clip(np.minimum(b[:, None, 2], b[None, :, 2]) - np.maximum(b[:, None, 0], b[None, :, 0]), 0, None)
+    h = np.clip(np.minimum(b[:, None, 3], b[None, :, 3]) - np.maximum(b[:, None, 1], b[None, :, 1]), 0, None)
+    inter = w * h
+    over = inter > iou_thres * (areas[:, None] + areas[None, :] - inter + 1e-9)  # iou > iou_thres
+    keep = np.ones(len(b), dtype=bool)
+    for i in range(len(b)):
+        if keep[i]:
+            keep[i + 1:] &= ~over[i, i + 1:]
+    return order[keep]
+
+
+def _nms_iterative(boxes, order, iou_thres):
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    keep = []
+    while order.size:
+        i, rest = order[0], order[1:]
+        keep.append(i)
+        w = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        h = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        inter = w * h
+        order = rest[inter / (areas[i] + areas[rest] - inter + 1e-9) <= iou_thres]
+    return np.array(keep, dtype=np.int64)
+
+
+def non_max_suppression(det, iou_thres=0.5, agnostic=False, max_det=300):
+    """Per-class NMS on an (N,6) detection array, NumPy counterpart of utils.general.non_max_suppression"""
+    if not len(det):
+        return det
+    c = det[:, 5:6] * (0 if agnostic else 4096)  # class offsets, 4096 = max box wh
+    i = nms(det[:, :4] + c, det[:, 4], iou_thres)[:max_det]
+    return det[i]
+
+
+def scale_boxes(det, input_size, img0_shape):
+    # Rescale xyxy boxes in place from the stretched network input (w,h) to img0 (h,w), then clip
+    h, w = img0_shape[:2]
+    det[:, [0, 2]] = (det[:, [0, 2]] * (w / input_size[0])).clip(0, w)
+    det[:, [1, 3]] = (det[:, [1, 3]] * (h / input_size[1])).clip(0, h)
+    return det
+
+
+def postprocess_predictions(pred, input_size, img0_shape, conf_thres=0.25, iou_thres=0.5):
+    """Decoded (1,n,5+nc) predictions, e.g. of a YOLOv5 ONNX export, to (N,6) [x1, y1, x2, y2, conf, cls] in img0
+    pixels: objectness mask, class argmax, bulk xywh to xyxy, per-class NMS and rescale without a Python loop"""
+    pred = np.asarray(pred, dtype=np.float32)
+    if pred.ndim == 3:
+        pred = pred[0]
+    return scale_boxes(non_max_suppression(filter_predictions(pred, conf_thres), iou_thres), input_size, img0_shape)
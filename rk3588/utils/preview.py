@@ -0,0 +1,159 @@
+# MJPEG HTTP preview: each stream's annotated frames are JPEG-encoded once and shared by all connected viewers
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+from utils.sinks import Sink
+
+
+class PreviewStream:
+    """Latest encoded JPEG of one stream plus the number of connected viewers"""
+
+    def __init__(self, name):
+        self.name = name
+        self.cond = threading.Condition()
+        self.jpeg = None
+        self.seq = 0
+        self.clients = 0
+        self.encoded = 0  # frames encoded
+
+    def publish(self, jpeg):
+        with self.cond:
+            self.jpeg = jpeg
+            self.seq += 1
+            self.encoded += 1
+            self.cond.notify_all()
+
+    def wait(self, seq, timeout=5.0):
+        # Return (seq, jpeg) of a frame newer than seq, or (seq, None) on timeout
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq > seq, timeout):
+                return seq, None
+            return self.seq, self.jpeg
+
+
+class PreviewServer:
+    """HTTP server on a background thread, GET / lists the streams, /stream/<name> is MJPEG, /snapshot/<name> a JPEG"""
+
+    def __init__(self, port=8080, host='0.0.0.0', fps=5.0, width=640, quality=70):
+        self.host = host
+        self.port = port
+        self.fps = fps
+        self.width = width
+        self.quality = quality
+        self.streams = {}
+        self.httpd = None
+        self.thread = None
+
+    def stream(self, name):
+        if name not in self.streams:
+            self.streams[name] = PreviewStream(name)
+        return self.streams[name]
+
+    def start(self):
+        server = self
+
+        class Handler(PreviewHandler):
+            preview = server
+
+        self.httpd = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.thread.join()
+            self.httpd = None
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    preview = None  # PreviewServer, set by PreviewServer.start()
+
+    def log_message(self, format, *args):
+        pass  # no per-request logging
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        kind, _, name = path.lstrip('/').partition('/')
+        if not path:
+            self._index()
+        elif kind in ('stream', 'snapshot') and name in self.preview.streams:
+            (self._mjpeg if kind == 'stream' else self._snapshot)(self.preview.streams[name])
+        else:
+            self.send_error(404)
+
+    def _index(self):
+        body = ''.join('<h3>%s</h3><img src="/stream/%s">' % (name, name) for name in self.preview.streams)
+        body = ('<html><head><title>Fire Detection Preview</title></head><body>%s</body></html>' % body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _snapshot(self, stream):
+        with stream.cond:
+            stream.clients += 1  # ask the sink for a frame
+        try:
+            _, jpeg = stream.wait(0, timeout=5.0) if stream.jpeg is None else (0, stream.jpeg)
+        finally:
+            with stream.cond:
+                stream.clients -= 1
+        if jpeg is None:
+            self.send_error(503)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(jpeg)))
+        self.end_headers()
+        self.wfile.write(jpeg)
+
+    def _mjpeg(self, stream):
+        self.send_response(200)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+        self.end_headers()
+        with stream.cond:
+            stream.clients += 1
+        try:
+            seq = 0
+            while self.preview.httpd is not None:
+                seq, jpeg = stream.wait(seq)
+                if jpeg is None:
+                    continue
+                self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n' % len(jpeg))
+                self.wfile.write(jpeg)
+                self.wfile.write(b'\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # viewer disconnected
+        finally:
+            with stream.cond:
+                stream.clients -= 1
+
+
+class PreviewSink(Sink):
+    """Encode annotated frames of one stream for a PreviewServer, at most server.fps per second, downscaled to
+    server.width, and only while a viewer is connected"""
+
+    def __init__(self, server, name='preview'):
+        self.server = server
+        self.stream = server.stream(name)
+        self.last = 0.0
+
+    def write(self, result):
+        now = time.time()
+        if not self.stream.clients or now - self.last < 1 / self.server.fps:
+            return
+        self.last = now
+        image = result.image
+        h, w = image.shape[:2]
+        if w > self.server.width:
+            image = cv2.resize(image, (self.server.width, round(h * self.server.width / w)),
+                               interpolation=cv2.INTER_AREA)
+        self.stream.publish(cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.server.quality])[1].tobytes())
@@ -0,0 +1,118 @@
+# Event clip recording: keep the last seconds of video in memory and only encode/write clips around events
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+
+class EventRecorder:
+    """Pre-event ring buffer plus background clip writer for one stream
+
+    push(frame, event, t, render) keeps frames of the last pre_seconds in a bounded ring, as raw copies by default
+    or as JPEG packets when jpeg_quality > 0 (about 10x less memory, but every kept frame is encoded). The first
+    event frame starts a clip with the ring contents, and every frame up to post_seconds after the last event
+    frame is appended to it. render(frame), e.g. drawing the frame's detections, is deferred with the frame and
+    only runs on the writer thread for frames that end up in a clip, where they are also encoded and written,
+    so push() never draws or touches the disk.
+    """
+
+    def __init__(self, output_dir='events', pre_seconds=5.0, post_seconds=10.0, max_fps=15.0, jpeg_quality=0,
+                 name='event', fourcc='mp4v'):
+        self.output_dir = output_dir
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.min_interval = 1 / max_fps if max_fps else 0  # ring and clip frame rate cap
+        self.jpeg_quality = jpeg_quality
+        self.name = name
+        self.fourcc = fourcc
+        self.ring = deque(maxlen=max(int(pre_seconds * (max_fps or 30)), 1))  # (t, (packet, render))
+        self.last_push = 0.0
+        self.clip = None  # queue.Queue of the clip being recorded
+        self.clip_end = 0.0
+        self.clips = []  # paths of started clips
+        self.writes = queue.Queue()  # (path, fps, clip queue) per clip
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    @property
+    def recording(self):
+        return self.clip is not None
+
+    def _packet(self, frame):
+        if self.jpeg_quality:
+            return cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])[1]
+        return frame.copy()
+
+    def wants(self, t, event=False):
+        # Whether push() at time t would keep the frame, to skip producing frames the frame rate cap drops
+        return t - self.last_push >= self.min_interval - 1e-3 or (event and not self.recording)
+
+    def push(self, frame, event=False, t=None, render=None):
+        t = time.time() if t is None else t
+        if not self.wants(t, event):
+            return
+        self.last_push = t
+        packet = (self._packet(frame), render)
+
+        if event:
+            if self.clip is None:
+                self._start(t)
+            self.clip_end = t + self.post_seconds
+        if self.clip is not None:
+            self.clip.put(packet)
+            if t >= self.clip_end:
+                self.clip.put(None)
+                self.clip = None
+        else:
+            self.ring.append((t, packet))
+        while self.ring and t - self.ring[0][0] > self.pre_seconds:
+            self.ring.popleft()
+
+    def _start(self, t):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, '%s_%s.mp4' % (self.name, datetime.now().strftime('%Y%m%d_%H%M%S')))
+        span = t - self.ring[0][0] if self.ring else 0
+        fps = float(np.clip(len(self.ring) / span, 1, 30)) if span > 0 else 1 / (self.min_interval or 1 / 15)
+        self.clip = queue.Queue()
+        for _, packet in self.ring:
+            self.clip.put(packet)
+        self.ring.clear()
+        self.clips.append(path)
+        self.writes.put((path, fps, self.clip))
+
+    def _writer(self):
+        while True:
+            job = self.writes.get()
+            if job is None:
+                break
+            path, fps, clip = job
+            writer = None
+            while True:
+                packet = clip.get()
+                if packet is None:
+                    break
+                frame, render = packet
+                if self.jpeg_quality:
+                    frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
+                if render is not None:
+                    frame = render(frame)
+                if writer is None:
+                    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.fourcc), fps,
+                                             (frame.shape[1], frame.shape[0]))
+                writer.write(frame)
+            if writer is not None:
+                writer.release()
+                print('Event clip saved to %s' % path)
+
+    def close(self):
+        # Finish the current clip and wait for all clips to be written
+        if self.clip is not None:
+            self.clip.put(None)
+            self.clip = None
+        self.writes.put(None)
+        self.thread.join()
@@ -0,0 +1,174 @@
+# Shared memory ring of fixed-size frames, so capture and inference can run in separate processes without pickling
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+MAGIC = 0x46524E47  # 'FRNG'
+HEADER = 8  # int64 fields: magic, slots, h, w, c, latest seq, creator pid, reserved
+
+
+def attach_shm(name):
+    # Attach to a segment owned by another process without letting this process's resource tracker unlink it
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+    return shm
+
+
+class FrameRing:
+    """Single-writer, multi-reader ring of (h,w,c) uint8 frames in one shared memory segment
+
+    Each slot has a sequence number and capture timestamp. The writer marks a slot invalid (seq -1), fills it,
+    stamps it and only then publishes its seq as the newest frame; readers get the newest slot as a zero-copy view.
+
+    NumPy stores carry no memory ordering, and AArch64 may make the published seq visible before the frame bytes,
+    so the seq checks alone do not protect readers there. Pass locks, one multiprocessing.Lock per slot created
+    by the parent and given to the writer and every reader: the writer holds a slot's lock from begin() to
+    commit(), and readers hold(seq) the slot while copying or preprocessing the frame, then release(seq). The lock
+    operations order the frame stores before the reader's loads. Without locks (x86-64 only, which keeps stores in
+    order) readers must copy the frame first and re-check valid(seq) afterwards, dropping it if that fails.
+    """
+
+    def __init__(self, shape=(720, 1280, 3), slots=8, name=None, create=True, locks=None):
+        if create:
+            h, w, c = shape
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=self._size(slots, h * w * c))
+        else:
+            self.shm = attach_shm(name)
+            header = np.ndarray(HEADER, dtype=np.int64, buffer=self.shm.buf)
+            if header[0] != MAGIC:
+                raise ValueError('%s is not a frame ring' % name)
+            slots, shape = int(header[1]), tuple(int(x) for x in header[2:5])
+            del header
+        self.owner = create
+        self.name = self.shm.name
+        self.slots = slots
+        self.locks = locks
+        if locks is not None and len(locks) != slots:
+            raise ValueError('%g slot locks for %g slots' % (len(locks), slots))
+        self.held = None  # writer: slot locked by begin()
+        self.shape = tuple(shape)
+        buf = self.shm.buf
+        self.header = np.ndarray(HEADER, dtype=np.int64, buffer=buf)
+        self.seqs = np.ndarray(slots, dtype=np.int64, buffer=buf, offset=HEADER * 8)
+        self.times = np.ndarray(slots, dtype=np.float64, buffer=buf, offset=(HEADER + slots) * 8)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=buf, offset=self._offset(slots))
+        if create:
+            self.seqs[:] = -1
+            self.header[:] = [MAGIC, slots, *shape, -1, os.getpid(), 0]
+        self.seq = int(self.header[5])  # writer: next seq - 1
+
+    @staticmethod
+    def _offset(slots):
+        return ((HEADER + 2 * slots) * 8 + 63) // 64 * 64  # frames start 64-byte aligned
+
+    @classmethod
+    def _size(cls, slots, frame_size):
+        return cls._offset(slots) + slots * frame_size
+
+    @classmethod
+    def attach(cls, name, locks=None):
+        return cls(name=name, create=False, locks=locks)
+
+    @property
+    def latest(self):
+        return int(self.header[5])
+
+    def offset(self, seq):
+        # Byte offset of a frame's slot in the segment, e.g. as a utils.daemon request handle
+        return self._offset(self.slots) + (seq % self.slots) * self.frames[0].nbytes
+
+    # Writer
+    def begin(self):
+        """Return (seq, slot view) to fill, e.g. with cap.read(view); publish it with commit()
+
+        A begin() without commit(), e.g. after a failed read, leaves its slot invalid and is abandoned by the next.
+        """
+        self._unlock()
+        self.seq += 1
+        i = self.seq % self.slots
+        if self.locks is not None:
+            self.locks[i].acquire()  # waits for readers still holding the slot
+            self.held = i
+        self.seqs[i] = -1  # invalidate before overwriting
+        return self.seq, self.frames[i]
+
+    def commit(self, t=None):
+        i = self.seq % self.slots
+        self.times[i] = time.time() if t is None else t
+        self.seqs[i] = self.seq
+        self._unlock()  # orders the frame and stamp stores before the publish
+        self.header[5] = self.seq  # publish as newest
+
+    def _unlock(self):
+        if self.held is not None:
+            self.locks[self.held].release()
+            self.held = None
+
+    def write(self, frame, t=None):
+        seq, view = self.begin()
+        view[:] = frame
+        self.commit(t)
+        return seq
+
+    # Readers
+    def valid(self, seq):
+        return seq >= 0 and self.seqs[seq % self.slots] == seq
+
+    def hold(self, seq):
+        """Keep the writer off seq's slot until release(seq); False, with nothing held, if seq was overwritten
+
+        Without locks this only checks valid(seq): copy the frame, then re-check valid(seq).
+        """
+        if self.locks is None:
+            return self.valid(seq)
+        lock = self.locks[seq % self.slots]
+        lock.acquire()
+        if self.valid(seq):
+            return True
+        lock.release()
+        return False
+
+    def release(self, seq):
+        if self.locks is not None:
+            self.locks[seq % self.slots].release()
+
+    def read(self, last=-1):
+        """Return (seq, capture time, frame view) of the newest frame if newer than last, else None
+
+        The writer may overwrite the view at any time: use it between hold(seq) and release(seq), or without
+        locks copy it and drop the copy unless valid(seq) still holds afterwards.
+        """
+        seq = self.latest
+        if seq <= last:
+            return None
+        i = seq % self.slots
+        t = float(self.times[i])
+        if not self.valid(seq):
+            return None  # overwritten while reading the index, retry
+        return seq, t, self.frames[i]
+
+    def wait(self, last=-1, timeout=1.0, poll=0.002):
+        # Poll until a frame newer than last is published
+        deadline = time.time() + timeout
+        while True:
+            item = self.read(last)
+            if item is not None or time.time() > deadline:
+                return item
+            time.sleep(poll)
+
+    def close(self):
+        self._unlock()
+        del self.header, self.seqs, self.times, self.frames  # release the views before unmapping
+        try:
+            self.shm.close()
+        except BufferError:
+            pass  # frames handed out by read() are still referenced, the mapping goes with them
+        if self.owner:
+            # Readers spawned by the same parent share its resource tracker and unregistered the segment on attach
+            resource_tracker.register(self.shm._name, 'shared_memory')
+            self.shm.unlink()
@@ -0,0 +1,186 @@
+# Output sinks for detection results; annotated frames are drawn lazily, at most once, and only if a sink needs pixels
+import json
+import os
+import time
+from datetime import datetime
+
+import cv2
+
+
+class FrameResult:
+    """Detections of one frame; `image` draws them on the frame on first access with annotate(result)"""
+
+    def __init__(self, frame, boxes, scores, class_ids, track_ids=None, t0=None, name='', info=(), annotate=None):
+        self.frame = frame
+        self.boxes = boxes
+        self.scores = scores
+        self.class_ids = class_ids
+        self.track_ids = track_ids
+        self.t0 = time.time() if t0 is None else t0  # capture time
+        self.name = name  # stream name, e.g. cam0
+        self.info = list(info)  # overlay text lines
+        self.annotate = annotate
+        self._image = None
+
+    def __len__(self):
+        return len(self.boxes)
+
+    @property
+    def annotated(self):
+        return self._image is not None
+
+    @property
+    def image(self):
+        if self._image is None:
+            self._image = self.annotate(self) if self.annotate else self.frame
+        return self._image
+
+    def detached(self):
+        # Copy without the frame, whose redraw(frame) annotates a stored copy of the frame later
+        return FrameResult(None, self.boxes, self.scores, self.class_ids, self.track_ids, self.t0, self.name,
+                           self.info, self.annotate)
+
+    def redraw(self, frame):
+        self.frame, self._image = frame, None
+        return self.image
+
+
+class Sink:
+    """Output for FrameResults; write() should only access result.image when it needs pixels"""
+
+    def write(self, result):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class DisplaySink(Sink):
+    # cv2.imshow window, raises StopIteration on 'q' or ESC
+    def __init__(self, window='Fire Detection'):
+        self.window = window
+
+    def write(self, result):
+        cv2.imshow(self.window, result.image)
+        if cv2.waitKey(1) & 0xFF in (ord('q'), 27):
+            raise StopIteration
+
+    def close(self):
+        cv2.destroyWindow(self.window)
+
+
+class VideoSink(Sink):
+    # Continuous recording of every frame, the writer is opened with the first frame's size
+    def __init__(self, path, fps=20.0, fourcc='mp4v'):
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self.writer = None
+
+    def write(self, result):
+        image = result.image
+        if self.writer is None:
+            self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps,
+                                          (image.shape[1], image.shape[0]))
+        self.writer.write(image)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+class RecorderSink(Sink):
+    # utils.recorder.EventRecorder, frames with detections are events; the ring keeps the raw frame and its
+    # detections, which are only drawn if the frame ends up in a clip (unless another sink already drew them)
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def write(self, result):
+        event = len(result) > 0
+        if not self.recorder.wants(result.t0, event):
+            return
+        if result.annotated or result.annotate is None:
+            self.recorder.push(result.image, event, result.t0)
+        else:
+            self.recorder.push(result.frame, event, result.t0, result.detached().redraw)
+
+    def close(self):
+        self.recorder.close()
+
+
+class SnapshotSink(Sink):
+    # JPEG snapshot of frames with detections, at most one per min_interval seconds
+    def __init__(self, output_dir='snapshots', min_interval=5.0, quality=90):
+        self.output_dir = output_dir
+        self.min_interval = min_interval
+        self.quality = quality
+        self.last = 0.0
+        self.saved = 0
+
+    def write(self, result):
+        if not len(result) or result.t0 - self.last < self.min_interval:
+            return
+        self.last = result.t0
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, '%s%s_%g.jpg' % (
+            result.name + '_' if result.name else '', datetime.now().strftime('%Y%m%d_%H%M%S'), self.saved))
+        cv2.imwrite(path, result.image, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        self.saved += 1
+
+
+class EventLogSink(Sink):
+    # Detections as JSON lines, printed when path is None; never needs pixels
+    def __init__(self, class_names, path=None):
+        self.class_names = class_names
+        self.file = open(path, 'a') if path else None
+
+    def write(self, result):
+        if not len(result):
+            return
+        event = {'time': datetime.fromtimestamp(result.t0).isoformat(timespec='milliseconds'),
+                 'source': result.name,
+                 'latency_ms': round((time.time() - result.t0) * 1000, 1),
+                 'detections': [{'class': self.class_names[int(c)], 'conf': round(float(s), 3),
+                                 'box': [int(x) for x in b]}
+                                for b, s, c in zip(result.boxes, result.scores, result.class_ids)]}
+        if result.track_ids:
+            for d, i in zip(event['detections'], result.track_ids):
+                d['id'] = int(i)
+        line = json.dumps(event, ensure_ascii=False)
+        if self.file is None:
+            print(line)
+        else:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class SinkGroup:
+    """Write every result to all sinks, counting how many frames needed annotation"""
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.frames = 0
+        self.annotated = 0
+
+    def __len__(self):
+        return len(self.sinks)
+
+    def add(self, sink):
+        self.sinks.append(sink)
+        return sink
+
+    def write(self, result):
+        self.frames += 1
+        try:
+            for sink in self.sinks:
+                sink.write(result)
+        finally:
+            self.annotated += result.annotated
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
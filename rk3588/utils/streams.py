@@ -0,0 +1,243 @@
+# Video sources for the RK3588 detectors: source lists, capture opening and per-camera capture threads
+import os
+import threading
+import time
+
+import cv2
+
+
+def load_sources(sources):
+    # Same convention as utils.datasets.LoadStreams: a *.txt file with one source per line, or a single source
+    if os.path.isfile(sources) and sources.endswith('.txt'):
+        with open(sources, 'r') as f:
+            return [x.strip() for x in f.read().splitlines() if len(x.strip()) and not x.strip().startswith('#')]
+    return [sources]
+
+
+def is_live(source):
+    return str(source).isdigit() or str(source).lower().startswith(('rtsp://', 'rtmp://', 'http://', 'https://'))
+
+
+def open_capture(source, pipeline=None, timeout=5.0):
+    """Open a webcam index, RTSP url (FFmpeg backend, 1-frame buffer) or video file
+
+    pipeline: a GStreamer pipeline (contains '!', {source} is replaced by the source) or FFmpeg capture
+    options 'key;value|key;value', e.g. 'rtsp_transport;tcp|fflags;nobuffer'
+    """
+    source = str(source)
+    if pipeline and '!' in pipeline:
+        return cv2.VideoCapture(pipeline.replace('{source}', source), cv2.CAP_GSTREAMER)
+    if source.isdigit():
+        return cv2.VideoCapture(int(source))
+    if is_live(source):
+        if pipeline:
+            os.environ['OPENCV_FFMPEG_CAPTURE_OPTIONS'] = pipeline
+        params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(timeout * 1000), cv2.CAP_PROP_READ_TIMEOUT_MSEC,
+                  int(timeout * 1000)] if hasattr(cv2, 'CAP_PROP_READ_TIMEOUT_MSEC') else []  # OpenCV>=4.6
+        cap = cv2.VideoCapture(source, cv2.CAP_FFMPEG, params)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+    return cv2.VideoCapture(source)
+
+
+class LatestFrameGrabber:
+    """Background capture thread that only keeps the newest decoded frame and its capture time
+
+    read() returns a frame not returned before, so a slow consumer always gets the latest frame and never a
+    backlog. A failed open or read of a live source reconnects with exponential backoff (backoff[0] doubling up
+    to backoff[1] seconds) instead of ending the stream; a video file that fails to open ends it. Video files are read at their own frame rate like a live stream
+    and, with loop=True, reopened at the end, e.g. to test reconnects with a local file.
+    """
+
+    def __init__(self, source, pipeline=None, loop=False, backoff=(0.5, 30.0), timeout=5.0):
+        self.source = str(source)
+        self.pipeline = pipeline
+        self.live = is_live(source) or bool(pipeline and '!' in pipeline)
+        self.loop = loop
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.frame = None
+        self.t = 0.0  # capture time of self.frame
+        self.seq = 0  # frames grabbed
+        self.last = 0  # seq of the last frame returned by read()
+        self.dropped = 0  # frames replaced before they were read
+        self.reconnects = 0
+        self.connected = False
+        self.ended = False
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def wait(self, timeout=None):
+        # Wait for the first frame, returns False on timeout or end of stream
+        with self.cond:
+            return self.cond.wait_for(lambda: self.frame is not None or self.ended, timeout) and self.frame is not None
+
+    def read(self, timeout=None):
+        """Return (frame, capture time) of a new frame, or (None, None) on timeout, end of stream or stop()"""
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.seq > self.last or self.ended, timeout) or self.seq == self.last:
+                return None, None
+            self.last = self.seq
+            return self.frame, self.t
+
+    def _sleep(self, seconds):
+        with self.cond:
+            self.cond.wait_for(lambda: not self.running, seconds)
+
+    def _run(self):
+        delay = self.backoff[0]
+        while self.running:
+            cap = open_capture(self.source, self.pipeline, self.timeout)
+            if not cap.isOpened():
+                cap.release()
+                if not self.live:
+                    print('Failed to open %s' % self.source)  # a missing file will not appear by retrying
+                    break
+                print('Failed to open %s, retrying in %.1fs' % (self.source, delay))
+                self._sleep(delay)
+                delay = min(delay * 2, self.backoff[1])
+                continue
+
+            interval = 0 if self.live else 1 / (cap.get(cv2.CAP_PROP_FPS) or 25)  # pace files like a live stream
+            grabbed = 0
+            while self.running:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                t = time.time()
+                with self.cond:
+                    self.dropped += self.seq > self.last
+                    self.frame, self.t = frame, t
+                    self.seq += 1
+                    self.connected = True
+                    self.cond.notify_all()
+                grabbed += 1
+                if grabbed == 1:
+                    delay = self.backoff[0]  # reset backoff once the stream delivers
+                if interval:
+                    time.sleep(max(interval - (time.time() - t), 0))
+            cap.release()
+            self.connected = False
+
+            if not self.running or not (self.live or self.loop):
+                break  # stopped, or end of a video file
+            if self.live:
+                print('Stream %s interrupted, reconnecting in %.1fs' % (self.source, delay))
+                self._sleep(delay)
+                delay = min(delay * 2, self.backoff[1])
+            self.reconnects += 1
+
+        with self.cond:
+            self.ended = True
+            self.cond.notify_all()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class CameraStream:
+    """Capture thread for one camera of a multi-camera process
+
+    A LatestFrameGrabber reads frames continuously, so the stream never lags, and reconnects with backoff when
+    the camera drops. At most fps_budget of the newest frames per second are handed to submit(camera, frame),
+    and at most max_inflight of them may be awaiting results at once. Call done() when a submitted frame's
+    result has been handled. running stays True while reconnecting, until stop() or the end of a video file.
+    """
+
+    def __init__(self, index, source, fps_budget=5.0, max_inflight=2, pipeline=None, loop=False,
+                 backoff=(0.5, 30.0)):
+        self.index = index
+        self.source = source
+        self.fps_budget = fps_budget
+        self.max_inflight = max_inflight
+        self.inflight = threading.BoundedSemaphore(max_inflight)
+        self.grabber = LatestFrameGrabber(source, pipeline, loop, backoff)
+        self.thread = None
+        self.running = False
+        self.submitted = 0  # frames sent to inference
+        self.detections = 0
+
+    @property
+    def frames(self):
+        return self.grabber.seq  # frames read
+
+    def start(self, submit, timeout=10.0):
+        self.grabber.start()
+        if self.grabber.wait(timeout):
+            h, w = self.grabber.frame.shape[:2]
+            print('%g: %s (%gx%g, budget %.1f FPS)' % (self.index, self.source, w, h, self.fps_budget))
+        elif self.grabber.ended:
+            print('%g: failed to open %s' % (self.index, self.source))
+            return False
+        else:
+            print('%g: no frames from %s yet, retrying in the background' % (self.index, self.source))
+        self.running = True
+        self.thread = threading.Thread(target=self._update, args=(submit,), daemon=True)
+        self.thread.start()
+        return True
+
+    def _update(self, submit):
+        interval = 1.0 / self.fps_budget if self.fps_budget > 0 else 0
+        last = 0.0
+        while self.running:
+            if not self.inflight.acquire(timeout=0.5):
+                continue
+            time.sleep(max(last + interval - time.time(), 0))  # fps budget, then take the newest frame
+            frame, _ = self.grabber.read(timeout=0.5)
+            if frame is None:
+                self.inflight.release()
+                if self.grabber.ended:
+                    print('%g: stream ended %s' % (self.index, self.source))
+                    break
+                continue  # reconnecting
+            last = time.time()
+            self.submitted += 1
+            submit(self, frame)
+        self.running = False
+
+    def done(self):
+        self.inflight.release()
+
+    def stop(self):
+        self.running = False
+        self.grabber.stop()
+        if self.thread is not None:
+            self.thread.join()
+
+
+if __name__ == '__main__':
+    # Grabber check with a looped local file as a fake stream: python -m utils.streams --source video.mp4 --loop
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', type=str, required=True, help='video file, RTSP url or webcam index')
+    parser.add_argument('--pipeline', type=str, default=None, help='GStreamer pipeline or FFmpeg capture options')
+    parser.add_argument('--loop', action='store_true', help='reopen video files at the end')
+    parser.add_argument('--seconds', type=float, default=10, help='test duration')
+    parser.add_argument('--consumer-ms', type=float, default=50, help='simulated processing time per frame')
+    opt = parser.parse_args()
+
+    grabber = LatestFrameGrabber(opt.source, opt.pipeline, opt.loop).start()
+    assert grabber.wait(10), 'no frames from %s' % opt.source
+    t, n, age = time.time(), 0, []
+    while time.time() - t < opt.seconds:
+        frame, t0 = grabber.read(timeout=10)
+        if frame is None:
+            break
+        age.append(time.time() - t0)
+        n += 1
+        time.sleep(opt.consumer_ms / 1000)
+    grabber.stop()
+    print('%g frames read, %g grabbed, %g dropped, %g reconnects, mean frame age %.1fms' % (
+        n, grabber.seq, grabber.dropped, grabber.reconnects, 1000 * sum(age) / max(len(age), 1)))
@@ -0,0 +1,109 @@
+# Lightweight IoU multi-object tracker with NumPy state arrays, to carry boxes across frames without inference
+import numpy as np
+
+
+def box_iou(box1, box2):
+    # IoU matrix (n,m) of xyxy boxes box1(n,4) and box2(m,4), NumPy counterpart of utils.general.box_iou
+    area1 = (box1[:, 2] - box1[:, 0]) * (box1[:, 3] - box1[:, 1])
+    area2 = (box2[:, 2] - box2[:, 0]) * (box2[:, 3] - box2[:, 1])
+    lt = np.maximum(box1[:, None, :2], box2[None, :, :2])
+    rb = np.minimum(box1[:, None, 2:], box2[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(2)
+    return inter / (area1[:, None] + area2[None] - inter + 1e-9)
+
+
+class IoUTracker:
+    """Track (N,6) [x1, y1, x2, y2, conf, cls] detections with persistent ids
+
+    Each track keeps an xyxy box and a per-frame velocity, filtered alpha-beta style (a steady-state Kalman
+    filter for a constant-velocity model). Call update(det) on frames that were inferred and predict() on
+    the frames in between; both advance the tracks by one frame and return (M,7) [x1, y1, x2, y2, conf, cls, id]
+    for the tracks matched at the last update. Velocity is applied for at most max_coast frames after a track's
+    last match, e.g. the detection interval, so long gaps between inferences hold boxes instead of drifting them;
+    predict(still=True) holds them too, for frames skipped because nothing moved. Detections are matched greedily
+    to same-class tracks by IoU; a track missed by max_misses consecutive updates is dropped, so its id survives
+    brief detection dropouts.
+    """
+
+    def __init__(self, iou_thres=0.2, max_misses=2, alpha=0.6, beta=0.2, max_coast=10):
+        self.iou_thres = iou_thres
+        self.max_misses = max_misses
+        self.max_coast = max(max_coast, 1)
+        self.alpha = alpha  # position gain
+        self.beta = beta  # velocity gain
+        self.boxes = np.zeros((0, 4), dtype=np.float32)  # xyxy
+        self.vel = np.zeros((0, 4), dtype=np.float32)  # xyxy change per frame
+        self.scores = np.zeros(0, dtype=np.float32)
+        self.classes = np.zeros(0, dtype=np.float32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.age = np.zeros(0, dtype=np.int64)  # frames extrapolated since last matched detection
+        self.misses = np.zeros(0, dtype=np.int64)  # consecutive updates without a matched detection
+        self.area0 = np.zeros(0, dtype=np.float32)  # box area when the track was created
+        self.next_id = 1
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _output(self):
+        i = self.misses == 0
+        return np.concatenate((self.boxes[i], self.scores[i, None], self.classes[i, None],
+                               self.ids[i, None].astype(np.float32)), 1)
+
+    def _advance(self):
+        # Move tracks one frame with their velocity, up to max_coast frames after their last match
+        coast = self.age < self.max_coast
+        self.boxes[coast] += self.vel[coast]
+        self.age[coast] += 1
+
+    def predict(self, still=False):
+        # Propagate all tracks one frame, or keep them in place for a frame without motion
+        if not still:
+            self._advance()
+        return self._output()
+
+    def update(self, det):
+        self._advance()
+        self.misses += 1
+        n = len(det)
+        unmatched = np.ones(n, dtype=bool)
+        if n and len(self):
+            iou = box_iou(self.boxes, det[:, :4])
+            iou[self.classes[:, None] != det[None, :, 5]] = 0  # only match the same class
+            for t, d in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+                if iou[t, d] < self.iou_thres:
+                    break
+                if not unmatched[d] or self.age[t] == 0:
+                    continue  # detection or track already matched
+                residual = det[d, :4] - self.boxes[t]
+                self.boxes[t] += self.alpha * residual
+                self.vel[t] += self.beta * residual / self.age[t]  # residual accumulated over age moved frames
+                self.scores[t] = det[d, 4]
+                self.age[t] = 0
+                self.misses[t] = 0
+                unmatched[d] = False
+
+        # New tracks from unmatched detections
+        new = det[unmatched]
+        k = len(new)
+        self.boxes = np.concatenate((self.boxes, new[:, :4].astype(np.float32)))
+        self.vel = np.concatenate((self.vel, np.zeros((k, 4), dtype=np.float32)))
+        self.scores = np.concatenate((self.scores, new[:, 4].astype(np.float32)))
+        self.classes = np.concatenate((self.classes, new[:, 5].astype(np.float32)))
+        self.ids = np.concatenate((self.ids, np.arange(self.next_id, self.next_id + k)))
+        self.age = np.concatenate((self.age, np.zeros(k, dtype=np.int64)))
+        self.misses = np.concatenate((self.misses, np.zeros(k, dtype=np.int64)))
+        area = (new[:, 2] - new[:, 0]) * (new[:, 3] - new[:, 1])
+        self.area0 = np.concatenate((self.area0, area.astype(np.float32)))
+        self.next_id += k
+
+        # Drop stale tracks
+        keep = self.misses <= self.max_misses
+        for a in ('boxes', 'vel', 'scores', 'classes', 'ids', 'age', 'misses', 'area0'):
+            setattr(self, a, getattr(self, a)[keep])
+        return self._output()
+
+    def growth(self):
+        # Current box area over area at creation for the tracks in the last output, e.g. to alert on spreading fire
+        i = self.misses == 0
+        area = (self.boxes[i, 2] - self.boxes[i, 0]) * (self.boxes[i, 3] - self.boxes[i, 1])
+        return area / np.maximum(self.area0[i], 1)
@@ -10,11 +10,10 @@ import torch
 import torch.backends.cudnn as cudnn
 from numpy import random
 
-from models.experimental import attempt_load
 from utils.datasets import LoadStreams, LoadImages
 from utils.general import (
     check_img_size, non_max_suppression, apply_classifier, scale_coords, xyxy2xywh, plot_one_box, strip_optimizer)
-from utils.torch_utils import select_device, load_classifier, time_synchronized
+from utils.torch_utils import TORCHSCRIPT_CACHE, select_device, load_classifier, load_compiled, time_synchronized
 
 def detect(save_img=False):
     out, source, weights, view_img, save_txt, imgsz = \
@@ -29,10 +28,20 @@ def detect(save_img=False):
     half = device.type != 'cpu'  # half precision only supported on CUDA
 
     # Load model
-    model = attempt_load(weights, map_location=device)  # load FP32 model
-    imgsz = check_img_size(imgsz, s=model.stride.max())  # check img_size
-    if half:
-        model.half()  # to FP16
+    weights = weights if isinstance(weights, list) else [weights]
+    compiled = opt.compile
+    if compiled and (opt.augment or len(weights) > 1):
+        print('WARNING: --compile does not support --augment or ensembles, running the eager model')
+        compiled = False
+    if compiled:  # TorchScript trace for fixed img_size x img_size inputs, loaded in load_compiled() below
+        imgsz = check_img_size(imgsz)  # check img_size
+    else:
+        from models.experimental import attempt_load
+
+        model = attempt_load(weights, map_location=device)  # load FP32 model
+        imgsz = check_img_size(imgsz, s=model.stride.max())  # check img_size
+        if half:
+            model.half()  # to FP16
 
     # Second-stage classifier
     classify = False
@@ -46,19 +55,27 @@ def detect(save_img=False):
     if webcam:
         view_img = True
         cudnn.benchmark = True  # set True to speed up constant image size inference
-        dataset = LoadStreams(source, img_size=imgsz)
+        dataset = LoadStreams(source, img_size=imgsz, auto=not compiled)
     else:
         save_img = True
-        dataset = LoadImages(source, img_size=imgsz)
+        dataset = LoadImages(source, img_size=imgsz, auto=not compiled)
 
     # Get names and colors
-    names = model.module.names if hasattr(model, 'module') else model.names
+    if compiled:
+        t = time.time()
+        shape = (len(dataset.sources) if webcam else 1, 3, imgsz, imgsz)
+        model, names, cache = load_compiled(weights[0], shape, device, half, opt.compile_cache)
+        print('TorchScript model %s from %s (%.3fs)' % ('loaded' if cache == 'hit' else 'compiled', opt.compile_cache,
+                                                        time.time() - t))
+    else:
+        names = model.module.names if hasattr(model, 'module') else model.names
     colors = [[random.randint(0, 255) for _ in range(3)] for _ in range(len(names))]
 
     # Run inference
     t0 = time.time()
-    img = torch.zeros((1, 3, imgsz, imgsz), device=device)  # init img
-    _ = model(img.half() if half else img) if device.type != 'cpu' else None  # run once
+    img = torch.zeros((shape if compiled else (1, 3, imgsz, imgsz)), device=device)  # init img
+    _ = model(img.half() if half else img) if device.type != 'cpu' or compiled else None  # run once
+    _ = model(img.half() if half else img) if compiled else None  # JIT profiling run, optimized from here
     for path, img, im0s, vid_cap in dataset:
         img = torch.from_numpy(img).to(device)
         img = img.half() if half else img.float()  # uint8 to fp16/32
@@ -68,7 +85,7 @@ def detect(save_img=False):
 
         # Inference
         t1 = time_synchronized()
-        pred = model(img, augment=opt.augment)[0]
+        pred = model(img)[0] if compiled else model(img, augment=opt.augment)[0]
 
         # Apply NMS
         pred = non_max_suppression(pred, opt.conf_thres, opt.iou_thres, classes=opt.classes, agnostic=opt.agnostic_nms)
@@ -159,6 +176,8 @@ if __name__ == '__main__':
     parser.add_argument('--agnostic-nms', action='store_true', help='class-agnostic NMS')
     parser.add_argument('--augment', action='store_true', help='augmented inference')
     parser.add_argument('--update', action='store_true', help='update all models')
+    parser.add_argument('--compile', action='store_true', help='run a cached TorchScript trace of the model')
+    parser.add_argument('--compile-cache', type=str, default=str(TORCHSCRIPT_CACHE), help='TorchScript cache folder')
     opt = parser.parse_args()
     print(opt)
 
@@ -19,6 +19,8 @@ from datetime import datetime
 import signal
 import sys
 
+from utils.pipeline import POLICIES, LatencyController, Pipeline, Stage
+
 class RK3588FireDetector:
     def __init__(self, weights_path, img_size=416, conf_thres=0.4, device='cpu'):
         self.weights_path = weights_path
@@ -57,38 +59,43 @@ class RK3588FireDetector:
             print(f"❌ 模型加载失败: {e}")
             return False
     
+    def preprocess(self, frame):
+        """预处理"""
+        return cv2.resize(frame, (self.img_size, self.img_size))
+    
+    def infer(self, img_resized):
+        """推理"""
+        return self.model(img_resized)
+    
+    def parse_results(self, results, frame):
+        """解析结果"""
+        detections = results.pandas().xyxy[0]
+        
+        fire_detections = []
+        if len(detections) > 0:
+            for _, detection in detections.iterrows():
+                if detection['confidence'] > self.conf_thres:
+                    # 将坐标缩放回原始图像
+                    h, w = frame.shape[:2]
+                    x1 = int(detection['xmin'] * w / self.img_size)
+                    y1 = int(detection['ymin'] * h / self.img_size)
+                    x2 = int(detection['xmax'] * w / self.img_size)
+                    y2 = int(detection['ymax'] * h / self.img_size)
+                    
+                    fire_detections.append({
+                        'bbox': [x1, y1, x2, y2],
+                        'confidence': detection['confidence'],
+                        'class': detection['name']
+                    })
+                    
+                    self.detection_count += 1
+        
+        return fire_detections
+    
     def detect_frame(self, frame):
         """检测单帧"""
         try:
-            # 预处理
-            img_resized = cv2.resize(frame, (self.img_size, self.img_size))
-            
-            # 推理
-            results = self.model(img_resized)
-            
-            # 解析结果
-            detections = results.pandas().xyxy[0]
-            
-            fire_detections = []
-            if len(detections) > 0:
-                for _, detection in detections.iterrows():
-                    if detection['confidence'] > self.conf_thres:
-                        # 将坐标缩放回原始图像
-                        h, w = frame.shape[:2]
-                        x1 = int(detection['xmin'] * w / self.img_size)
-                        y1 = int(detection['ymin'] * h / self.img_size)
-                        x2 = int(detection['xmax'] * w / self.img_size)
-                        y2 = int(detection['ymax'] * h / self.img_size)
-                        
-                        fire_detections.append({
-                            'bbox': [x1, y1, x2, y2],
-                            'confidence': detection['confidence'],
-                            'class': detection['name']
-                        })
-                        
-                        self.detection_count += 1
-            
-            return fire_detections
+            return self.parse_results(self.infer(self.preprocess(frame)), frame)
         except Exception as e:
             print(f"检测错误: {e}")
             return []
@@ -112,8 +119,11 @@ class RK3588FireDetector:
         
         return frame
     
-    def run(self, source, save_video=False, show_display=False, log_detections=True):
-        """运行检测"""
+    def run(self, source, save_video=False, show_display=False, log_detections=True, queue_size=2, policy=None,
+            latency_slo=None):
+        """运行检测，policy为None时RTSP丢弃最旧帧、文件阻塞等待
+        latency_slo: 采集到结果的p95延迟目标(毫秒)，超出时自动跳帧；为None时RTSP默认1000ms，其他输入源不跳帧
+        """
         print(f"🎥 启动检测 - 输入源: {source}")
         
         # 打开视频源
@@ -148,62 +158,109 @@ class RK3588FireDetector:
         self.running = True
         frame_count = 0
         
-        try:
-            while self.running:
-                ret, frame = cap.read()
-                if not ret:
-                    print("📺 视频流结束或读取失败")
-                    break
-                
-                frame_count += 1
-                
-                # 检测
-                detections = self.detect_frame(frame)
-                
-                # 绘制结果
-                if detections:
-                    frame = self.draw_detections(frame, detections)
-                    
-                    # 记录检测结果
-                    if log_detections:
-                        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        print(f"🔥 [{timestamp}] 检测到 {len(detections)} 个目标")
-                        for i, det in enumerate(detections):
-                            print(f"   目标{i+1}: {det['class']} (置信度: {det['confidence']:.3f})")
-                
-                # 显示FPS和状态信息
-                elapsed_time = time.time() - self.start_time
-                if elapsed_time > 1:
-                    current_fps = frame_count / elapsed_time
-                    
-                    # 在画面上显示信息
-                    info_text = f"FPS: {current_fps:.1f} | Detections: {self.detection_count}"
-                    cv2.putText(frame, info_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                    
-                    # 重置计数器
-                    if elapsed_time > 5:  # 每5秒重置一次
-                        self.start_time = time.time()
-                        frame_count = 0
+        # 延迟控制: 根据采集到结果的延迟动态跳帧，保证告警实时性
+        if latency_slo is None and str(source).startswith('rtsp://'):
+            latency_slo = 1000
+        controller = LatencyController(latency_slo / 1000) if latency_slo else None
+        
+        def capture():
+            if not self.running:
+                return None
+            ret, frame = cap.read()
+            if not ret:
+                print("📺 视频流结束或读取失败")
+                return None
+            if controller is not None and not controller.admit():
+                return []  # 照常读帧避免缓冲堆积，但不送入流水线
+            return {'frame': frame, 't0': time.time()}
+        
+        def preprocess(item):
+            item['img'] = self.preprocess(item['frame'])
+            return item
+        
+        def infer(item):
+            try:
+                item['results'] = self.infer(item['img'])
+            except Exception as e:
+                print(f"检测错误: {e}")
+                item['results'] = None
+            return item
+        
+        def postprocess(item):
+            try:
+                item['detections'] = self.parse_results(item['results'], item['frame']) if item['results'] is not None else []
+            except Exception as e:
+                print(f"检测错误: {e}")
+                item['detections'] = []
+            return item
+        
+        def sink(item):
+            nonlocal frame_count
+            frame, detections = item['frame'], item['detections']
+            frame_count += 1
+            if controller is not None:
+                controller.observe(time.time() - item['t0'])
+            
+            # 绘制结果
+            if detections:
+                frame = self.draw_detections(frame, detections)
                 
-                # 保存视频
-                if save_video and out:
-                    out.write(frame)
+                # 记录检测结果
+                if log_detections:
+                    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    print(f"🔥 [{timestamp}] 检测到 {len(detections)} 个目标")
+                    for i, det in enumerate(detections):
+                        print(f"   目标{i+1}: {det['class']} (置信度: {det['confidence']:.3f})")
+            
+            # 显示FPS和状态信息
+            elapsed_time = time.time() - self.start_time
+            if elapsed_time > 1:
+                current_fps = frame_count / elapsed_time
                 
-                # 显示图像（如果启用）
-                if show_display:
-                    cv2.imshow('RK3588 Fire Detection', frame)
-                    key = cv2.waitKey(1) & 0xFF
-                    if key == ord('q') or key == 27:  # q键或ESC键退出
-                        break
+                # 在画面上显示信息
+                info_text = f"FPS: {current_fps:.1f} | Detections: {self.detection_count}"
+                cv2.putText(frame, info_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
                 
-                # CPU使用率控制
-                time.sleep(0.01)  # 10ms延迟，避免CPU占用过高
+                # 重置计数器
+                if elapsed_time > 5:  # 每5秒重置一次
+                    print(f"⏱️  各阶段: {pipeline.report()}")
+                    if controller is not None:
+                        print(f"🎯 延迟控制: {controller.report()}")
+                    self.start_time = time.time()
+                    frame_count = 0
+            
+            # 保存视频
+            if save_video and out:
+                out.write(frame)
+            
+            # 显示图像（如果启用）
+            if show_display:
+                cv2.imshow('RK3588 Fire Detection', frame)
+                key = cv2.waitKey(1) & 0xFF
+                if key == ord('q') or key == 27:  # q键或ESC键退出
+                    raise StopIteration
+
+        
+        # 采集 -> 预处理 -> 推理 -> 解析 -> 输出，各阶段独立线程，有界队列连接
+        if policy is None:
+            policy = 'drop_oldest' if str(source).startswith('rtsp://') else 'block'
+        pipeline = Pipeline([
+            Stage('capture', capture),
+            Stage('preprocess', preprocess),
+            Stage('infer', infer),
+            Stage('postprocess', postprocess),
+            Stage('sink', sink),
+        ], queue_size, policy)
+        
+        try:
+            pipeline.run()
         
         except KeyboardInterrupt:
             print("\n⏹️  收到停止信号")
         
         finally:
             self.running = False
+            pipeline.stop()
             cap.release()
             if out:
                 out.release()
@@ -211,6 +268,9 @@ class RK3588FireDetector:
                 cv2.destroyAllWindows()
             
             print("✅ 检测结束")
+            print(f"⏱️  各阶段: {pipeline.report()}")
+            if controller is not None:
+                print(f"🎯 延迟控制: {json.dumps(controller.stats())}")
             print(f"📊 总计检测到 {self.detection_count} 个目标")
 
 def signal_handler(sig, frame):
@@ -231,6 +291,11 @@ def main():
     parser.add_argument('--save-vid', action='store_true', help='保存检测视频')
     parser.add_argument('--view-img', action='store_true', help='显示检测窗口')
     parser.add_argument('--no-log', action='store_true', help='不记录检测日志')
+    parser.add_argument('--queue-size', type=int, default=2, help='流水线各阶段队列长度')
+    parser.add_argument('--queue-policy', type=str, default=None, choices=POLICIES,
+                        help='队列满时策略 (默认: RTSP丢弃最旧帧, 其他阻塞)')
+    parser.add_argument('--latency-slo', type=float, default=None,
+                        help='采集到结果的p95延迟目标(ms)，超出时自动跳帧 (默认: RTSP 1000ms, 其他不跳帧)')
     
     args = parser.parse_args()
     
@@ -265,7 +330,10 @@ def main():
         source=args.source,
         save_video=args.save_vid,
         show_display=args.view_img,
-        log_detections=not args.no_log
+        log_detections=not args.no_log,
+        queue_size=args.queue_size,
+        policy=args.queue_policy,
+        latency_slo=args.latency_slo
     )
 
 if __name__ == '__main__':
@@ -2,6 +2,9 @@
 
 Usage:
     $ export PYTHONPATH="$PWD" && python models/export.py --weights ./weights/yolov5s.pt --img 640 --batch 1
+    $ export PYTHONPATH="$PWD" && python models/export.py --weights ./weights/yolov5s.pt --nms  # (K,6) detections
+    $ export PYTHONPATH="$PWD" && python models/export.py --weights ./weights/yolov5s.pt --uint8-input bgr  # raw frames
+    $ export PYTHONPATH="$PWD" && python models/export.py --weights ./weights/yolov5s.pt --dynamic  # any batch size
 """
 
 import argparse
@@ -15,6 +18,13 @@ if __name__ == '__main__':
     parser.add_argument('--weights', type=str, default='./yolov5s.pt', help='weights path')
     parser.add_argument('--img-size', nargs='+', type=int, default=[640, 640], help='image size')
     parser.add_argument('--batch-size', type=int, default=1, help='batch size')
+    parser.add_argument('--dynamic', action='store_true', help='ONNX: dynamic batch axis, e.g. to batch several streams')
+    parser.add_argument('--nms', action='store_true', help='ONNX: append decode and NMS, output (K,6) detections')
+    parser.add_argument('--conf-thres', type=float, default=0.25, help='ONNX --nms object confidence threshold')
+    parser.add_argument('--iou-thres', type=float, default=0.45, help='ONNX --nms IOU threshold')
+    parser.add_argument('--max-det', type=int, default=100, help='ONNX --nms maximum detections per image')
+    parser.add_argument('--uint8-input', type=str, default=None, choices=['rgb', 'bgr'],
+                        help='ONNX: uint8 NHWC input in this channel order, normalized in the graph')
     opt = parser.parse_args()
     opt.img_size *= 2 if len(opt.img_size) == 1 else 1  # expand
     print(opt)
@@ -46,12 +56,26 @@ if __name__ == '__main__':
         print('\nStarting ONNX export with onnx %s...' % onnx.__version__)
         f = opt.weights.replace('.pt', '.onnx')  # filename
         model.fuse()  # only for ONNX
+        output_names = ['classes', 'boxes'] if y is None else ['output'] + ['output%g' % i for i in range(1, len(y))]
         torch.onnx.export(model, img, f, verbose=False, opset_version=12, input_names=['images'],
-                          output_names=['classes', 'boxes'] if y is None else ['output'])
+                          output_names=output_names,
+                          dynamic_axes={k: {0: 'batch'} for k in ['images'] + output_names} if opt.dynamic else None)
 
         # Checks
         onnx_model = onnx.load(f)  # load onnx model
         onnx.checker.check_model(onnx_model)  # check onnx model
+        if opt.nms:
+            from utils.onnx_graph import add_nms
+
+            m = model.model[-1]  # Detect()
+            onnx_model = add_nms(onnx_model, opt.conf_thres, opt.iou_thres, opt.max_det,
+                                 anchors=m.anchor_grid.view(m.nl, -1, 2).numpy(), strides=m.stride.tolist())
+        if opt.uint8_input:
+            from utils.onnx_graph import add_uint8_input
+
+            onnx_model = add_uint8_input(onnx_model, opt.uint8_input)
+        if opt.nms or opt.uint8_input:
+            onnx.save(onnx_model, f)
         print(onnx.helper.printable_graph(onnx_model.graph))  # print a human readable model
         print('ONNX export success, saved as %s' % f)
     except Exception as e:
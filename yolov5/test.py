@@ -18,6 +18,35 @@ from utils.general import (
 from utils.torch_utils import select_device, time_synchronized
 
 
+def match_predictions(pred, tcls, tbox, iouv):
+    """Returns the (n, niou) correct matrix of predictions pred (n,6) [xyxy, conf, cls] against targets of
+    classes tcls (m,) with xyxy boxes tbox (m,4) in the same pixels, at each IoU threshold of iouv"""
+    correct = torch.zeros(pred.shape[0], iouv.numel(), dtype=torch.bool, device=pred.device)
+    nl = len(tcls)
+    if nl:
+        detected = []  # target indices
+
+        # Per target class
+        for cls in torch.unique(tcls):
+            ti = (cls == tcls).nonzero(as_tuple=False).view(-1)  # prediction indices
+            pi = (cls == pred[:, 5]).nonzero(as_tuple=False).view(-1)  # target indices
+
+            # Search for detections
+            if pi.shape[0]:
+                # Prediction to target ious
+                ious, i = box_iou(pred[pi, :4], tbox[ti]).max(1)  # best ious, indices
+
+                # Append detections
+                for j in (ious > iouv[0]).nonzero(as_tuple=False):
+                    d = ti[i[j]]  # detected target
+                    if d not in detected:
+                        detected.append(d)
+                        correct[pi[j]] = ious[j] > iouv  # iou_thres is 1xn
+                        if len(detected) == nl:  # all targets already located in image
+                            break
+    return correct
+
+
 def test(data,
          weights=None,
          batch_size=16,
@@ -151,33 +180,8 @@ def test(data,
                                   'bbox': [round(x, 3) for x in b],
                                   'score': round(p[4], 5)})
 
-            # Assign all predictions as incorrect
-            correct = torch.zeros(pred.shape[0], niou, dtype=torch.bool, device=device)
-            if nl:
-                detected = []  # target indices
-                tcls_tensor = labels[:, 0]
-
-                # target boxes
-                tbox = xywh2xyxy(labels[:, 1:5]) * whwh
-
-                # Per target class
-                for cls in torch.unique(tcls_tensor):
-                    ti = (cls == tcls_tensor).nonzero(as_tuple=False).view(-1)  # prediction indices
-                    pi = (cls == pred[:, 5]).nonzero(as_tuple=False).view(-1)  # target indices
-
-                    # Search for detections
-                    if pi.shape[0]:
-                        # Prediction to target ious
-                        ious, i = box_iou(pred[pi, :4], tbox[ti]).max(1)  # best ious, indices
-
-                        # Append detections
-                        for j in (ious > iouv[0]).nonzero(as_tuple=False):
-                            d = ti[i[j]]  # detected target
-                            if d not in detected:
-                                detected.append(d)
-                                correct[pi[j]] = ious[j] > iouv  # iou_thres is 1xn
-                                if len(detected) == nl:  # all targets already located in image
-                                    break
+            # Assign all predictions as incorrect, then match them to target boxes
+            correct = match_predictions(pred, labels[:, 0], xywh2xyxy(labels[:, 1:5]) * whwh, iouv)
 
             # Append statistics (correct, conf, pcls, tcls)
             stats.append((correct.cpu(), pred[:, 4].cpu(), pred[:, 5].cpu(), tcls))
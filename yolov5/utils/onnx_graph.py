@@ -0,0 +1,175 @@
+# Graph surgery on exported YOLOv5 ONNX models: uint8 NHWC input, in-graph decoding and NonMaxSuppression
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper, shape_inference
+
+# xywh (n,4) @ XYWH2XYXY = xyxy
+XYWH2XYXY = np.array([[1, 0, 1, 0], [0, 1, 0, 1], [-0.5, 0, 0.5, 0], [0, -0.5, 0, 0.5]], dtype=np.float32)
+
+
+class GraphBuilder:
+    # Adds nodes and constants to a graph with unique names
+    def __init__(self, model, prefix='nms'):
+        self.graph = model.graph
+        self.opset = next(o.version for o in model.opset_import if o.domain in ('', 'ai.onnx'))
+        self.prefix = prefix
+        self.i = 0
+
+    def name(self, base):
+        self.i += 1
+        return '%s/%s_%g' % (self.prefix, base, self.i)
+
+    def const(self, value, dtype=np.float32):
+        name = self.name('const')
+        self.graph.initializer.append(numpy_helper.from_array(np.asarray(value, dtype=dtype), name))
+        return name
+
+    def prepend(self, n):
+        # Move the last n nodes to the front, for nodes that feed the existing graph
+        nodes = list(self.graph.node)
+        del self.graph.node[:]
+        self.graph.node.extend(nodes[-n:] + nodes[:-n])
+
+    def node(self, op, inputs, outputs=1, **attrs):
+        names = [self.name(op.lower()) for _ in range(outputs)] if isinstance(outputs, int) else outputs
+        self.graph.node.append(helper.make_node(op, inputs, names, name=self.name(op), **attrs))
+        return names[0] if len(names) == 1 else names
+
+    def slice(self, x, start, end, axis=-1):
+        return self.node('Slice', [x, self.const([start], np.int64), self.const([end], np.int64),
+                                   self.const([axis], np.int64)])
+
+    def reduce(self, op, x, axis, keepdims=1):
+        if self.opset >= 18:  # axes became an input
+            return self.node(op, [x, self.const([axis], np.int64)], keepdims=keepdims)
+        return self.node(op, [x], axes=[axis], keepdims=keepdims)
+
+
+def output_shape(model, name):
+    # Static dims of a graph output, None for symbolic dims
+    for v in list(model.graph.output) + list(model.graph.value_info):
+        if v.name == name:
+            return [d.dim_value if d.HasField('dim_value') else None for d in v.type.tensor_type.shape.dim]
+    return None
+
+
+def add_uint8_input(model, channels='rgb'):
+    """Replace the float (b,3,h,w) 0-1 RGB input with raw uint8 (b,h,w,3) pixels in channels order ('rgb' or
+    'bgr', e.g. OpenCV frames), so runtimes only resize; cast, channel order, scale and layout run in the graph.
+    The order is stored as metadata input_format."""
+    inp = model.graph.input[0]
+    name, dims = inp.name, list(inp.type.tensor_type.shape.dim)
+    x = name + '/float'
+    for node in model.graph.node:  # existing consumers read the normalized tensor
+        node.input[:] = [x if i == name else i for i in node.input]
+
+    g = GraphBuilder(model, prefix='input')
+    n = len(model.graph.node)
+    y = g.node('Cast', [name], to=TensorProto.FLOAT)
+    if channels == 'bgr':
+        y = g.node('Gather', [y, g.const([2, 1, 0], np.int64)], axis=3)  # BGR -> RGB
+    g.node('Transpose', [g.node('Mul', [y, g.const(1 / 255.0)])], [x], perm=[0, 3, 1, 2])  # 0-255 NHWC -> 0-1 NCHW
+    g.prepend(len(model.graph.node) - n)
+
+    inp.type.tensor_type.elem_type = TensorProto.UINT8
+    nhwc = [onnx.TensorShapeProto.Dimension() for _ in dims]
+    for d, src in zip(nhwc, (dims[0], dims[2], dims[3], dims[1])):
+        d.CopyFrom(src)
+    del inp.type.tensor_type.shape.dim[:]
+    inp.type.tensor_type.shape.dim.extend(nhwc)
+    onnx.helper.set_model_props(model, dict({p.key: p.value for p in model.metadata_props}, input_format=channels))
+    onnx.checker.check_model(model)
+    return model
+
+
+def decode_heads(g, model, heads, anchors, strides):
+    """Raw Detect heads (b,na,ny,nx,no) or (b,na*no,ny,nx) to (b,n,no) xywh in input pixels, as Detect.forward"""
+    anchors = np.asarray(anchors, dtype=np.float32).reshape(len(strides), -1, 2)
+    na = anchors.shape[1]
+    z = []
+    for name in heads:
+        shape = output_shape(model, name)
+        if len(shape) == 4:  # (b,na*no,ny,nx)
+            no, ny, nx = shape[1] // na, shape[2], shape[3]
+            x = g.node('Reshape', [name, g.const([0, na, no, ny, nx], np.int64)])
+            x = g.node('Transpose', [x], perm=[0, 1, 3, 4, 2])
+        else:
+            ny, nx, no = shape[2], shape[3], shape[4]
+            x = name
+        if None in (ny, nx, no):
+            raise ValueError('head %s needs static spatial dims, got %s' % (name, shape))
+        z.append((x, ny, nx, no))
+    # strides follow head resolution: the largest grid has the smallest stride
+    order = sorted(range(len(z)), key=lambda k: -z[k][1] * z[k][2])
+    out = []
+    for rank, k in enumerate(order):
+        x, ny, nx, no = z[k]
+        stride = sorted(strides)[rank]
+        a = anchors[list(strides).index(stride)]
+        xv, yv = np.meshgrid(np.arange(nx), np.arange(ny))
+        grid = np.stack((xv, yv), 2).reshape(1, 1, ny, nx, 2).astype(np.float32)
+        y = g.node('Sigmoid', [x])
+        xy = g.node('Mul', [g.node('Add', [g.node('Mul', [g.slice(y, 0, 2), g.const(2.0)]),
+                                           g.const(grid - 0.5)]), g.const(float(stride))])
+        wh = g.node('Mul', [g.slice(y, 2, 4), g.const(2.0)])
+        wh = g.node('Mul', [g.node('Mul', [wh, wh]), g.const(a.reshape(1, na, 1, 1, 2))])
+        y = g.node('Concat', [xy, wh, g.slice(y, 4, no)], axis=-1)
+        out.append(g.node('Reshape', [y, g.const([0, -1, no], np.int64)]))
+    return g.node('Concat', out, axis=1) if len(out) > 1 else out[0]
+
+
+def add_nms(model, conf_thres=0.25, iou_thres=0.45, max_det=100, anchors=None, strides=(8, 16, 32)):
+    """Append postprocessing to an exported YOLOv5 ONNX model, replacing its outputs with
+
+    detections (K,6) [x1, y1, x2, y2, conf, cls] in input pixels, by descending conf, at most max_det per image
+    batch_index (K,) image of each detection in the batch, e.g. to split batched multi-stream results
+
+    The model may output decoded predictions (b,n,5+nc) or raw Detect heads, which are decoded in the graph with
+    anchors (pixels, shape(nl,na,2)) and strides. As on the host, each box keeps only its best class with
+    conf = obj_conf * cls_conf, and NMS is per class.
+    """
+    model = shape_inference.infer_shapes(model)
+    g = GraphBuilder(model)
+    outputs = [o.name for o in model.graph.output]
+    if len(outputs) == 1 and len(output_shape(model, outputs[0])) == 3:
+        pred = outputs[0]
+    elif anchors is not None:
+        pred = decode_heads(g, model, outputs, anchors, strides)
+    else:
+        raise ValueError('raw head outputs %s need anchors to decode' % outputs)
+
+    xywh, obj, cls = g.slice(pred, 0, 4), g.slice(pred, 4, 5), g.slice(pred, 5, 2 ** 31 - 1)
+    best = g.node('Cast', [g.node('Equal', [cls, g.reduce('ReduceMax', cls, -1)])], to=TensorProto.FLOAT)
+    scores = g.node('Mul', [g.node('Mul', [obj, cls]), best])  # (b,n,nc), zero except the best class
+    scores = g.node('Transpose', [scores], perm=[0, 2, 1])  # (b,nc,n)
+    boxes = g.node('MatMul', [xywh, g.const(XYWH2XYXY)])  # (b,n,4)
+
+    sel = g.node('NonMaxSuppression', [boxes, scores, g.const([max_det], np.int64), g.const([iou_thres]),
+                                       g.const([conf_thres])])  # (K,3) [batch, class, box]
+    b = g.node('Gather', [sel, g.const(0, np.int64)], axis=1)  # (K,)
+    c = g.node('Cast', [g.slice(sel, 1, 2, axis=1)], to=TensorProto.FLOAT)  # (K,1)
+    bi = g.node('Concat', [g.slice(sel, 0, 1, axis=1), g.slice(sel, 2, 3, axis=1)], axis=1)  # (K,2) [batch, box]
+    conf = g.node('GatherND', [scores, sel])  # (K,)
+    det = g.node('Concat', [g.node('GatherND', [boxes, bi]), g.node('Reshape', [conf, g.const([-1, 1], np.int64)]),
+                            c], axis=1)  # (K,6)
+
+    # sort by conf over all classes and images, keep the first max_det of each image
+    k = g.node('Shape', [conf])
+    _, order = g.node('TopK', [conf, k], outputs=2, axis=0, largest=1, sorted=1)
+    column = g.const([-1, 1], np.int64)
+    image = g.node('Reshape', [g.node('Gather', [b, order], axis=0), column])  # (K,1)
+    n = g.node('Reshape', [g.slice(g.node('Shape', [pred]), 0, 1, axis=0), g.const([], np.int64)])  # batch size
+    images = g.node('Range', [g.const(0, np.int64), n, g.const(1, np.int64)])
+    onehot = g.node('Cast', [g.node('Equal', [image, images])], to=TensorProto.INT64)  # (K,b)
+    rank = g.node('GatherElements', [g.node('CumSum', [onehot, g.const(0, np.int64)]), image], axis=1)  # 1-based
+    keep = g.node('NonZero', [g.node('Reshape', [g.node('Less', [rank, g.const(max_det + 1, np.int64)]),
+                                                 g.const([-1], np.int64)])])
+    idx = g.node('Gather', [order, g.node('Reshape', [keep, g.const([-1], np.int64)])], axis=0)
+    g.node('Gather', [det, idx], ['detections'], axis=0)
+    g.node('Gather', [b, idx], ['batch_index'], axis=0)
+
+    del model.graph.output[:]
+    model.graph.output.extend([helper.make_tensor_value_info('detections', TensorProto.FLOAT, ['num_det', 6]),
+                               helper.make_tensor_value_info('batch_index', TensorProto.INT64, ['num_det'])])
+    onnx.checker.check_model(model)
+    return model
@@ -0,0 +1,230 @@
+# Staged frame pipeline: every stage is a worker thread, stages are connected by bounded queues,
+# so end-to-end throughput is bounded by the slowest stage rather than the sum of all stages
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+POLICIES = ('block', 'drop_oldest')
+_END = object()  # end-of-stream marker, never dropped
+
+
+class StageQueue:
+    """Bounded queue between two stages; when full, 'block' waits and 'drop_oldest' discards the oldest item"""
+
+    def __init__(self, maxsize=2, policy='block'):
+        if policy not in POLICIES:
+            raise ValueError('unknown queue policy %s, expected one of %s' % (policy, POLICIES))
+        self.q = queue.Queue(maxsize)
+        self.policy = policy
+        self.dropped = 0
+
+    def __len__(self):
+        return self.q.qsize()
+
+    def put(self, item, stop):
+        if self.policy == 'drop_oldest' and item is not _END:
+            while True:
+                try:
+                    self.q.put_nowait(item)
+                    return True
+                except queue.Full:
+                    try:
+                        self.q.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        while not stop.is_set():
+            try:
+                self.q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, stop):
+        while not stop.is_set():
+            try:
+                return self.q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _END
+
+
+class Stage:
+    """One pipeline step
+
+    fn(item) returns the item for the next stage, a list of items, or None to drop it. The first stage is
+    the source: fn() takes no argument and returns None at end of stream. flush() optionally returns the
+    items a stage still holds when the stream ends. A stage may raise StopIteration to stop the pipeline.
+    """
+
+    def __init__(self, name, fn, flush=None):
+        self.name = name
+        self.fn = fn
+        self.flush = flush
+        self.input = None  # StageQueue, set by Pipeline
+        self.frames = 0
+        self.latency = deque(maxlen=100)  # recent per-item latencies (s)
+
+    def __call__(self, *item):
+        t = time.time()
+        out = self.fn(*item)
+        self.latency.append(time.time() - t)
+        self.frames += 1
+        return out
+
+    def stats(self):
+        lat = np.array(self.latency) * 1000 if self.latency else np.zeros(1)
+        return {'stage': self.name,
+                'frames': self.frames,
+                'latency_ms': float(lat.mean()),
+                'latency_p95_ms': float(np.percentile(lat, 95)),
+                'queue': len(self.input) if self.input is not None else 0,
+                'dropped': self.input.dropped if self.input is not None else 0}
+
+
+class Pipeline:
+    """Run stages concurrently; run() executes the last (sink) stage on the calling thread, e.g. for cv2.imshow"""
+
+    def __init__(self, stages, queue_size=2, policy='block'):
+        self.stages = stages
+        self.stop_event = threading.Event()
+        for s in stages[1:]:
+            s.input = StageQueue(queue_size, policy)
+        self.threads = []
+
+    def _run_stage(self, i):
+        stage, stop = self.stages[i], self.stop_event
+        out = self.stages[i + 1].input if i + 1 < len(self.stages) else None
+
+        def emit(item):
+            if isinstance(item, list):
+                for x in item:
+                    emit(x)
+            elif item is not None and out is not None:
+                out.put(item, stop)
+
+        try:
+            while not stop.is_set():
+                if i == 0:
+                    item = stage()
+                    if item is None:
+                        break
+                    emit(item)
+                else:
+                    item = stage.input.get(stop)
+                    if item is _END:
+                        break
+                    emit(stage(item))
+            if stage.flush and not stop.is_set():
+                emit(stage.flush())
+        except StopIteration:
+            stop.set()
+        except Exception as e:
+            print('Pipeline stage %s error: %s' % (stage.name, e))
+            stop.set()
+            raise
+        finally:
+            if out is not None:
+                out.put(_END, stop)
+
+    def run(self):
+        self.stop_event.clear()
+        self.threads = [threading.Thread(target=self._run_stage, args=(i,), name=s.name, daemon=True)
+                        for i, s in enumerate(self.stages[:-1])]
+        for t in self.threads:
+            t.start()
+        try:
+            self._run_stage(len(self.stages) - 1)
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.stop_event.set()
+        for t in self.threads:
+            if t is not threading.current_thread():
+                t.join()
+
+    def stats(self):
+        return [s.stats() for s in self.stages]
+
+    def report(self):
+        return ' | '.join('%s %.1fms q=%g drop=%g' % (s['stage'], s['latency_ms'], s['queue'], s['dropped'])
+                          for s in self.stats())
+
+
+class LatencyController:
+    """Shed load at the source to keep p95 capture-to-result latency under a target
+
+    Call admit() for every captured frame and observe(latency) for every frame that reaches the sink. Every
+    `window` observations the controller compares their p95 with target: above it, the number of frames
+    skipped between admitted frames is doubled (up to max_skip); below `low` * target it is decreased by one.
+    Frames already in flight at an adjustment are not counted towards the next window.
+    Frames should still be read when they are not admitted, so capture buffers never fill.
+    """
+
+    def __init__(self, target, max_skip=30, window=20, low=0.5):
+        self.target = target  # s
+        self.max_skip = max_skip
+        self.window = window
+        self.low = low
+        self.skip = 0  # frames skipped after each admitted frame
+        self.samples = []
+        self.recent = deque(maxlen=100)  # recent latencies (s), for stats()
+        self.p95 = 0.0  # p95 latency of the last full window (s)
+        self.countdown = 0
+        self.settle = 0  # observations to ignore after an adjustment
+        self.observed = 0
+        self.admitted = 0
+        self.shed = 0
+        self.adjustments = 0
+
+    def admit(self):
+        if self.countdown > 0:
+            self.countdown -= 1
+            self.shed += 1
+            return False
+        self.countdown = self.skip
+        self.admitted += 1
+        return True
+
+    def observe(self, latency):
+        self.observed += 1
+        self.recent.append(latency)
+        if self.settle > 0:
+            self.settle -= 1
+            return
+        self.samples.append(latency)
+        if len(self.samples) < self.window:
+            return
+        self.p95 = float(np.percentile(self.samples, 95))
+        self.samples = []
+        skip = self.skip
+        if self.p95 > self.target:
+            skip = min(max(2 * skip, 1), self.max_skip)
+        elif self.p95 < self.low * self.target:
+            skip = max(skip - 1, 0)
+        if skip != self.skip:
+            self.skip = skip
+            self.adjustments += 1
+            self.settle = self.admitted - self.observed
+
+    def stats(self):
+        lat = np.array(self.recent) * 1000 if self.recent else np.zeros(1)
+        total = self.admitted + self.shed
+        return {'target_ms': self.target * 1000,
+                'latency_ms': float(lat.mean()),
+                'latency_p95_ms': float(np.percentile(lat, 95)),
+                'skip': self.skip,
+                'admitted': self.admitted,
+                'shed': self.shed,
+                'shed_ratio': self.shed / total if total else 0.0,
+                'adjustments': self.adjustments}
+
+    def report(self):
+        s = self.stats()
+        return 'latency p95 %.0fms (target %.0fms) skip=%g shed %g/%g' % (
+            s['latency_p95_ms'], s['target_ms'], s['skip'], s['shed'], s['admitted'] + s['shed'])
@@ -1,8 +1,12 @@
+import hashlib
+import json
 import math
 import os
+import platform
 import time
 import logging
 from copy import deepcopy
+from pathlib import Path
 
 import torch
 import torch.backends.cudnn as cudnn
@@ -12,6 +16,8 @@ import torchvision.models as models
 
 logger = logging.getLogger(__name__)
 
+TORCHSCRIPT_CACHE = Path.home() / '.cache' / 'fire-detect' / 'torchscript'
+
 def init_seeds(seed=0):
     torch.manual_seed(seed)
 
@@ -56,6 +62,50 @@ def time_synchronized():
     return time.time()
 
 
+def file_hash(path, chunk=1 << 20):
+    # SHA-256 of a file, first 16 hex digits
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+def load_compiled(weights, shape=(1, 3, 640, 640), device=torch.device('cpu'), half=False, cache_dir=TORCHSCRIPT_CACHE):
+    """Returns (model, names, cache) with model a frozen TorchScript trace of the fused weights for inputs of shape
+
+    The trace is cached under cache_dir keyed by weights hash, input shape, device, precision, torch version and
+    machine. A cache hit loads it without importing the model definitions (models/); cache is 'hit' or 'miss'.
+    """
+    from utils.google_utils import attempt_download
+    attempt_download(weights)
+    key = '%s-%s-%s-%s-torch%s-%s' % (file_hash(weights), 'x'.join('%g' % x for x in shape), device.type,
+                                       'fp16' if half else 'fp32', torch.__version__, platform.machine())
+    f = Path(cache_dir) / ('%s-%s.torchscript.pt' % (Path(weights).stem, key))
+    if f.exists():
+        extra = {'meta.json': ''}
+        try:
+            model = torch.jit.load(str(f), map_location=device, _extra_files=extra)
+            return model, json.loads(extra['meta.json'])['names'], 'hit'
+        except Exception as e:
+            logger.info('TorchScript cache %s unusable (%s), recompiling' % (f, e))
+
+    from models.experimental import attempt_load  # model definitions only needed to trace
+    model = attempt_load(weights, map_location=device)  # fused FP32 model
+    if half:
+        model.half()
+    img = torch.zeros(shape, device=device)
+    with torch.no_grad():
+        ts = torch.jit.trace(model, img.half() if half else img, strict=False)
+        ts = torch.jit.freeze(ts.eval()) if hasattr(torch.jit, 'freeze') else ts  # fold weights and attributes
+    names = list(model.names)
+    f.parent.mkdir(parents=True, exist_ok=True)
+    tmp = f.with_name('%s.%d.tmp' % (f.name, os.getpid()))  # concurrent runs never load a partial file
+    torch.jit.save(ts, str(tmp), _extra_files={'meta.json': json.dumps({'names': names})})
+    os.replace(tmp, f)
+    return ts, names, 'miss'
+
+
 def is_parallel(model):
     return type(model) in (nn.parallel.DataParallel, nn.parallel.DistributedDataParallel)
 